@@ -9,16 +9,28 @@ calculates weight and assigns grades, and saves the results to CSV files
 and annotated images to an output directory.
 """
 
-from collections import defaultdict
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import hashlib
+import json
+import multiprocessing
 import os
+import pickle
+import queue
 import random
-from time import sleep
+import resource
+import shutil
+import threading
 import cv2
 import numpy as np
 import pandas as pd
 import torch
+from PIL import Image
 from detectron2.config import get_cfg
 from detectron2.engine import DefaultPredictor
+from detectron2.layers.mask_ops import _do_paste_mask
+from detectron2.structures import Boxes, Instances
 
 # ==============================================================================
 # --- Configuration & Constants ---
@@ -52,6 +64,77 @@ IMG_SUFFIXES = ('png', 'jpg', 'jpeg', 'tiff', 'tif') # Added 'tif' for completen
 DEFAULT_OUTPUT_SCALE = 1.0 # Scale for output images
 DEFAULT_CONTOUR_THICKNESS = 10 # Thickness for drawing contours
 DEFAULT_BORDER_FILTER_PIXELS = 0 # Pixels from border to ignore detections
+MASK_CROP_PADDING = 2 # Pixels kept around each predicted box when cropping its mask
+MASK_THRESHOLD = 0.5  # Mask probability at which a pixel belongs to the object
+# Keep masks at ROI resolution and paste them one at a time into their box,
+# instead of materializing the full N x H x W mask stack per image
+DEFAULT_LOW_MEMORY_MASKS = True
+
+# --- Early Rejection ---
+# Cheap gates on scores, boxes and mask pixel counts applied before any
+# contour work. Defaults only drop objects the contour stage would reject anyway.
+FILTER_CONF = {
+    "MIN_SCORE": 0.0,      # Extra confidence gate on top of SCORE_THRESH_TEST
+    "MIN_BOX_AREA": 0,     # Smallest predicted box area (px^2) worth measuring
+    "MAX_BOX_AREA": None,  # Largest predicted box area (px^2), None for no limit
+    "MIN_MASK_PIXELS": 10  # A mask with fewer pixels cannot reach contour area 10
+}
+MIN_CONTOUR_AREA = 10 # Contours smaller than this (px^2) are discarded
+
+# --- Tiled Inference ---
+# Large frames can be split into overlapping tiles that are each run at the
+# model's test resolution, so small objects are not lost to downscaling.
+DEFAULT_TILE_SIZE = 0       # Tile edge in pixels; 0 disables tiling
+DEFAULT_TILE_OVERLAP = 256  # Overlap between neighbouring tiles; should exceed the largest object
+TILE_MERGE_OVERLAP = 0.5    # Intersection over the smaller mask at which tile detections are merged
+TILE_MERGE_GRID = 256       # Cell edge of the grid that limits merging to nearby detections
+
+# --- Decode-Time Downscaling ---
+# The model resizes every input so its short side is MIN_SIZE_TEST, so JPEGs
+# at least twice that size are decoded at 1/2, 1/4 or 1/8 scale by libjpeg
+# (never below MIN_SIZE_TEST) and detections are mapped back to original pixels.
+MIN_SIZE_TEST = 800               # cfg.INPUT.MIN_SIZE_TEST of the predictor
+DEFAULT_DECODE_DOWNSCALE = True   # Disabled automatically for tiled inference
+MAX_DECODE_FACTOR = 8
+REDUCED_DECODE_SUFFIXES = ('.jpg', '.jpeg') # Formats whose decoder can scale while decoding
+_REDUCED_COLOR_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4,
+                        8: cv2.IMREAD_REDUCED_COLOR_8}
+
+# --- Output Rendering ---
+# Encoding of the annotated images: "FORMAT" is "jpeg", "webp" or "png";
+# "QUALITY" (0-100) applies to JPEG and WebP, "PNG_COMPRESSION" (0-9) to PNG.
+# A thumbnail with its longest edge at THUMBNAIL_SIZE (0 disables them) is
+# written next to every annotated image. With "LAZY", runs only store each
+# image's contours and the annotated image is drawn on first request.
+# WebP files are about a third the size of JPEG but take over ten times longer to encode.
+OUTPUT_CONF = {
+    "FORMAT": "jpeg",
+    "QUALITY": 90,
+    "PNG_COMPRESSION": 3,
+    "THUMBNAIL_SIZE": 320,
+    "THUMBNAIL_QUALITY": 75,
+    "LAZY": False
+}
+OUTPUT_EXTENSIONS = {"jpeg": (".jpg", ".jpeg"), "webp": (".webp",), "png": (".png",)}
+THUMBNAIL_DIRNAME = "thumbnails" # Subdirectory of the output directory holding thumbnails
+PENDING_DIRNAME = ".pending"     # Subdirectory holding annotations not drawn yet
+
+# --- Parallelism ---
+DEFAULT_NUM_WORKERS = 1 # Inference processes; >1 enables the multi-process pool
+DEFAULT_BATCH_SIZE = 1  # Images per forward pass
+PREFETCH_DEPTH = 2      # Decoded batches buffered ahead of inference
+WRITER_QUEUE_DEPTH = 4  # Annotated images buffered ahead of the writer thread
+
+# --- Result Cache ---
+# Per-image results keyed by image content and model/config fingerprint, so
+# re-uploaded images skip inference entirely
+DEFAULT_CACHE_MAX_BYTES = 2 * 1024**3 # Size bound of the cache directory before LRU eviction
+HASH_CHUNK_BYTES = 1024**2            # Read size when hashing files
+
+# --- Incremental Processing ---
+# Processed files (path, size, mtime, hash) and their results, kept in the
+# output directory so unchanged images are not run again
+MANIFEST_FILENAME = "processing_manifest.json"
 
 # --- Physical Conversion Constants ---
 # Used for calculating real-world dimensions and weight
@@ -62,6 +145,25 @@ FUDGE_FACTOR = 1.5          # Adjusts area in weight calculation
 # --- Utility Functions ---
 # ==============================================================================
 
+def reset_peak_rss():
+    """Resets the process peak RSS (VmHWM) where the kernel allows it."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass # Not Linux or not permitted; peak_rss_mb falls back to the lifetime peak
+
+def peak_rss_mb():
+    """Returns the peak resident set size of this process in MB."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # KB on Linux
+
 def check_cuda():
     """Checks CUDA availability and prints status."""
     if torch.cuda.is_available():
@@ -113,7 +215,7 @@ def extract_contour_dimensions(cnt):
     """Extracts various geometric properties from a single contour."""
     res = {}
     res['area'] = area = cv2.contourArea(cnt)
-    if area < 10: # Filter out very small contours early
+    if area < MIN_CONTOUR_AREA: # Filter out very small contours early
         return None
 
     perimeter = cv2.arcLength(cnt, True)
@@ -145,8 +247,8 @@ def extract_contour_dimensions(cnt):
                                if perimeter > 0 and hull_cnt_area > 0 else 0)
     return res
 
-def initialize_predictor(device):
-    """Initializes and returns the Detectron2 DefaultPredictor."""
+def build_predictor_config(device):
+    """Builds the Detectron2 config used by every predictor in this pipeline."""
     cfg = get_cfg()
     cfg.merge_from_file(DETECTRON2_CONFIG_PATH)
     cfg.DATALOADER.NUM_WORKERS = MODEL_CONF["NUM_WORKERS"]
@@ -155,126 +257,857 @@ def initialize_predictor(device):
     cfg.MODEL.WEIGHTS = MODEL_WEIGHTS_PATH
     cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST = MODEL_CONF["SCORE_THRESH_TEST"]
     cfg.TEST.DETECTIONS_PER_IMAGE = MODEL_CONF["DETECTIONS_PER_IMAGE"]
-    
+    cfg.INPUT.MIN_SIZE_TEST = MIN_SIZE_TEST
+    return cfg
+
+class BatchPredictor(DefaultPredictor):
+    """
+    DefaultPredictor that can also run the model on several images in a
+    single forward pass, amortizing the backbone/FPN cost over the batch.
+    Calling it with one image behaves exactly like DefaultPredictor.
+
+    With low_memory_masks, predict_batch leaves masks at ROI resolution in a
+    "mask_probs" field instead of pasting every mask into a full-size
+    "pred_masks" stack; iter_mask_crops pastes them one by one on demand.
+    """
+
+    def __init__(self, cfg, low_memory_masks=DEFAULT_LOW_MEMORY_MASKS):
+        super().__init__(cfg)
+        self.low_memory_masks = low_memory_masks
+
+    def predict_batch(self, original_images):
+        """
+        Runs inference on a list of BGR images.
+        Returns one output dict (with an "instances" key) per image.
+        """
+        with torch.no_grad():
+            inputs = []
+            for original_image in original_images:
+                if self.input_format == "RGB":
+                    original_image = original_image[:, :, ::-1]
+                height, width = original_image.shape[:2]
+                image = self.aug.get_transform(original_image).apply_image(original_image)
+                image = torch.as_tensor(image.astype("float32").transpose(2, 0, 1))
+                image = image.to(self.cfg.MODEL.DEVICE)
+                inputs.append({"image": image, "height": height, "width": width})
+
+            if not self.low_memory_masks:
+                return self.model(inputs)
+
+            results = self.model.inference(inputs, do_postprocess=False)
+            return [{"instances": self._postprocess_lazy(result, inp["height"], inp["width"])}
+                    for result, inp in zip(results, inputs)]
+
+    @staticmethod
+    def _postprocess_lazy(results, output_height, output_width):
+        """
+        Same as detectron2's detector_postprocess, except that masks are left
+        unpasted: boxes are rescaled to the original image and the ROI mask
+        probabilities are kept as "mask_probs".
+        """
+        scale_x = output_width / results.image_size[1]
+        scale_y = output_height / results.image_size[0]
+        results = Instances((output_height, output_width), **results.get_fields())
+
+        output_boxes = results.pred_boxes
+        output_boxes.scale(scale_x, scale_y)
+        output_boxes.clip(results.image_size)
+        results = results[output_boxes.nonempty()]
+
+        if results.has("pred_masks"):
+            results.mask_probs = results.pred_masks[:, 0, :, :]
+            results.remove("pred_masks")
+        return results
+
+def create_predictor(device, low_memory_masks=DEFAULT_LOW_MEMORY_MASKS):
+    """Creates a Detectron2 BatchPredictor, raising on failure."""
+    predictor = BatchPredictor(build_predictor_config(device), low_memory_masks)
+    print("Detectron2 predictor initialized successfully.")
+    return predictor
+
+def initialize_predictor(device):
+    """Initializes and returns the Detectron2 predictor."""
     try:
-        predictor = DefaultPredictor(cfg)
-        print("Detectron2 predictor initialized successfully.")
-        return predictor
+        return create_predictor(device)
     except Exception as e:
         print(f"Error initializing DefaultPredictor: {e}")
         print("Please ensure Detectron2 is installed correctly and model paths are valid.")
         exit(1) # Exit if predictor fails to initialize
 
+# ==============================================================================
+# --- Image Loading ---
+# ==============================================================================
+
+def decode_factor(short_side, min_size=MIN_SIZE_TEST, max_factor=MAX_DECODE_FACTOR):
+    """
+    Returns the largest power-of-two reduction (up to max_factor) that keeps
+    the short side at or above min_size; 1 for images under 2 * min_size.
+    """
+    factor = 1
+    while factor < max_factor and short_side >= 2 * factor * min_size:
+        factor *= 2
+    return factor
+
+def load_image(fullpath, downscale=DEFAULT_DECODE_DOWNSCALE):
+    """
+    Decodes an image, at reduced scale when downscale is set and the format
+    supports it. Returns (image, scale) where scale is the factor that maps
+    the decoded image's pixels back to the original's, or (None, 1) if the
+    image cannot be read.
+    """
+    factor = 1
+    if downscale and fullpath.lower().endswith(REDUCED_DECODE_SUFFIXES):
+        try:
+            with Image.open(fullpath) as header: # Reads the header only
+                factor = decode_factor(min(header.size))
+        except Exception:
+            factor = 1 # Let cv2 report unreadable files
+    if factor == 1:
+        return cv2.imread(fullpath), 1
+    return cv2.imread(fullpath, _REDUCED_COLOR_FLAGS[factor]), factor
+
 # ==============================================================================
 # --- Core Image Processing Function ---
 # ==============================================================================
 
-def process_image_features(predictor, img, img_base_name, current_csv_row_start_index,
-                           output_scale=DEFAULT_OUTPUT_SCALE,
-                           contour_thickness=DEFAULT_CONTOUR_THICKNESS,
-                           border_filter_pixels=DEFAULT_BORDER_FILTER_PIXELS):
+def mask_crop_bounds(boxes, image_shape, padding=MASK_CROP_PADDING):
     """
-    Performs inference on an image, extracts features from detected objects,
-    draws detections, and returns a DataFrame of features.
+    Computes integer (x0, y0, x1, y1) crop windows for all predicted boxes at
+    once, padded so that every mask pixel and a ring of background around it
+    fall inside the window.
     """
-    if border_filter_pixels < 0:
-        raise ValueError("Border filter width cannot be less than 0.")
+    height, width = image_shape[:2]
+    bounds = np.empty((len(boxes), 4), dtype=np.int64)
+    bounds[:, :2] = np.floor(boxes[:, :2]) - padding
+    bounds[:, 2:] = np.ceil(boxes[:, 2:]) + padding
+    bounds[:, 0::2] = np.clip(bounds[:, 0::2], 0, width)
+    bounds[:, 1::2] = np.clip(bounds[:, 1::2], 0, height)
+    return bounds
 
-    height, width = img.shape[:2]
-    filter_array = None
-    if border_filter_pixels > 0:
-        filter_array = np.ones((height, width), dtype=np.uint8)
-        filter_array[border_filter_pixels : height - border_filter_pixels,
-                     border_filter_pixels : width - border_filter_pixels] = 0
+def iter_mask_crops(predictions, image_shape, indices=None, scale=1):
+    """
+    Yields (mask_idx, mask_crop, (x0, y0)) for every predicted mask (or only
+    those in indices), with the
+    mask cropped to its predicted box. Detectron2 only pastes mask pixels
+    within one pixel of the box, so the crop holds the whole mask.
 
-    outputs = predictor(img)
-    predictions = outputs["instances"].to("cpu")
-    masks = predictions.get("pred_masks").numpy().astype(np.uint8) * 255
+    Low-memory predictions ("mask_probs") are pasted into their box one mask
+    at a time, exactly as detectron2 does on the CPU, so only one box-sized
+    mask is alive at once. Tiled predictions already carry their cropped
+    masks ("mask_crops").
 
-    extracted_data = defaultdict(list)
-    img_to_draw_on = img.copy()
-    detected_object_count = 0
-    next_csv_row_to_assign = current_csv_row_start_index #initialize a variabel to manage csv row numbers for this image objects
+    For predictions on an image decoded at reduced scale, crops and offsets
+    are in original pixels: ROI masks are pasted into the scaled-up box, as
+    a full-resolution decode would have, and full-size masks are upsampled.
+    """
+    if predictions.has("mask_crops"):
+        mask_crops = predictions.get("mask_crops")
+        for mask_idx in (range(len(mask_crops)) if indices is None else indices):
+            mask_crop, offset = mask_crops[mask_idx]
+            yield mask_idx, *_upscale_crop(mask_crop, offset, scale)
+        return
+
+    if predictions.has("mask_probs"):
+        height, width = image_shape[:2]
+        mask_probs = predictions.get("mask_probs")
+        boxes = predictions.get("pred_boxes").tensor * scale
+        for mask_idx in (range(len(mask_probs)) if indices is None else indices):
+            pasted, (rows, cols) = _do_paste_mask(mask_probs[mask_idx:mask_idx + 1, None],
+                                                  boxes[mask_idx:mask_idx + 1],
+                                                  height * scale, width * scale, skip_empty=True)
+            yield mask_idx, (pasted[0] >= MASK_THRESHOLD).numpy(), (cols.start, rows.start)
+        return
+
+    masks = predictions.get("pred_masks").numpy() # bool N x H x W, no copy
+    if predictions.has("pred_boxes"):
+        bounds = mask_crop_bounds(predictions.get("pred_boxes").tensor.numpy(), image_shape)
+    else:
+        height, width = image_shape[:2]
+        bounds = np.tile(np.array([0, 0, width, height], dtype=np.int64), (len(masks), 1))
+
+    for mask_idx in (range(len(masks)) if indices is None else indices):
+        x0, y0, x1, y1 = bounds[mask_idx]
+        yield mask_idx, *_upscale_crop(masks[mask_idx, y0:y1, x0:x1], (int(x0), int(y0)), scale)
+
+def _upscale_crop(mask_crop, offset, scale):
+    """Upsamples a binary mask crop and its offset by scale, smoothing the staircase edges."""
+    if scale == 1 or mask_crop.size == 0:
+        return mask_crop, offset
+    height, width = mask_crop.shape
+    upscaled = cv2.resize(np.ascontiguousarray(mask_crop).view(np.uint8) * np.uint8(255),
+                          (width * scale, height * scale), interpolation=cv2.INTER_LINEAR)
+    return upscaled >= 128, (offset[0] * scale, offset[1] * scale)
+
+def find_main_contour(mask_crop, offset):
+    """
+    Returns the largest contour of a (cropped) mask in full-image
+    coordinates, or None if the mask is empty.
+    """
+    mask = np.ascontiguousarray(mask_crop).view(np.uint8)
+    contours, _ = cv2.findContours(mask, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE, offset=offset)
+    if not contours:
+        return None
+
+    # If a single mask yields multiple contours, take the largest one
+    if len(contours) == 1:
+        return contours[0]
+    return max(contours, key=cv2.contourArea)
+
+def prefilter_predictions(predictions, filter_conf=FILTER_CONF, rejections=None, scale=1):
+    """
+    Applies the score and box-area gates to all predictions at once.
+    Returns the indices that survive, counting rejections per stage.
+    Box areas are compared in original pixels, scale per decoded pixel.
+    """
+    count = len(predictions)
+    keep = np.ones(count, dtype=bool)
+    if count == 0:
+        return np.flatnonzero(keep)
+
+    stages = []
+    if filter_conf["MIN_SCORE"] > 0 and predictions.has("scores"):
+        stages.append(("score", predictions.get("scores").numpy() >= filter_conf["MIN_SCORE"]))
+
+    if predictions.has("pred_boxes"):
+        boxes = predictions.get("pred_boxes").tensor.numpy()
+        box_areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]) * scale**2
+        box_ok = box_areas >= filter_conf["MIN_BOX_AREA"]
+        if filter_conf["MAX_BOX_AREA"] is not None:
+            box_ok &= box_areas <= filter_conf["MAX_BOX_AREA"]
+        stages.append(("box_area", box_ok))
 
-    for mask_idx, mask in enumerate(masks):
-        contours, _ = cv2.findContours(mask, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
-        if not contours:
+    for stage, stage_ok in stages:
+        rejected = int(np.count_nonzero(keep & ~stage_ok))
+        if rejections is not None and rejected:
+            rejections[stage] += rejected
+        keep &= stage_ok
+
+    return np.flatnonzero(keep)
+
+def touches_border(dims, image_shape, border_filter_pixels):
+    """
+    Checks whether a contour reaches the border band using its bounding box:
+    a filled contour touches the band exactly when its bounding box does.
+    """
+    height, width = image_shape[:2]
+    return (dims['top_left_x'] < border_filter_pixels
+            or dims['top_left_y'] < border_filter_pixels
+            or dims['bottom_right_x'] > width - border_filter_pixels
+            or dims['bottom_right_y'] > height - border_filter_pixels)
+
+def extract_detections(predictions, image_shape,
+                       border_filter_pixels=DEFAULT_BORDER_FILTER_PIXELS,
+                       filter_conf=FILTER_CONF, rejections=None, scale=1):
+    """
+    Extracts the main contour and its dimensions for every predicted mask.
+    Returns a list of dicts with 'mask_idx', 'contour' and 'dims' keys.
+
+    Predictions are gated cheapest-first (score, box area, mask pixel count,
+    contour area, border); if rejections is given (a Counter) the number of
+    objects dropped at each stage is added to it.
+
+    For an image decoded at reduced scale (see load_image), image_shape is
+    the decoded shape; masks are mapped back to original pixels before
+    their contours are measured, so dimensions and gates are in original pixels.
+    """
+    if border_filter_pixels < 0:
+        raise ValueError("Border filter width cannot be less than 0.")
+    if rejections is None:
+        rejections = Counter()
+
+    indices = prefilter_predictions(predictions, filter_conf, rejections, scale)
+    original_shape = (image_shape[0] * scale, image_shape[1] * scale)
+
+    detections = []
+    for mask_idx, mask_crop, offset in iter_mask_crops(predictions, image_shape, indices, scale):
+        if np.count_nonzero(mask_crop) < max(filter_conf["MIN_MASK_PIXELS"], 1):
+            rejections["mask_pixels"] += 1
             continue
 
-        # If a single mask yields multiple contours, take the largest one
-        main_contour = max(contours, key=cv2.contourArea)
+        main_contour = find_main_contour(mask_crop, offset)
+        if main_contour is None:
+            rejections["mask_pixels"] += 1
+            continue
 
         dims = extract_contour_dimensions(main_contour)
-        if dims is None: # Skips if area < 10 (handled in extract_contour_dimensions)
+        if dims is None: # Skips if area < MIN_CONTOUR_AREA (handled in extract_contour_dimensions)
+            rejections["contour_area"] += 1
             continue
 
-        # Border filtering: check if any part of the contour is in the border region
-        if border_filter_pixels > 0 and filter_array is not None:
-            temp_contour_mask = np.zeros(mask.shape[:2], dtype=np.uint8)
-            cv2.drawContours(temp_contour_mask, [main_contour], -1, 255, -1)
-            if np.any(np.logical_and(temp_contour_mask, filter_array)):
-                continue # Skip this contour as it touches the border
+        # Border filtering: skip contours reaching into the border region
+        if border_filter_pixels > 0 and touches_border(dims, original_shape, border_filter_pixels):
+            rejections["border"] += 1
+            continue
 
-        cv2.drawContours(img_to_draw_on, [main_contour], -1,
-                         random_saturated_color(), contour_thickness)
-        
-        #--- Draw the CSV row number on the image ---
-        center_x, center_y = dims['center']
-        draw_text_centered(img_to_draw_on, str(next_csv_row_to_assign + 1),
-                           (center_x, center_y),
-                           fontScale=1,  # Adjusted for visibility as an ID
-                           thickness=2,  # Adjusted for visibility
-                           bg_color=(255, 255, 255), # Ensuring background for text
-                           text_color=(0, 0, 0))     # Ensuring text color
-        
-        detected_object_count += 1
+        detections.append({'mask_idx': mask_idx, 'contour': main_contour, 'dims': dims})
+
+    return detections
+
+def predict_images(predictor, images):
+    """
+    Runs inference on a list of images, batched when the predictor supports it.
+    Returns the per-image predicted Instances on the CPU.
+    """
+    if hasattr(predictor, "predict_batch"):
+        outputs = predictor.predict_batch(images)
+    else:
+        outputs = [predictor(img) for img in images]
+    return [output["instances"].to("cpu") for output in outputs]
+
+def detect_objects_batch(predictor, images, border_filter_pixels=DEFAULT_BORDER_FILTER_PIXELS,
+                         rejections=None, scales=None):
+    """
+    Performs batched inference and returns the filtered detections of each
+    image. scales gives each image's decode scale (see load_image); the
+    detections are always in original pixel coordinates.
+    """
+    scales = scales or [1] * len(images)
+    return [extract_detections(predictions, img.shape, border_filter_pixels, rejections=rejections, scale=scale)
+            for img, scale, predictions in zip(images, scales, predict_images(predictor, images))]
+
+def detect_objects(predictor, img, border_filter_pixels=DEFAULT_BORDER_FILTER_PIXELS):
+    """Performs inference on an image and returns its filtered detections."""
+    return detect_objects_batch(predictor, [img], border_filter_pixels)[0]
+
+def detections_to_dataframe(detections, img_base_name):
+    """Builds the per-image feature DataFrame from a list of detections."""
+    extracted_data = defaultdict(list)
+    for detection in detections:
         extracted_data['image_name'].append(img_base_name)
-        extracted_data['object_id_in_image'].append(mask_idx) # Unique ID for object in this image
-        for key, value in dims.items():
+        extracted_data['object_id_in_image'].append(detection['mask_idx']) # Unique ID for object in this image
+        for key, value in detection['dims'].items():
             # Adjust column names for clarity
             if key == 'area': extracted_data['area_px2'].append(value)
             elif key == 'width': extracted_data['width_px'].append(value)
             elif key == 'length': extracted_data['length_px'].append(value)
             elif key == 'volume': extracted_data['volume_px3'].append(value)
             else: extracted_data[key].append(value)
-        
-        next_csv_row_to_assign += 1 # increment the csv row number for the next object
 
     df = pd.DataFrame(extracted_data)
     if not df.empty:
         df.index.name = 'detection_index'
+    return df
+
+def reported_name(f_name, image_names=None):
+    """Name an image's results and annotated output go by: its entry in image_names, else its filename."""
+    return (image_names or {}).get(f_name, os.path.basename(f_name))
+
+def annotated_filename(img_basename, output_conf=OUTPUT_CONF):
+    """
+    Name of an image's annotated output: masked_ plus the image's name, in an
+    extension of the output format. An image of another format keeps its own
+    extension before the output one (masked_x.png.jpg), so x.png and x.jpg
+    do not overwrite each other's output.
+    """
+    ext = os.path.splitext(img_basename)[1]
+    extensions = OUTPUT_EXTENSIONS[output_conf["FORMAT"]]
+    if ext.lower() in extensions:
+        return f"masked_{img_basename}"
+    return f"masked_{img_basename}{extensions[0]}"
+
+def thumbnail_path(output_filename):
+    """Path of the thumbnail written alongside an annotated image."""
+    output_dir, name = os.path.split(output_filename)
+    return os.path.join(output_dir, THUMBNAIL_DIRNAME, name)
+
+def encode_params(output_conf=OUTPUT_CONF, thumbnail=False):
+    """cv2.imwrite parameters of the output format."""
+    quality = output_conf["THUMBNAIL_QUALITY"] if thumbnail else output_conf["QUALITY"]
+    if output_conf["FORMAT"] == "jpeg":
+        return [cv2.IMWRITE_JPEG_QUALITY, quality]
+    if output_conf["FORMAT"] == "webp":
+        return [cv2.IMWRITE_WEBP_QUALITY, quality]
+    if output_conf["FORMAT"] == "png":
+        return [cv2.IMWRITE_PNG_COMPRESSION, output_conf["PNG_COMPRESSION"]]
+    raise ValueError(f"Unknown output format: {output_conf['FORMAT']}")
+
+def output_encoding(output_filename, output_scale=DEFAULT_OUTPUT_SCALE, output_conf=OUTPUT_CONF):
+    """Settings an annotated image was encoded with, to tell whether a cached copy can be reused."""
+    return [os.path.splitext(output_filename)[1].lower(), output_scale, output_conf["FORMAT"],
+            output_conf["QUALITY"], output_conf["PNG_COMPRESSION"],
+            output_conf["THUMBNAIL_SIZE"], output_conf["THUMBNAIL_QUALITY"]]
+
+def write_image(path, img, params):
+    """Encodes and writes an image atomically, so readers never see a partial file."""
+    ok, encoded = cv2.imencode(os.path.splitext(path)[1], img, params)
+    if not ok:
+        raise ValueError(f"Could not encode {path}")
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(encoded.tobytes())
+    os.replace(tmp_path, path)
+
+def write_thumbnail(img, output_filename, output_conf=OUTPUT_CONF):
+    """Writes the thumbnail of an annotated image, unless thumbnails are disabled."""
+    size = output_conf["THUMBNAIL_SIZE"]
+    if not size:
+        return
+    h, w = img.shape[:2]
+    factor = min(size / max(h, w), 1.0)
+    # Subsample to about twice the thumbnail size first: INTER_AREA over a
+    # whole frame costs more than encoding it
+    step = max(1, int(1 / factor) // 2)
+    thumbnail = cv2.resize(img[::step, ::step], (max(1, int(w * factor)), max(1, int(h * factor))),
+                           interpolation=cv2.INTER_AREA)
+    os.makedirs(os.path.join(os.path.dirname(output_filename), THUMBNAIL_DIRNAME), exist_ok=True)
+    write_image(thumbnail_path(output_filename), thumbnail, encode_params(output_conf, thumbnail=True))
+
+def render_detections(img, detections, current_csv_row_start_index, output_filename,
+                      output_scale=DEFAULT_OUTPUT_SCALE,
+                      contour_thickness=DEFAULT_CONTOUR_THICKNESS, image_scale=1,
+                      output_conf=OUTPUT_CONF, in_place=False):
+    """
+    Draws detections labelled with their CSV row numbers and writes the
+    annotated image and its thumbnail. Returns the next CSV row number to assign.
+
+    img may be a reduced-scale decode (image_scale original pixels per
+    pixel); detections are drawn into it and the output keeps its size.
+    With in_place, img is drawn on directly instead of on a copy.
+    """
+    img_to_draw_on = img if in_place else img.copy()
+    next_csv_row_to_assign = current_csv_row_start_index #initialize a variabel to manage csv row numbers for this image objects
+
+    for detection in detections:
+        contour = detection['contour'] if image_scale == 1 else detection['contour'] // image_scale
+        cv2.drawContours(img_to_draw_on, [contour], -1,
+                         random_saturated_color(), contour_thickness)
+        
+        #--- Draw the CSV row number on the image ---
+        center_x, center_y = (coordinate // image_scale for coordinate in detection['dims']['center'])
+        draw_text_centered(img_to_draw_on, str(next_csv_row_to_assign + 1),
+                           (center_x, center_y),
+                           fontScale=1,  # Adjusted for visibility as an ID
+                           thickness=2,  # Adjusted for visibility
+                           bg_color=(255, 255, 255), # Ensuring background for text
+                           text_color=(0, 0, 0))     # Ensuring text color
+        
+        next_csv_row_to_assign += 1 # increment the csv row number for the next object
 
-    # Save the output image with detections
-    output_filename = os.path.join(OUTPUT_PATH, f"masked_{img_base_name}")
     if output_scale != 1.0:
         h, w = img_to_draw_on.shape[:2]
         new_h, new_w = int(h * output_scale), int(w * output_scale)
         img_to_draw_on = cv2.resize(img_to_draw_on, (new_w, new_h), interpolation=cv2.INTER_AREA)
     
     try:
-        cv2.imwrite(output_filename, img_to_draw_on)
+        write_image(output_filename, img_to_draw_on, encode_params(output_conf))
+        write_thumbnail(img_to_draw_on, output_filename, output_conf)
+        discard_pending(output_filename) # A lazy run's leftover would outlive this image
     except Exception as e:
         print(f"Error writing image {output_filename}: {e}")
 
-    return df, detected_object_count, next_csv_row_to_assign
+    return next_csv_row_to_assign
+
+# ------------------------------------------------------------------------------
+# Lazy rendering: a run stores what render_detections needs, with a hard link
+# to the source image (so clearing the input does not lose it), and
+# render_pending draws it on first request.
+# ------------------------------------------------------------------------------
+
+def _pending_record_path(output_filename):
+    output_dir, name = os.path.split(output_filename)
+    return os.path.join(output_dir, PENDING_DIRNAME, f"{name}.pkl")
+
+def save_pending(fullpath, detections, current_csv_row_start_index, output_filename,
+                 output_scale=DEFAULT_OUTPUT_SCALE, contour_thickness=DEFAULT_CONTOUR_THICKNESS,
+                 decode_downscale=DEFAULT_DECODE_DOWNSCALE, output_conf=OUTPUT_CONF):
+    """Stores an image's annotation for render_pending instead of drawing it now."""
+    record_path = _pending_record_path(output_filename)
+    os.makedirs(os.path.dirname(record_path), exist_ok=True)
+    discard_pending(output_filename)
+    # Keep the extension: load_image decides on reduced decoding by it
+    source = f"{record_path[:-len('.pkl')]}.src{os.path.splitext(fullpath)[1].lower()}"
+    try:
+        os.link(fullpath, source)
+    except OSError:
+        shutil.copyfile(fullpath, source) # Other filesystem, or no hard links
+    record = {
+        "source": source,
+        "detections": detections,
+        "row_start": current_csv_row_start_index,
+        "output_scale": output_scale,
+        "contour_thickness": contour_thickness,
+        "decode_downscale": decode_downscale,
+        "output_conf": dict(output_conf),
+    }
+    tmp_path = f"{record_path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(record, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, record_path)
+    # An annotated image of an earlier run would otherwise be served instead
+    for stale in (output_filename, thumbnail_path(output_filename)):
+        if os.path.exists(stale):
+            os.remove(stale)
+
+def is_pending(output_filename):
+    """Returns True if the annotated image is stored for lazy rendering and not drawn yet."""
+    return os.path.exists(_pending_record_path(output_filename))
+
+def list_pending(output_dir):
+    """Returns the names of the annotated images in output_dir that are not drawn yet."""
+    pending_dir = os.path.join(output_dir, PENDING_DIRNAME)
+    if not os.path.isdir(pending_dir):
+        return []
+    return sorted(f_name[:-len(".pkl")] for f_name in os.listdir(pending_dir) if f_name.endswith(".pkl"))
+
+def discard_pending(output_filename):
+    """Removes the lazy rendering record of an annotated image and its source link, if any."""
+    record_path = _pending_record_path(output_filename)
+    if not os.path.isdir(os.path.dirname(record_path)):
+        return
+    base = record_path[:-len(".pkl")]
+    for path in [record_path] + [f"{base}.src.{suffix}" for suffix in IMG_SUFFIXES]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def render_pending(output_filename):
+    """
+    Draws a lazily stored annotated image and its thumbnail, then drops the
+    record. Returns False if nothing is pending for output_filename.
+    """
+    try:
+        with open(_pending_record_path(output_filename), "rb") as f:
+            record = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return False
+    img, image_scale = load_image(record["source"], record["decode_downscale"])
+    if img is None:
+        return False
+    render_detections(img, record["detections"], record["row_start"], output_filename,
+                      record["output_scale"], record["contour_thickness"], image_scale,
+                      record["output_conf"], in_place=True)
+    return True
+
+def process_image_features(predictor, img, img_base_name, current_csv_row_start_index,
+                           output_scale=DEFAULT_OUTPUT_SCALE,
+                           contour_thickness=DEFAULT_CONTOUR_THICKNESS,
+                           border_filter_pixels=DEFAULT_BORDER_FILTER_PIXELS,
+                           output_path=OUTPUT_PATH):
+    """
+    Performs inference on an image, extracts features from detected objects,
+    draws detections, and returns a DataFrame of features.
+    """
+    detections = detect_objects(predictor, img, border_filter_pixels)
+    df = detections_to_dataframe(detections, img_base_name)
+
+    # Save the output image with detections
+    output_filename = os.path.join(output_path, annotated_filename(img_base_name))
+    next_csv_row_to_assign = render_detections(img, detections, current_csv_row_start_index,
+                                               output_filename, output_scale, contour_thickness)
+
+    return df, len(detections), next_csv_row_to_assign
+
+# ==============================================================================
+# --- Tiled Inference ---
+# ==============================================================================
+
+def tile_windows(height, width, tile_size, overlap):
+    """
+    Returns (x0, y0, x1, y1) windows of at most tile_size pixels covering the
+    image, with neighbouring windows overlapping by at least overlap pixels.
+    """
+    if overlap >= tile_size:
+        raise ValueError("Tile overlap must be smaller than the tile size.")
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        stride = tile_size - overlap
+        positions = list(range(0, length - tile_size, stride))
+        positions.append(length - tile_size) # Last tile flush with the far edge
+        return positions
+
+    return [(x0, y0, min(x0 + tile_size, width), min(y0 + tile_size, height))
+            for y0 in starts(height) for x0 in starts(width)]
+
+def _grid_cells(offset, shape, cell_size):
+    """Grid cells of cell_size pixels touched by a mask crop at offset."""
+    x0, y0 = offset
+    h, w = shape
+    return [(gx, gy)
+            for gy in range(y0 // cell_size, (y0 + h - 1) // cell_size + 1)
+            for gx in range(x0 // cell_size, (x0 + w - 1) // cell_size + 1)]
+
+def merge_tile_detections(candidates, merge_overlap=TILE_MERGE_OVERLAP, cell_size=TILE_MERGE_GRID):
+    """
+    Merges duplicate detections of the same object from overlapping tiles.
+
+    candidates are dicts with 'score', 'mask' (bool crop) and 'offset'
+    (x0, y0) in image coordinates. Going from the highest score down, a
+    candidate whose mask overlaps an already kept one by at least
+    merge_overlap of the smaller mask is unioned into it; otherwise it is
+    kept as a new object. An object cut by a tile seam is thereby replaced
+    by (or completed with) its copy from the neighbouring tile.
+
+    Kept objects are indexed on a grid of cell_size pixels, so a candidate
+    is only compared with objects whose boxes share a cell with its own.
+    """
+    kept = []
+    grid = defaultdict(set) # cell -> indices into kept
+    for cand in sorted(candidates, key=lambda c: c['score'], reverse=True):
+        cx0, cy0 = cand['offset']
+        ch, cw = cand['mask'].shape
+        nearby = sorted({k for cell in _grid_cells(cand['offset'], cand['mask'].shape, cell_size)
+                         for k in grid.get(cell, ())})
+        for k in nearby:
+            obj = kept[k]
+            ox0, oy0 = obj['offset']
+            oh, ow = obj['mask'].shape
+            ix0, iy0 = max(cx0, ox0), max(cy0, oy0)
+            ix1, iy1 = min(cx0 + cw, ox0 + ow), min(cy0 + ch, oy0 + oh)
+            if ix0 >= ix1 or iy0 >= iy1:
+                continue
+
+            intersection = np.count_nonzero(
+                cand['mask'][iy0 - cy0:iy1 - cy0, ix0 - cx0:ix1 - cx0]
+                & obj['mask'][iy0 - oy0:iy1 - oy0, ix0 - ox0:ix1 - ox0])
+            smaller = min(cand['pixels'], obj['pixels'])
+            if smaller == 0 or intersection / smaller < merge_overlap:
+                continue
+
+            # Union the candidate into the kept object on a canvas covering both
+            ux0, uy0 = min(cx0, ox0), min(cy0, oy0)
+            ux1, uy1 = max(cx0 + cw, ox0 + ow), max(cy0 + ch, oy0 + oh)
+            union = np.zeros((uy1 - uy0, ux1 - ux0), dtype=bool)
+            union[oy0 - uy0:oy0 - uy0 + oh, ox0 - ux0:ox0 - ux0 + ow] = obj['mask']
+            union[cy0 - uy0:cy0 - uy0 + ch, cx0 - ux0:cx0 - ux0 + cw] |= cand['mask']
+            obj.update(mask=union, offset=(ux0, uy0), pixels=int(np.count_nonzero(union)))
+            for cell in _grid_cells(obj['offset'], union.shape, cell_size):
+                grid[cell].add(k)
+            break
+        else:
+            for cell in _grid_cells(cand['offset'], cand['mask'].shape, cell_size):
+                grid[cell].add(len(kept))
+            kept.append(dict(cand))
+    return kept
+
+class TiledPredictor:
+    """
+    Wraps a BatchPredictor to run each image as overlapping tiles, batching
+    tiles through the model and stitching the per-tile masks back into
+    full-image detections. Can be used anywhere a predictor is expected.
+    """
+
+    def __init__(self, predictor, tile_size, overlap=DEFAULT_TILE_OVERLAP,
+                 tile_batch_size=DEFAULT_BATCH_SIZE, merge_overlap=TILE_MERGE_OVERLAP):
+        self.predictor = predictor
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.tile_batch_size = max(1, tile_batch_size)
+        self.merge_overlap = merge_overlap
+
+    def __call__(self, original_image):
+        return self.predict_batch([original_image])[0]
+
+    def predict_batch(self, original_images):
+        """Runs tiled inference on a list of images; one output dict per image."""
+        tiles = []
+        for image_index, img in enumerate(original_images):
+            height, width = img.shape[:2]
+            for x0, y0, x1, y1 in tile_windows(height, width, self.tile_size, self.overlap):
+                tiles.append((image_index, (x0, y0), img[y0:y1, x0:x1]))
+
+        candidates = [[] for _ in original_images]
+        for k in range(0, len(tiles), self.tile_batch_size):
+            chunk = tiles[k:k + self.tile_batch_size]
+            predictions = predict_images(self.predictor, [tile for _, _, tile in chunk])
+            for (image_index, (tx, ty), tile), tile_predictions in zip(chunk, predictions):
+                scores = tile_predictions.get("scores").numpy()
+                for mask_idx, mask_crop, (x0, y0) in iter_mask_crops(tile_predictions, tile.shape):
+                    pixels = int(np.count_nonzero(mask_crop))
+                    if pixels == 0:
+                        continue
+                    candidates[image_index].append({
+                        'score': float(scores[mask_idx]),
+                        'mask': np.asarray(mask_crop, dtype=bool),
+                        'offset': (tx + x0, ty + y0),
+                        'pixels': pixels
+                    })
+
+        return [{"instances": self._to_instances(merge_tile_detections(image_candidates, self.merge_overlap),
+                                                 img.shape)}
+                for img, image_candidates in zip(original_images, candidates)]
+
+    @staticmethod
+    def _to_instances(objects, image_shape):
+        """Packs merged objects into Instances carrying their cropped masks."""
+        boxes = np.zeros((len(objects), 4), dtype=np.float32)
+        for k, obj in enumerate(objects):
+            ys, xs = np.nonzero(obj['mask'])
+            x0, y0 = obj['offset']
+            boxes[k] = (x0 + xs.min(), y0 + ys.min(), x0 + xs.max() + 1, y0 + ys.max() + 1)
+
+        instances = Instances(image_shape[:2])
+        instances.scores = torch.tensor([obj['score'] for obj in objects], dtype=torch.float32)
+        instances.pred_boxes = Boxes(torch.from_numpy(boxes))
+        instances.mask_crops = [(obj['mask'], obj['offset']) for obj in objects]
+        return instances
+
+# ==============================================================================
+# --- Multi-Process Inference Pool ---
+# ==============================================================================
+
+# Predictor owned by the current pool worker process
+_worker_predictor = None
+
+def _init_pool_worker(torch_threads, tile_size, tile_overlap, tile_batch_size):
+    """Loads a predictor into a freshly spawned pool worker."""
+    global _worker_predictor
+    if torch_threads:
+        torch.set_num_threads(torch_threads)
+    _worker_predictor = create_predictor(check_cuda())
+    if tile_size:
+        _worker_predictor = TiledPredictor(_worker_predictor, tile_size, tile_overlap,
+                                           tile_batch_size=tile_batch_size)
+
+def _pool_detect(fullpaths, border_filter_pixels, decode_downscale):
+    """
+    Pool task: decodes a batch of images and returns their detections, with
+    None in place of any unreadable image, the worker's peak RSS in MB and
+    the per-stage rejection counts.
+    """
+    reset_peak_rss()
+    rejections = Counter()
+    loaded = [load_image(fullpath, decode_downscale) for fullpath in fullpaths]
+    images = [img for img, _ in loaded]
+    readable = [(img, scale) for img, scale in loaded if img is not None]
+    detections = iter(detect_objects_batch(_worker_predictor, [img for img, _ in readable],
+                                           border_filter_pixels, rejections,
+                                           scales=[scale for _, scale in readable])
+                      if readable else [])
+    return [None if img is None else next(detections) for img in images], peak_rss_mb(), rejections
+
+def _pool_render(fullpath, detections, current_csv_row_start_index, output_filename,
+                 output_scale, contour_thickness, decode_downscale, output_conf):
+    """Pool task: decodes an image again and writes its annotated copy."""
+    img, image_scale = load_image(fullpath, decode_downscale)
+    if img is None:
+        return current_csv_row_start_index + len(detections)
+    return render_detections(img, detections, current_csv_row_start_index,
+                             output_filename, output_scale, contour_thickness, image_scale,
+                             output_conf, in_place=True)
+
+class InferencePool:
+    """
+    Process pool where every worker holds its own predictor, so images are
+    spread across all CPU cores. Can be passed to run_pipeline in place of a
+    predictor.
+    """
+
+    def __init__(self, num_workers, torch_threads=None,
+                 tile_size=DEFAULT_TILE_SIZE, tile_overlap=DEFAULT_TILE_OVERLAP,
+                 tile_batch_size=DEFAULT_BATCH_SIZE):
+        if num_workers < 1:
+            raise ValueError("Inference pool needs at least one worker.")
+        if torch_threads is None:
+            torch_threads = max(1, (os.cpu_count() or 1) // num_workers)
+        self.num_workers = num_workers
+        self.torch_threads = torch_threads
+        self.tile_size = tile_size
+        # spawn (not fork) so workers do not inherit the parent's OpenMP state
+        self._executor = ProcessPoolExecutor(max_workers=num_workers,
+                                             mp_context=multiprocessing.get_context("spawn"),
+                                             initializer=_init_pool_worker,
+                                             initargs=(torch_threads, tile_size, tile_overlap,
+                                                       tile_batch_size))
+
+    def submit_detect(self, fullpaths, border_filter_pixels=DEFAULT_BORDER_FILTER_PIXELS,
+                      decode_downscale=DEFAULT_DECODE_DOWNSCALE):
+        return self._executor.submit(_pool_detect, fullpaths, border_filter_pixels, decode_downscale)
+
+    def submit_render(self, fullpath, detections, current_csv_row_start_index, output_filename,
+                      output_scale=DEFAULT_OUTPUT_SCALE,
+                      contour_thickness=DEFAULT_CONTOUR_THICKNESS,
+                      decode_downscale=DEFAULT_DECODE_DOWNSCALE, output_conf=OUTPUT_CONF):
+        return self._executor.submit(_pool_render, fullpath, detections,
+                                     current_csv_row_start_index, output_filename,
+                                     output_scale, contour_thickness, decode_downscale, output_conf)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
 
 # ==============================================================================
 # --- Data Aggregation and Final Processing ---
 # ==============================================================================
 
-def finalize_data_and_save(all_data_frames, output_dir):
+def add_grade_columns(df):
+    """
+    Adds real-world size, weight, grade and price columns to a feature
+    DataFrame in place. Every column is computed per row, so this works on a
+    single image's features as well as on the combined ones.
+    """
+    # Calculate real-world dimensions and weight
+    df["lw_ratio"] = df["length_px"].replace(0, np.nan) / df["width_px"].replace(0, np.nan) # Avoid division by zero
+    df["area_in2"] = df["area_px2"] * (INCHES_PER_PIXEL**2)
+
+    log_arg = df["area_in2"] * FUDGE_FACTOR
+    log_arg_safe = np.where(log_arg > 0, log_arg, np.nan) # Ensure log argument is positive
+
+    df["weight_oz"] = (
+        10**(1.465 * np.log10(log_arg_safe) + 0.8749) * 0.03527396
+    )
+    #df["axiallength_in"] = df["length_px"] * INCHES_PER_PIXEL
+    #df["maxdiameter_in"] = df["width_px"] * INCHES_PER_PIXEL
+    df['Grade'] = df['weight_oz'].apply(lambda x: assign_grade(x) if pd.notnull(x) else None)
+
+    df['Price USD'] = np.where(df['Grade'] == 'Marketable', 0.56,
+                               np.where(df['Grade'] == 'Not Marketable', 0.008, np.nan))
+    return df
+
+def graded_rows(df_features, row_start):
+    """
+    Returns an image's feature rows with grades as JSON-ready dicts keyed
+    like the combined CSV columns (object_id first), plus its grade counts.
+    """
+    if df_features.empty:
+        return [], {}
+    df = add_grade_columns(df_features.copy())
+    df.insert(0, 'object_id', range(row_start + 1, row_start + 1 + len(df)))
+    grade_counts = {str(grade): int(count) for grade, count in df['Grade'].value_counts(dropna=False).items()}
+    df = df.astype(object).where(df.notna(), None) # NaN is not valid JSON
+    rows = [{key: (value.item() if isinstance(value, np.generic) else value) for key, value in row.items()}
+            for row in df.to_dict('records')]
+    return rows, grade_counts
+
+def grade_summary(df):
+    """
+    Returns the grade distribution and weight statistics of a combined
+    DataFrame as JSON-ready dicts, for the run summary.
+    """
+    summary = {"grade_counts": {}, "weight_stats": None}
+    if 'Grade' in df.columns:
+        summary["grade_counts"] = {str(grade): int(count)
+                                   for grade, count in df['Grade'].value_counts(dropna=False).items()}
+    if 'weight_oz' in df.columns:
+        weights = df['weight_oz'].dropna()
+        summary["weight_stats"] = {
+            "count": int(len(weights)),
+            "mean": float(weights.mean()) if len(weights) else None,
+            "std": float(weights.std()) if len(weights) > 1 else None,
+            "min": float(weights.min()) if len(weights) else None,
+            "max": float(weights.max()) if len(weights) else None,
+        }
+    return summary
+
+def finalize_data_and_save(all_data_frames, output_dir, preserve_row_ids=False):
     """
     Combines all dataframes, calculates additional metrics (weight, grade),
-    and saves the final CSV.
+    and saves the final CSV. Returns the combined DataFrame, or None if
+    there was nothing to save.
+
+    With preserve_row_ids the dataframes are indexed by their 0-based CSV
+    rows already, and object_id is taken from that index instead of being
+    renumbered.
     """
     if not all_data_frames:
         print("No dataframes to process. Skipping finalization.")
-        return
+        return None
 
-    combined_df = pd.concat(all_data_frames, ignore_index=True)
+    combined_df = pd.concat(all_data_frames, ignore_index=not preserve_row_ids)
     if combined_df.empty:
         print("Combined DataFrame is empty. No data to save.")
-        return
+        return None
 
     # --- MODIFICATION START ---
     # Set the index to be 1-based instead of 0-based for the final CSV.
@@ -289,23 +1122,7 @@ def finalize_data_and_save(all_data_frames, output_dir):
         print("Attempting to save partial data.")
         csv_path = os.path.join(output_dir, 'combined_analysis_partial.csv')
     else:
-        # Calculate real-world dimensions and weight
-        combined_df["lw_ratio"] = combined_df["length_px"].replace(0, np.nan) / combined_df["width_px"].replace(0, np.nan) # Avoid division by zero
-        combined_df["area_in2"] = combined_df["area_px2"] * (INCHES_PER_PIXEL**2)
-
-        log_arg = combined_df["area_in2"] * FUDGE_FACTOR
-        log_arg_safe = np.where(log_arg > 0, log_arg, np.nan) # Ensure log argument is positive
-
-        combined_df["weight_oz"] = (
-            10**(1.465 * np.log10(log_arg_safe) + 0.8749) * 0.03527396
-        )
-        #combined_df["axiallength_in"] = combined_df["length_px"] * INCHES_PER_PIXEL
-        #combined_df["maxdiameter_in"] = combined_df["width_px"] * INCHES_PER_PIXEL
-        combined_df['Grade'] = combined_df['weight_oz'].apply(lambda x: assign_grade(x) if pd.notnull(x) else None)
-        
-        combined_df['Price USD'] = np.where(combined_df['Grade'] == 'Marketable', 0.56, 
-                                       np.where(combined_df['Grade'] == 'Not Marketable', 0.008, np.nan))
-        
+        add_grade_columns(combined_df)
         csv_path = os.path.join(output_dir, 'combined_analysis_with_grades.csv')
 
     try:
@@ -326,74 +1143,830 @@ def finalize_data_and_save(all_data_frames, output_dir):
         print("\n--- Weight Statistics (oz) ---")
         print(combined_df['weight_oz'].describe())
 
+    return combined_df
+
 # ==============================================================================
-# --- Main Execution ---
+# --- Result Cache ---
 # ==============================================================================
 
-def main():
-    """Main function to orchestrate the image processing pipeline."""
-    
-    device = check_cuda() # Check CUDA and set device
-    predictor = initialize_predictor(device)
+def file_sha256(path, chunk_size=HASH_CHUNK_BYTES):
+    """Returns the hex SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
 
-    # --- Prepare for Processing ---
-    if not os.path.exists(OUTPUT_PATH):
-        os.makedirs(OUTPUT_PATH)
-        print(f"Created output directory: {OUTPUT_PATH}")
+def model_fingerprint(extra=None):
+    """
+    Returns a hash of everything that changes per-image results: the model
+    weights and config, the detection filters, the rendering settings and
+    the physical conversion constants, plus any caller-supplied settings.
+    """
+    settings = {
+        "weights": file_sha256(MODEL_WEIGHTS_PATH) if os.path.exists(MODEL_WEIGHTS_PATH) else None,
+        "config": DETECTRON2_CONFIG_PATH,
+        "model_conf": MODEL_CONF,
+        "filter_conf": FILTER_CONF,
+        "min_contour_area": MIN_CONTOUR_AREA,
+        "min_size_test": MIN_SIZE_TEST,
+        "border_filter_pixels": DEFAULT_BORDER_FILTER_PIXELS,
+        "output_scale": DEFAULT_OUTPUT_SCALE,
+        "contour_thickness": DEFAULT_CONTOUR_THICKNESS,
+        "inches_per_pixel": INCHES_PER_PIXEL,
+        "fudge_factor": FUDGE_FACTOR,
+        "extra": extra or {},
+    }
+    return hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()
+
+class ResultCache:
+    """
+    On-disk cache of per-image results (detections and the annotated image)
+    keyed by image content hash plus model fingerprint, bounded to max_bytes
+    with least-recently-used eviction. Safe to share between threads.
+
+    The annotated image carries CSV row numbers, so it is only reused when
+    the image starts at the same row as when it was cached; otherwise it is
+    redrawn from the cached detections, which still skips inference.
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_CACHE_MAX_BYTES, fingerprint_extra=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.fingerprint = model_fingerprint(fingerprint_extra)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # Rebuild the LRU order from the entries' last-use times
+        entries = []
+        for f_name in os.listdir(cache_dir):
+            if f_name.endswith(".pkl"):
+                stat = os.stat(os.path.join(cache_dir, f_name))
+                entries.append((stat.st_mtime, f_name[:-len(".pkl")], stat.st_size))
+        self._entries = OrderedDict((key, size) for _, key, size in sorted(entries))
+        self._total_bytes = sum(self._entries.values())
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pkl")
+
+    def key_for(self, image_path):
+        """Returns the cache key of an image file under the current fingerprint."""
+        return hashlib.sha256(f"{self.fingerprint}:{file_sha256(image_path)}".encode()).hexdigest()
+
+    def contains(self, key):
+        """Returns True if key has an entry, without loading it or counting a lookup."""
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key):
+        """
+        Returns the cached entry (a dict with 'detections', 'row_start',
+        'encoding', 'image_bytes' and 'thumbnail_bytes') or None, counting the
+        hit or miss. The image fields are None if the image was rendered lazily.
+        """
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            try:
+                with open(self._path(key), "rb") as f:
+                    entry = pickle.load(f)
+                os.utime(self._path(key))
+            except (OSError, pickle.UnpicklingError, EOFError):
+                self._discard(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, detections, row_start, annotated_image_path=None, encoding=None):
+        """
+        Stores an image's detections and its annotated output (encoded with
+        the given output_encoding), then evicts down to max_bytes. Without
+        annotated_image_path only the detections are stored.
+        """
+        image_bytes = thumbnail_bytes = None
+        if annotated_image_path is not None:
+            try:
+                with open(annotated_image_path, "rb") as f:
+                    image_bytes = f.read()
+            except OSError:
+                return # Nothing was rendered; cache nothing rather than half an entry
+            try:
+                with open(thumbnail_path(annotated_image_path), "rb") as f:
+                    thumbnail_bytes = f.read()
+            except OSError:
+                pass # Thumbnails disabled
+        entry = {
+            "detections": detections,
+            "row_start": row_start,
+            "encoding": encoding,
+            "image_bytes": image_bytes,
+            "thumbnail_bytes": thumbnail_bytes,
+        }
+
+        with self._lock:
+            path = self._path(key)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path) # Readers never see a partially written entry
+
+            self._total_bytes -= self._entries.pop(key, 0)
+            self._entries[key] = os.path.getsize(path)
+            self._total_bytes += self._entries[key]
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                self._discard(next(iter(self._entries)))
+
+    def _discard(self, key):
+        self._total_bytes -= self._entries.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def stats(self):
+        """Returns the hit/miss counters and current size of the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            }
 
+# ==============================================================================
+# --- Streaming Pipeline Stages ---
+# ==============================================================================
+
+_STAGE_DONE = object() # Sentinel closing a stage queue
+
+def _put_until_stopped(stage_queue, item, stop_event):
+    """Puts item on a bounded queue, giving up once stop_event is set."""
+    while not stop_event.is_set():
+        try:
+            stage_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _prefetch_batches(batches, depth=PREFETCH_DEPTH, decode_downscale=DEFAULT_DECODE_DOWNSCALE):
+    """
+    Yields (batch, images, scales) while a background thread decodes up to
+    depth upcoming batches, so disk reads and JPEG decoding overlap with
+    inference. scales holds each image's decode scale (see load_image).
+    """
+    stage_queue = queue.Queue(maxsize=depth)
+    stop_event = threading.Event()
+
+    def decode_batches():
+        try:
+            for batch in batches:
+                loaded = [load_image(os.path.join(root, f_name), decode_downscale) for root, f_name in batch]
+                images = [img for img, _ in loaded]
+                scales = [scale for _, scale in loaded]
+                if not _put_until_stopped(stage_queue, (batch, images, scales), stop_event):
+                    return
+        except Exception as e:
+            _put_until_stopped(stage_queue, e, stop_event)
+        finally:
+            _put_until_stopped(stage_queue, _STAGE_DONE, stop_event)
+
+    decoder = threading.Thread(target=decode_batches, name="pipeline-prefetch", daemon=True)
+    decoder.start()
+    try:
+        while True:
+            item = stage_queue.get()
+            if item is _STAGE_DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop_event.set()
+        decoder.join()
+
+class ImageWriter:
+    """
+    Background stage that draws annotations, resizes and writes output
+    images, so encoding and disk I/O overlap with the next forward pass.
+    """
+
+    def __init__(self, depth=WRITER_QUEUE_DEPTH):
+        self._queue = queue.Queue(maxsize=depth)
+        self._error = None
+        self._thread = threading.Thread(target=self._drain, name="pipeline-writer", daemon=True)
+        self._thread.start()
+
+    def _drain(self):
+        while True:
+            item = self._queue.get()
+            if item is _STAGE_DONE:
+                return
+            if self._error is not None:
+                continue # Keep draining so producers never block on a dead writer
+            *render_args, on_done = item
+            try:
+                render_detections(*render_args, in_place=True)
+                if on_done is not None:
+                    on_done()
+            except Exception as e:
+                self._error = e
+
+    def submit(self, img, detections, current_csv_row_start_index, output_filename,
+               output_scale=DEFAULT_OUTPUT_SCALE,
+               contour_thickness=DEFAULT_CONTOUR_THICKNESS, on_done=None, image_scale=1,
+               output_conf=OUTPUT_CONF):
+        """
+        Queues an image for rendering, blocking while the queue is full.
+        The annotations are drawn into img itself, so it must not be used afterwards.
+        on_done, if given, is called from the writer thread once the image is on disk.
+        """
+        self._queue.put((img, detections, current_csv_row_start_index, output_filename,
+                         output_scale, contour_thickness, image_scale, output_conf, on_done))
+
+    def close(self):
+        """Waits for every queued image to be written and re-raises any writer error."""
+        self._queue.put(_STAGE_DONE)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+# ==============================================================================
+# --- Main Execution ---
+# ==============================================================================
+
+def find_image_files(input_path=INPUT_PATH):
+    """Returns (root, filename) pairs for every image under input_path, sorted by filename."""
     all_image_files = []
-    for root, _, files in os.walk(INPUT_PATH):
+    for root, _, files in os.walk(input_path):
         for f_name in files:
             if f_name.lower().endswith(IMG_SUFFIXES):
                 all_image_files.append((root, f_name))
-    
+
     all_image_files.sort(key=lambda x: x[1]) # Sort by filename for consistent order
+    return all_image_files
 
-    if not all_image_files:
-        print(f"No images found in {INPUT_PATH} with suffixes {IMG_SUFFIXES}.")
+def decode_downscale_enabled(predictor, decode_downscale=DEFAULT_DECODE_DOWNSCALE):
+    """
+    Decode-time downscaling would defeat tiled inference, which exists to
+    run large frames at full resolution, so it is only used without tiles.
+    """
+    if isinstance(predictor, TiledPredictor):
+        return False
+    if isinstance(predictor, InferencePool) and predictor.tile_size:
+        return False
+    return decode_downscale
+
+def _iter_detections(predictor, all_image_files, batch_size, rejections,
+                     decode_downscale=DEFAULT_DECODE_DOWNSCALE):
+    """
+    Yields (index, root, filename, image, image_scale, detections,
+    peak_rss_mb) in filename order, running inference batch_size images at a
+    time. detections is None for unreadable images; image is None when a
+    pool decoded it in a worker. image_scale is the decode scale of image
+    (see load_image); detections are in original pixels either way.
+    peak_rss_mb is the peak RSS of the process that ran the image's batch.
+    Per-stage rejection counts are accumulated into the rejections Counter.
+    """
+    batches = [all_image_files[k:k + batch_size]
+               for k in range(0, len(all_image_files), batch_size)]
+
+    if isinstance(predictor, InferencePool):
+        # Queue every batch up front; results are consumed in filename order
+        # so CSV row numbers stay deterministic regardless of which worker finishes first
+        detect_futures = [predictor.submit_detect([os.path.join(root, f_name) for root, f_name in batch],
+                                                  DEFAULT_BORDER_FILTER_PIXELS, decode_downscale)
+                          for batch in batches]
+        i = 0
+        for batch, future in zip(batches, detect_futures):
+            batch_detections, batch_peak_rss, batch_rejections = future.result()
+            rejections.update(batch_rejections)
+            for (root, f_name), detections in zip(batch, batch_detections):
+                yield i, root, f_name, None, 1, detections, batch_peak_rss
+                i += 1
+        return
+
+    i = 0
+    for batch, images, scales in _prefetch_batches(batches, decode_downscale=decode_downscale):
+        reset_peak_rss()
+        readable = [(img, scale) for img, scale in zip(images, scales) if img is not None]
+        batch_detections = iter(detect_objects_batch(predictor, [img for img, _ in readable],
+                                                     DEFAULT_BORDER_FILTER_PIXELS, rejections,
+                                                     scales=[scale for _, scale in readable])
+                                if readable else [])
+        batch_peak_rss = peak_rss_mb()
+        for (root, f_name), img, scale in zip(batch, images, scales):
+            yield (i, root, f_name, img, scale, (None if img is None else next(batch_detections)),
+                   batch_peak_rss)
+            i += 1
+
+def _iter_results(predictor, all_image_files, batch_size, rejections, cache,
+                  decode_downscale=DEFAULT_DECODE_DOWNSCALE):
+    """
+    Like _iter_detections, but serves images found in the result cache
+    without inference. Yields (index, root, filename, image, image_scale,
+    detections, peak_rss_mb, cache_key, cache_entry); cache_entry is None on
+    a miss and cache_key is None without a cache. Entries carry the encoded
+    output images, so each is loaded only when its image is yielded.
+    """
+    if cache is None:
+        for result in _iter_detections(predictor, all_image_files, batch_size, rejections,
+                                       decode_downscale):
+            yield result + (None, None)
         return
 
+    keys, cached = [], []
+    for root, f_name in all_image_files:
+        try:
+            key = cache.key_for(os.path.join(root, f_name))
+        except OSError:
+            key = None # Unreadable; let the detection stage report it
+        keys.append(key)
+        cached.append(key is not None and cache.contains(key))
+
+    misses = [image_file for image_file, hit in zip(all_image_files, cached) if not hit]
+    inferred = _iter_detections(predictor, misses, batch_size, rejections, decode_downscale)
+    for i, ((root, f_name), key, hit) in enumerate(zip(all_image_files, keys, cached)):
+        if not hit:
+            # Always consume the miss's inference result, even if another job
+            # has cached the image since the first pass, so results stay paired
+            _, _, _, img, image_scale, detections, image_peak_rss = next(inferred)
+        else:
+            entry = cache.get(key)
+            if entry is not None:
+                yield i, root, f_name, None, 1, entry["detections"], 0.0, key, entry
+                continue
+            # Evicted or unreadable since the first pass; run this image on its own
+            (_, _, _, img, image_scale, detections, image_peak_rss), = _iter_detections(
+                predictor, [(root, f_name)], 1, rejections, decode_downscale)
+        yield i, root, f_name, img, image_scale, detections, image_peak_rss, key, None
+
+def _collect_render(future, on_written):
+    """Waits for a pool render and reports the written image."""
+    future.result()
+    if on_written is not None:
+        on_written()
+
+def _restore_cached_output(cache_entry, output_filename):
+    """Writes a cache entry's annotated image and thumbnail to output_filename."""
+    with open(output_filename, "wb") as f:
+        f.write(cache_entry["image_bytes"])
+    if cache_entry["thumbnail_bytes"] is not None:
+        os.makedirs(os.path.join(os.path.dirname(output_filename), THUMBNAIL_DIRNAME), exist_ok=True)
+        with open(thumbnail_path(output_filename), "wb") as f:
+            f.write(cache_entry["thumbnail_bytes"])
+    discard_pending(output_filename)
+
+def _process_images(predictor, all_image_files, output_path, summary, progress_callback=None,
+                     batch_size=DEFAULT_BATCH_SIZE, cache=None, csv_row_start=0,
+                     decode_downscale=DEFAULT_DECODE_DOWNSCALE, output_conf=OUTPUT_CONF,
+                     image_names=None):
+    """
+    Runs detection, rendering and feature extraction over all_image_files,
+    numbering objects from csv_row_start, and accumulates counts into
+    summary. Returns an (root, filename, row_start, features DataFrame)
+    record for every readable image, in filename order. With
+    output_conf["LAZY"], annotated images are stored for render_pending
+    instead of being drawn. Images are reported and their outputs named
+    under reported_name(filename, image_names).
+    """
+    decode_downscale = decode_downscale_enabled(predictor, decode_downscale)
+    image_results = []
+    global_csv_row_counter = csv_row_start # initialize global counter for CSV row numbers
+
+    pooled = isinstance(predictor, InferencePool)
+    render_futures = []
+    writer = None if pooled else ImageWriter()
+    rejections = Counter()
+    to_cache = [] # (key, detections, row_start, output_filename, encoding) of freshly inferred images
+
+    try:
+        for (i, root, file_iter_name, img_in, img_in_scale, detections, image_peak_rss,
+             cache_key, cache_entry) in _iter_results(predictor, all_image_files, batch_size,
+                                                      rejections, cache, decode_downscale):
+            img_basename = reported_name(file_iter_name, image_names)
+            fullpath = os.path.join(root, file_iter_name)
+
+            print(f"\nProcessing image {i + 1}/{len(all_image_files)}: {img_basename}")
+
+            if detections is None:
+                print(f"Error: Could not read image {fullpath}. Skipping.")
+                if progress_callback is not None:
+                    progress_callback({"index": i, "total": len(all_image_files),
+                                       "filename": img_basename, "status": "unreadable",
+                                       "objects_detected": 0})
+                continue
+
+            output_filename = os.path.join(output_path, annotated_filename(img_basename, output_conf))
+            encoding = output_encoding(output_filename, DEFAULT_OUTPUT_SCALE, output_conf)
+            df_features = detections_to_dataframe(detections, img_basename)
+            num_detections = len(detections)
+
+            # Reported once the annotated image is on disk, so listeners can fetch it right away
+            on_written = None
+            if progress_callback is not None:
+                rows, grade_counts = graded_rows(df_features, global_csv_row_counter)
+                event = {"index": i, "total": len(all_image_files),
+                         "filename": img_basename, "status": "processed",
+                         "objects_detected": num_detections,
+                         "peak_rss_mb": image_peak_rss,
+                         "cached": cache_entry is not None,
+                         "output_file": os.path.basename(output_filename),
+                         "rows": rows,
+                         "grade_counts": grade_counts}
+                on_written = lambda event=event: progress_callback(event)
+
+            # Save the output image with detections, numbered from the current global CSV row
+            if cache_entry is not None:
+                summary["cache_hits"] += 1
+            elif cache_key is not None:
+                summary["cache_misses"] += 1
+                to_cache.append((cache_key, detections, global_csv_row_counter, output_filename, encoding))
+
+            if (cache_entry is not None and cache_entry["row_start"] == global_csv_row_counter
+                    and cache_entry.get("encoding") == encoding and cache_entry["image_bytes"] is not None):
+                _restore_cached_output(cache_entry, output_filename)
+                if on_written is not None:
+                    on_written()
+            elif output_conf["LAZY"]:
+                save_pending(fullpath, detections, global_csv_row_counter, output_filename,
+                             DEFAULT_OUTPUT_SCALE, DEFAULT_CONTOUR_THICKNESS, decode_downscale, output_conf)
+                if on_written is not None:
+                    on_written()
+            elif pooled:
+                render_futures.append((predictor.submit_render(fullpath, detections, global_csv_row_counter,
+                                                               output_filename, DEFAULT_OUTPUT_SCALE,
+                                                               DEFAULT_CONTOUR_THICKNESS, decode_downscale,
+                                                               output_conf),
+                                       on_written))
+            else:
+                # Cache hits were not decoded by the detection stage
+                img, img_scale = ((img_in, img_in_scale) if img_in is not None
+                                  else load_image(fullpath, decode_downscale))
+                writer.submit(img, detections, global_csv_row_counter, output_filename,
+                              output_scale=DEFAULT_OUTPUT_SCALE,
+                              contour_thickness=DEFAULT_CONTOUR_THICKNESS,
+                              on_done=on_written, image_scale=img_scale, output_conf=output_conf)
+            image_results.append((root, file_iter_name, global_csv_row_counter, df_features))
+            global_csv_row_counter += num_detections #update global csv row counter
+            summary["peak_rss_mb"] = max(summary["peak_rss_mb"], image_peak_rss)
+
+            summary["images_processed"] += 1
+            summary["processed_files"].append(img_basename)
+            summary["output_files"].append(os.path.basename(output_filename))
+            summary["objects_detected"] += num_detections
+            if df_features is not None and not df_features.empty:
+                print(f"Successfully processed {img_basename}. Detected {num_detections} objects. "
+                      f"Peak RSS: {image_peak_rss:.0f} MB.")
+            else:
+                print(f"No valid objects detected in {img_basename} after filtering.")
+
+            # Report pool renders that have finished, in order
+            while render_futures and render_futures[0][0].done():
+                _collect_render(*render_futures.pop(0))
+    except BaseException:
+        # Stop the writer so its thread never outlives the run, without
+        # letting a writer error hide the one already propagating
+        if writer is not None:
+            try:
+                writer.close()
+            except Exception as close_error:
+                print(f"Warning: image writer also failed while aborting: {close_error}")
+        raise
+    if writer is not None:
+        writer.close()
+
+    for future, on_written in render_futures:
+        _collect_render(future, on_written)
+
+    # Annotated images are on disk now, so new results can be cached
+    for cache_key, detections, row_start, output_filename, encoding in to_cache:
+        cache.put(cache_key, detections, row_start,
+                  None if output_conf["LAZY"] else output_filename, encoding)
+
+    for stage, count in rejections.items():
+        summary["rejections"][stage] = summary["rejections"].get(stage, 0) + count
+    return image_results
+
+def _new_summary():
+    """Returns the empty summary dict that run_pipeline and run_incremental fill in."""
+    return {
+        "images_found": 0,
+        "images_processed": 0,
+        "objects_detected": 0,
+        "processed_files": [],
+        "output_files": [],
+        "peak_rss_mb": 0.0,
+        "rejections": {},
+        "cache_hits": 0,
+        "cache_misses": 0,
+        "grade_counts": {},
+        "weight_stats": None,
+    }
+
+def _print_run_summary(summary, cache):
+    print(f"\nTotal images attempted for processing: {summary['images_processed']}")
+    print(f"Peak RSS while processing an image: {summary['peak_rss_mb']:.0f} MB")
+    if summary["rejections"]:
+        print("\n--- Rejected Detections by Stage ---")
+        for stage, count in summary["rejections"].items():
+            print(f"{stage}: {count}")
+    if cache is not None:
+        print(f"Result cache: {summary['cache_hits']} hits, {summary['cache_misses']} misses")
+
+def run_pipeline(predictor, input_path=INPUT_PATH, output_path=OUTPUT_PATH,
+                 image_files=None, progress_callback=None, batch_size=DEFAULT_BATCH_SIZE,
+                 cache=None, decode_downscale=DEFAULT_DECODE_DOWNSCALE, output_conf=OUTPUT_CONF,
+                 image_names=None):
+    """
+    Runs the full pipeline over every image in input_path with an already
+    initialized predictor, writing annotated images and the combined CSV to
+    output_path. Returns a summary dict describing the run.
+
+    image_files optionally fixes the (root, filename) list to process instead
+    of walking input_path. progress_callback, if given, is called after every
+    image with a dict describing that image's outcome; for processed images
+    it fires once the annotated image is written and carries the image's
+    graded feature rows. batch_size images are sent through the model per
+    forward pass. cache, a ResultCache, lets previously seen images skip
+    inference. decode_downscale decodes large JPEGs at reduced scale (see
+    load_image); it is ignored for tiled predictors. output_conf sets the
+    encoding of the annotated images and whether they are drawn lazily.
+    image_names optionally maps filenames to the names the images are
+    reported under (in the CSV, progress and summary) and their annotated
+    images are named after, such as the original names of uploads.
+    """
+    summary = _new_summary()
+
+    # --- Prepare for Processing ---
+    if not os.path.exists(output_path):
+        os.makedirs(output_path)
+        print(f"Created output directory: {output_path}")
+
+    all_image_files = find_image_files(input_path) if image_files is None else list(image_files)
+    summary["images_found"] = len(all_image_files)
+
+    if not all_image_files:
+        print(f"No images found in {input_path} with suffixes {IMG_SUFFIXES}.")
+        return summary
+
     print(f"Found {len(all_image_files)} images to potentially process.")
 
-    all_processed_data_frames = []
-    processed_image_count = 0
-    global_csv_row_counter = 0 # initialize global counter for CSV row numbers
+    image_results = _process_images(predictor, all_image_files, output_path, summary,
+                                    progress_callback, batch_size, cache,
+                                    decode_downscale=decode_downscale, output_conf=output_conf,
+                                    image_names=image_names)
 
-    for i, (root, file_iter_name) in enumerate(all_image_files):
-        img_basename = os.path.basename(file_iter_name)
-        fullpath = os.path.join(root, file_iter_name)
+    # --- Finalize and Save ---
+    combined_df = finalize_data_and_save([df for _, _, _, df in image_results if not df.empty], output_path)
+    if combined_df is not None:
+        summary.update(grade_summary(combined_df))
+    _print_run_summary(summary, cache)
+    return summary
 
-        print(f"\nProcessing image {i + 1}/{len(all_image_files)}: {file_iter_name}")
-        
-        img_in = cv2.imread(fullpath)
-        if img_in is None:
-            print(f"Error: Could not read image {fullpath}. Skipping.")
-            continue
+# ==============================================================================
+# --- Incremental Processing ---
+# ==============================================================================
 
-        # Pass global_csv_row_counter and receive the updated counter
-        df_features, num_detections, updated_global_csv_counter = process_image_features(
-            predictor,
-            img_in,
-            img_basename,
-            global_csv_row_counter, # Pass the current global CSV row counter
-            output_scale=DEFAULT_OUTPUT_SCALE,
-            contour_thickness=DEFAULT_CONTOUR_THICKNESS,
-            border_filter_pixels=DEFAULT_BORDER_FILTER_PIXELS
-        )
-        global_csv_row_counter = updated_global_csv_counter #update global csv row counter with returned value
-        
-        processed_image_count += 1
-        if df_features is not None and not df_features.empty:
-            all_processed_data_frames.append(df_features)
-            print(f"Successfully processed {file_iter_name}. Detected {num_detections} objects.")
+def load_manifest(output_path, fingerprint):
+    """
+    Returns the per-file entries of the manifest in output_path, or an empty
+    dict if there is none or it was written under a different fingerprint.
+    """
+    try:
+        with open(os.path.join(output_path, MANIFEST_FILENAME)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get("fingerprint") != fingerprint:
+        print("Model or configuration changed since the last run; reprocessing every image.")
+        return {}
+    return manifest.get("files", {})
+
+def save_manifest(output_path, fingerprint, files):
+    """Atomically writes the manifest of processed files to output_path."""
+    path = os.path.join(output_path, MANIFEST_FILENAME)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"fingerprint": fingerprint, "files": files}, f,
+                  default=lambda o: o.item() if isinstance(o, np.generic) else str(o))
+    os.replace(tmp_path, path)
+
+def plan_incremental(all_image_files, input_path, output_path, previous, image_names=None,
+                     output_conf=OUTPUT_CONF):
+    """
+    Splits all_image_files into unchanged files, whose manifest entries are
+    returned by relative path, and files that need processing, returned as
+    (root, filename, relative path, os.stat result, sha256) tuples.
+
+    A file is unchanged when its size and mtime match the manifest, or when
+    only its mtime moved but its content hash still matches. Files whose
+    annotated image went missing (and is not waiting to be drawn lazily),
+    or would now be named differently, are processed again.
+    """
+    unchanged, to_process = {}, []
+    for root, f_name in all_image_files:
+        fullpath = os.path.join(root, f_name)
+        rel_path = os.path.relpath(fullpath, input_path)
+        try:
+            stat = os.stat(fullpath)
+        except OSError:
+            continue # Vanished since the walk
+
+        entry = previous.get(rel_path)
+        output_filename = os.path.join(output_path, entry["output_file"]) if entry is not None else None
+        if (entry is not None
+                and entry["output_file"] == annotated_filename(reported_name(f_name, image_names), output_conf)
+                and (os.path.exists(output_filename) or is_pending(output_filename))):
+            if entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                unchanged[rel_path] = entry
+                continue
+            sha256 = file_sha256(fullpath)
+            if entry["size"] == stat.st_size and entry["sha256"] == sha256:
+                unchanged[rel_path] = dict(entry, mtime_ns=stat.st_mtime_ns) # Touched, not modified
+                continue
         else:
-            print(f"No valid objects detected in {file_iter_name} after filtering.")
-        
-        sleep(0.1) # Small delay between processing images
+            sha256 = file_sha256(fullpath)
+        to_process.append((root, f_name, rel_path, stat, sha256))
+    return unchanged, to_process
 
-    # --- Finalize and Save ---
-    finalize_data_and_save(all_processed_data_frames, OUTPUT_PATH)
-    print(f"\nTotal images attempted for processing: {processed_image_count}")
+def _manifest_rows_to_dataframe(entry):
+    """Rebuilds an unchanged file's feature DataFrame, indexed by its CSV rows."""
+    df = pd.DataFrame(entry["rows"])
+    if "center" in df.columns:
+        df["center"] = df["center"].map(tuple) # JSON turned the (x, y) tuples into lists
+    df.index = pd.RangeIndex(entry["row_start"], entry["row_start"] + len(df))
+    return df
+
+def run_incremental(predictor, input_path=INPUT_PATH, output_path=OUTPUT_PATH,
+                    image_files=None, progress_callback=None, batch_size=DEFAULT_BATCH_SIZE,
+                    cache=None, fingerprint_extra=None, decode_downscale=DEFAULT_DECODE_DOWNSCALE,
+                    output_conf=OUTPUT_CONF, image_names=None):
+    """
+    Like run_pipeline, but only new or changed images go through the
+    predictor. Results of unchanged images come from the manifest kept in
+    output_path and are merged into the combined CSV.
+
+    Unchanged images keep their CSV row numbers, so their annotated images
+    stay valid without being redrawn; new and changed images are numbered
+    after the highest row in use. Rows of removed or changed images leave
+    gaps in object_id until the next full run.
+    """
+    summary = _new_summary()
+    summary["images_unchanged"] = 0
+    summary["images_removed"] = 0
+
+    if not os.path.exists(output_path):
+        os.makedirs(output_path)
+        print(f"Created output directory: {output_path}")
+
+    all_image_files = find_image_files(input_path) if image_files is None else list(image_files)
+    summary["images_found"] = len(all_image_files)
+
+    fingerprint = cache.fingerprint if cache is not None else model_fingerprint(fingerprint_extra)
+    previous = load_manifest(output_path, fingerprint)
+    unchanged, to_process = plan_incremental(all_image_files, input_path, output_path, previous,
+                                             image_names, output_conf)
+    summary["images_unchanged"] = len(unchanged)
+    summary["images_removed"] = len(set(previous) - set(unchanged) - {rel for _, _, rel, _, _ in to_process})
+    print(f"Found {len(all_image_files)} images: {len(unchanged)} unchanged, "
+          f"{len(to_process)} new or changed, {summary['images_removed']} removed since the last run.")
+
+    positions = {image_file: i for i, image_file in enumerate(all_image_files)}
+    if progress_callback is not None:
+        for i, (root, f_name) in enumerate(all_image_files):
+            entry = unchanged.get(os.path.relpath(os.path.join(root, f_name), input_path))
+            if entry is not None:
+                rows, grade_counts = graded_rows(_manifest_rows_to_dataframe(entry), entry["row_start"])
+                progress_callback({"index": i, "total": len(all_image_files),
+                                   "filename": reported_name(f_name, image_names), "status": "unchanged",
+                                   "objects_detected": entry["num_objects"],
+                                   "output_file": entry["output_file"],
+                                   "rows": rows,
+                                   "grade_counts": grade_counts})
+
+    def on_progress(event):
+        # Report positions in the full file list, not in the processed subset
+        root, f_name = to_process[event["index"]][:2]
+        progress_callback(dict(event, index=positions[(root, f_name)], total=len(all_image_files)))
+
+    next_row = max((entry["row_start"] + entry["num_objects"] for entry in unchanged.values()), default=0)
+    image_results = _process_images(predictor, [(root, f_name) for root, f_name, _, _, _ in to_process],
+                                    output_path, summary,
+                                    on_progress if progress_callback is not None else None,
+                                    batch_size, cache, csv_row_start=next_row,
+                                    decode_downscale=decode_downscale, output_conf=output_conf,
+                                    image_names=image_names)
+
+    # --- Merge with the stored results and save ---
+    files = dict(unchanged)
+    frames = [_manifest_rows_to_dataframe(entry) for entry in unchanged.values() if entry["num_objects"]]
+    planned = {(root, f_name): (rel_path, stat, sha256) for root, f_name, rel_path, stat, sha256 in to_process}
+    for root, f_name, row_start, df in image_results:
+        rel_path, stat, sha256 = planned[(root, f_name)]
+        files[rel_path] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": sha256,
+            "output_file": annotated_filename(reported_name(f_name, image_names), output_conf),
+            "row_start": row_start,
+            "num_objects": len(df),
+            "rows": df.to_dict("records"),
+        }
+        if not df.empty:
+            frames.append(df.set_axis(pd.RangeIndex(row_start, row_start + len(df))))
+
+    frames.sort(key=lambda df: df.index[0])
+    combined_df = finalize_data_and_save(frames, output_path, preserve_row_ids=True)
+    if combined_df is not None:
+        summary.update(grade_summary(combined_df))
+    save_manifest(output_path, fingerprint, files)
+    _print_run_summary(summary, cache)
+    return summary
+
+def parse_args():
+    """Parses command line options for the pipeline."""
+    parser = argparse.ArgumentParser(description="Detect, measure and grade objects in images.")
+    parser.add_argument("--input", default=INPUT_PATH,
+                        help=f"Directory of images to process (default: {INPUT_PATH})")
+    parser.add_argument("--output", default=OUTPUT_PATH,
+                        help=f"Directory for annotated images and the combined CSV (default: {OUTPUT_PATH})")
+    parser.add_argument("--workers", type=int, default=DEFAULT_NUM_WORKERS,
+                        help="Number of inference processes, each with its own predictor (default: 1)")
+    parser.add_argument("--torch-threads", type=int, default=None,
+                        help="Torch intra-op threads per worker (default: CPU count / workers)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Images (or tiles, when tiling) per forward pass (default: 1)")
+    parser.add_argument("--tile-size", type=int, default=DEFAULT_TILE_SIZE,
+                        help="Run inference on overlapping tiles of this size in pixels (default: off)")
+    parser.add_argument("--tile-overlap", type=int, default=DEFAULT_TILE_OVERLAP,
+                        help=f"Overlap between neighbouring tiles in pixels (default: {DEFAULT_TILE_OVERLAP})")
+    parser.add_argument("--full-res-decode", action="store_true",
+                        help="Always decode images at full resolution instead of reducing large JPEGs")
+    parser.add_argument("--output-format", choices=sorted(OUTPUT_EXTENSIONS), default=OUTPUT_CONF["FORMAT"],
+                        help=f"Encoding of the annotated images (default: {OUTPUT_CONF['FORMAT']})")
+    parser.add_argument("--output-quality", type=int, default=OUTPUT_CONF["QUALITY"],
+                        help=f"JPEG/WebP quality of the annotated images (default: {OUTPUT_CONF['QUALITY']})")
+    parser.add_argument("--thumbnail-size", type=int, default=OUTPUT_CONF["THUMBNAIL_SIZE"],
+                        help=f"Longest thumbnail edge in pixels, 0 for none (default: {OUTPUT_CONF['THUMBNAIL_SIZE']})")
+    parser.add_argument("--lazy-render", action="store_true",
+                        help="Store contours and draw annotated images on first request instead of during the run")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only process images that are new or changed since the last run")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Directory of the per-image result cache (default: no cache)")
+    parser.add_argument("--cache-max-mb", type=int, default=DEFAULT_CACHE_MAX_BYTES // 1024**2,
+                        help="Size bound of the result cache in MB")
+    return parser.parse_args()
+
+def main():
+    """Main function to orchestrate the image processing pipeline."""
+    args = parse_args()
+    decode_downscale = not args.full_res_decode
+    run_settings = {"tile_size": args.tile_size, "tile_overlap": args.tile_overlap,
+                    "decode_downscale": decode_downscale}
+    output_conf = dict(OUTPUT_CONF, FORMAT=args.output_format, QUALITY=args.output_quality,
+                       THUMBNAIL_SIZE=args.thumbnail_size, LAZY=args.lazy_render)
+    cache = None
+    if args.cache_dir:
+        cache = ResultCache(args.cache_dir, args.cache_max_mb * 1024**2, fingerprint_extra=run_settings)
+
+    def run(predictor):
+        if args.incremental:
+            return run_incremental(predictor, args.input, args.output, batch_size=args.batch_size,
+                                   cache=cache, fingerprint_extra=run_settings,
+                                   decode_downscale=decode_downscale, output_conf=output_conf)
+        return run_pipeline(predictor, args.input, args.output, batch_size=args.batch_size, cache=cache,
+                            decode_downscale=decode_downscale, output_conf=output_conf)
+
+    if args.workers > 1:
+        predictor = InferencePool(args.workers, args.torch_threads,
+                                  tile_size=args.tile_size, tile_overlap=args.tile_overlap,
+                                  tile_batch_size=args.batch_size)
+        print(f"Started inference pool with {predictor.num_workers} workers "
+              f"x {predictor.torch_threads} torch threads.")
+        try:
+            run(predictor)
+        finally:
+            predictor.shutdown()
+        return
+
+    device = check_cuda() # Check CUDA and set device
+    if args.torch_threads:
+        torch.set_num_threads(args.torch_threads)
+    predictor = initialize_predictor(device)
+    if args.tile_size:
+        predictor = TiledPredictor(predictor, args.tile_size, args.tile_overlap,
+                                   tile_batch_size=args.batch_size)
+    run(predictor)
 
 if __name__ == "__main__":
     print("--- Starting Image Processing Script ---")
@@ -0,0 +1,389 @@
+#!/usr/bin/env python
+"""
+Micro-benchmarks for the image processing pipeline.
+
+Usage:
+    python benchmark.py batch --sizes 1 2 4 8
+    python benchmark.py tiling --tile-size 1024 --overlap 256
+    python benchmark.py decode --images 8 --detect
+    python benchmark.py render --formats jpeg webp png --quality 85
+    python benchmark.py db --requests 2000 --threads 4
+    python benchmark.py db-async --rows 200000 --requests 400
+
+Each subcommand prints a small table; run from the backend directory so the
+model config and weights paths in MaskrcnnGradAidAg resolve.
+"""
+
+import argparse
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+import database
+import MaskrcnnGradAidAg as pipeline
+from services import image_service, user_analysis_service, user_service
+
+
+def load_images(input_path, limit):
+    """Decode up to limit images from input_path, in pipeline order."""
+    images = []
+    for root, f_name in pipeline.find_image_files(input_path)[:limit]:
+        img = cv2.imread(os.path.join(root, f_name))
+        if img is not None:
+            images.append(img)
+    if not images:
+        raise SystemExit(f"No readable images found in {input_path}")
+    return images
+
+
+def bench_batch(args):
+    """Images/sec of batched inference for each batch size."""
+    images = load_images(args.input, args.images)
+    predictor = pipeline.create_predictor(pipeline.check_cuda())
+
+    # Warm-up so lazy initialization is not charged to the first batch size
+    pipeline.predict_images(predictor, images[:1])
+
+    print(f"\n{'batch_size':>10} {'images':>8} {'seconds':>10} {'images/sec':>12}")
+    for batch_size in args.sizes:
+        start = time.perf_counter()
+        for k in range(0, len(images), batch_size):
+            pipeline.predict_images(predictor, images[k:k + batch_size])
+        elapsed = time.perf_counter() - start
+        print(f"{batch_size:>10} {len(images):>8} {elapsed:>10.2f} {len(images) / elapsed:>12.2f}")
+
+
+def box_iou(a, b):
+    """IoU between every box in a (N, 4) and every box in b (M, 4)."""
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)))
+    ix0 = np.maximum(a[:, None, 0], b[None, :, 0])
+    iy0 = np.maximum(a[:, None, 1], b[None, :, 1])
+    ix1 = np.minimum(a[:, None, 2], b[None, :, 2])
+    iy1 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(ix1 - ix0, 0, None) * np.clip(iy1 - iy0, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / (area_a[:, None] + area_b[None, :] - inter)
+
+
+def detection_boxes(detections):
+    """(N, 4) x0, y0, x1, y1 boxes of extracted detections."""
+    return np.array([[d['dims']['top_left_x'], d['dims']['top_left_y'],
+                      d['dims']['bottom_right_x'], d['dims']['bottom_right_y']]
+                     for d in detections], dtype=np.float64).reshape(-1, 4)
+
+
+def bench_tiling(args):
+    """
+    Throughput of whole-image against tiled inference, and the recall of the
+    whole-image detections under tiling (box IoU >= --match-iou). Tiling
+    usually finds extra small objects, which are reported separately.
+    """
+    images = load_images(args.input, args.images)
+    predictor = pipeline.create_predictor(pipeline.check_cuda())
+    tiled = pipeline.TiledPredictor(predictor, args.tile_size, args.overlap,
+                                    tile_batch_size=args.batch_size)
+    pipeline.predict_images(predictor, images[:1])
+
+    results = {}
+    print(f"\n{'mode':>10} {'images':>8} {'objects':>8} {'seconds':>10} {'images/sec':>12}")
+    for mode, model in (("whole", predictor), ("tiled", tiled)):
+        start = time.perf_counter()
+        detections = []
+        for k in range(0, len(images), args.batch_size):
+            detections.extend(pipeline.detect_objects_batch(model, images[k:k + args.batch_size],
+                                                            pipeline.DEFAULT_BORDER_FILTER_PIXELS))
+        elapsed = time.perf_counter() - start
+        results[mode] = detections
+        objects = sum(len(d) for d in detections)
+        print(f"{mode:>10} {len(images):>8} {objects:>8} {elapsed:>10.2f} {len(images) / elapsed:>12.2f}")
+
+    matched = reference = extra = 0
+    for whole, tiles in zip(results["whole"], results["tiled"]):
+        iou = box_iou(detection_boxes(whole), detection_boxes(tiles))
+        reference += len(whole)
+        if iou.size:
+            matched += int((iou.max(axis=1) >= args.match_iou).sum())
+            extra += int((iou.max(axis=0) < args.match_iou).sum())
+        else:
+            extra += len(tiles)
+    recall = matched / reference if reference else 1.0
+    print(f"\nrecall of whole-image detections: {recall:.3f} ({matched}/{reference}), "
+          f"tiled-only detections: {extra}")
+
+
+def bench_decode(args):
+    """
+    Decode time and decoded-image memory of full-resolution against reduced
+    JPEG decoding, and with --detect the recall of the full-resolution
+    detections on the reduced decode (box IoU >= --match-iou).
+    """
+    paths = [os.path.join(root, f_name)
+             for root, f_name in pipeline.find_image_files(args.input)[:args.images]]
+    if not paths:
+        raise SystemExit(f"No images found in {args.input}")
+
+    loaders = (("full", lambda path: (cv2.imread(path), 1)),
+               ("reduced", lambda path: pipeline.load_image(path)))
+    decoded = {}
+    print(f"\n{'mode':>10} {'images':>8} {'ms/image':>10} {'MB/image':>10}")
+    for mode, load in loaders:
+        start = time.perf_counter()
+        decoded[mode] = [load(path) for path in paths]
+        elapsed = time.perf_counter() - start
+        megabytes = sum(img.nbytes for img, _ in decoded[mode] if img is not None) / (1024 * 1024)
+        print(f"{mode:>10} {len(paths):>8} {elapsed * 1000 / len(paths):>10.1f} "
+              f"{megabytes / len(paths):>10.1f}")
+
+    if not args.detect:
+        return
+    predictor = pipeline.create_predictor(pipeline.check_cuda())
+    detections = {}
+    for mode, images in decoded.items():
+        images = [(img, scale) for img, scale in images if img is not None]
+        detections[mode] = pipeline.detect_objects_batch(
+            predictor, [img for img, _ in images], pipeline.DEFAULT_BORDER_FILTER_PIXELS,
+            scales=[scale for _, scale in images])
+
+    matched = reference = 0
+    for full, reduced in zip(detections["full"], detections["reduced"]):
+        iou = box_iou(detection_boxes(full), detection_boxes(reduced))
+        reference += len(full)
+        if iou.size:
+            matched += int((iou.max(axis=1) >= args.match_iou).sum())
+    recall = matched / reference if reference else 1.0
+    print(f"\nrecall of full-resolution detections: {recall:.3f} ({matched}/{reference})")
+
+
+def bench_render(args):
+    """
+    Time and size of writing the annotated image plus thumbnail in each
+    output format, against the time a lazy run spends storing the image
+    for drawing on first request.
+    """
+    paths = [os.path.join(root, f_name)
+             for root, f_name in pipeline.find_image_files(args.input)[:args.images]]
+    loaded = [(path, *pipeline.load_image(path)) for path in paths]
+    loaded = [(path, img, scale) for path, img, scale in loaded if img is not None]
+    if not loaded:
+        raise SystemExit(f"No readable images found in {args.input}")
+    predictor = pipeline.create_predictor(pipeline.check_cuda())
+    detections = pipeline.detect_objects_batch(predictor, [img for _, img, _ in loaded],
+                                               pipeline.DEFAULT_BORDER_FILTER_PIXELS,
+                                               scales=[scale for _, _, scale in loaded])
+
+    print(f"\n{'mode':>10} {'images':>8} {'ms/image':>10} {'KB/image':>10}")
+    with tempfile.TemporaryDirectory() as scratch:
+        modes = [(output_format, dict(pipeline.OUTPUT_CONF, FORMAT=output_format, QUALITY=args.quality))
+                 for output_format in args.formats]
+        modes.append(("lazy", dict(pipeline.OUTPUT_CONF, LAZY=True)))
+        for mode, output_conf in modes:
+            elapsed = 0.0
+            written = 0
+            for (path, img, scale), image_detections in zip(loaded, detections):
+                output_filename = os.path.join(scratch, pipeline.annotated_filename(os.path.basename(path),
+                                                                                    output_conf))
+                img = img.copy() # Drawing is in place; keep the decoded image for the next mode
+                start = time.perf_counter()
+                if output_conf["LAZY"]:
+                    pipeline.save_pending(path, image_detections, 0, output_filename, output_conf=output_conf)
+                else:
+                    pipeline.render_detections(img, image_detections, 0, output_filename,
+                                               image_scale=scale, output_conf=output_conf, in_place=True)
+                elapsed += time.perf_counter() - start
+                if os.path.exists(output_filename):
+                    written += os.path.getsize(output_filename)
+            print(f"{mode:>10} {len(loaded):>8} {elapsed * 1000 / len(loaded):>10.1f} "
+                  f"{written / 1024 / len(loaded):>10.1f}")
+
+
+def legacy_connection():
+    """A fresh connection per call, as get_connection used to open them."""
+    conn = sqlite3.connect(database.DB_PATH)
+    conn.execute('PRAGMA journal_mode=WAL')
+    return conn
+
+
+def db_request(k):
+    """One simulated API request: a user lookup, an insert and a per-user read."""
+    user = user_service.get_or_create_name(f"bench-user-{k % 16}")
+    if k % 2:
+        image_service.add_image_match(f"bench_{k}.jpg", user['id'])
+    else:
+        user_analysis_service.add_analysis(f"bench_{k}.jpg", 0, 1200.0, 0, 0, 40, 40, "(20, 20)",
+                                           39.4, 39.4, 31483.8, 0.97, 0.92, 1.0, 0.54,
+                                           0.19, 0.008, "Not Marketable", user['id'])
+    image_service.get_images_by_user(user['id'])
+    user_analysis_service.get_user_analyses(user['id'])
+
+
+def bench_db(args):
+    """
+    Requests/sec of the service layer against a scratch database, opening a
+    connection per call (before) and reusing thread-local connections (after).
+    """
+    patched = (database, user_service, image_service, user_analysis_service)
+    persistent = database.get_connection
+    original_path = database.DB_PATH
+
+    print(f"\n{'connections':>12} {'threads':>8} {'requests':>9} {'seconds':>10} {'requests/sec':>13}")
+    with tempfile.TemporaryDirectory() as scratch:
+        for mode, get_connection in (("per-call", legacy_connection), ("persistent", persistent)):
+            database.DB_PATH = os.path.join(scratch, f"{mode}.db")
+            for module in patched:
+                module.get_connection = get_connection
+            try:
+                database.init_db()
+                with ThreadPoolExecutor(max_workers=args.threads) as executor:
+                    start = time.perf_counter()
+                    list(executor.map(db_request, range(args.requests)))
+                    elapsed = time.perf_counter() - start
+            finally:
+                for module in patched:
+                    module.get_connection = persistent
+                database.DB_PATH = original_path
+            print(f"{mode:>12} {args.threads:>8} {args.requests:>9} {elapsed:>10.2f} "
+                  f"{args.requests / elapsed:>13.1f}")
+
+
+def db_latency_app(blocking):
+    """
+    A two-route app over the analysis tables: a slow full-table read and a
+    fast per-user read, either calling SQLite on the event loop (blocking)
+    or awaiting it on the database pool.
+    """
+    from fastapi import FastAPI
+
+    app = FastAPI()
+
+    @app.get("/all")
+    async def all_analyses():
+        if blocking:
+            rows = user_analysis_service.get_all_analyses()
+        else:
+            rows = await database.run_db(user_analysis_service.get_all_analyses)
+        return {"count": len(rows)}
+
+    @app.get("/images/{user_id}")
+    async def user_images(user_id: int):
+        if blocking:
+            images = image_service.get_images_by_user(user_id)
+        else:
+            images = await database.run_db(image_service.get_images_by_user, user_id)
+        return {"count": len(images)}
+
+    return app
+
+
+def bench_db_async(args):
+    """
+    Latency of fast per-user reads issued concurrently with slow full-table
+    reads, with SQLite called on the event loop (before) and awaited on the
+    database pool (after).
+    """
+    import httpx
+
+    async def run(app):
+        latencies = []
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            t0 = time.perf_counter()
+
+            async def fast(k):
+                # Timed from the scheduled arrival, so time spent waiting for a
+                # blocked event loop to even start the request is counted
+                arrival = t0 + k * args.interval
+                await asyncio.sleep(arrival - time.perf_counter())
+                await client.get(f"/images/{k % 16 + 1}")
+                latencies.append(time.perf_counter() - arrival)
+
+            async def slow(k):
+                await asyncio.sleep(k * args.requests * args.interval / args.slow)
+                await client.get("/all")
+
+            await asyncio.gather(*(fast(k) for k in range(args.requests)),
+                                 *(slow(k) for k in range(args.slow)))
+        return np.array(latencies) * 1000
+
+    original_path = database.DB_PATH
+    with tempfile.TemporaryDirectory() as scratch:
+        database.DB_PATH = os.path.join(scratch, "bench.db")
+        try:
+            database.init_db()
+            record = {field: 0 for field in user_analysis_service.ANALYSIS_FIELDS}
+            record.update(image_name="bench.jpg", center="(0, 0)", grade="Marketable")
+            for user_id in range(1, 17):
+                user_analysis_service.add_analyses([record] * (args.rows // 16), user_id)
+                for k in range(20):
+                    image_service.add_image_match(f"bench_{user_id}_{k}.jpg", user_id)
+
+            print(f"\n{'mode':>10} {'requests':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+            for mode, blocking in (("blocking", True), ("pool", False)):
+                latencies = asyncio.run(run(db_latency_app(blocking)))
+                p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+                print(f"{mode:>10} {len(latencies):>9} {p50:>9.1f} {p95:>9.1f} {p99:>9.1f} "
+                      f"{latencies.max():>9.1f}")
+        finally:
+            database.DB_PATH = original_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    batch = subparsers.add_parser("batch", help="Images/sec against inference batch size")
+    batch.add_argument("--input", default=pipeline.INPUT_PATH, help="Directory of benchmark images")
+    batch.add_argument("--images", type=int, default=16, help="Number of images to run")
+    batch.add_argument("--sizes", type=int, nargs="+", default=[1, 2, 4, 8], help="Batch sizes to compare")
+    batch.set_defaults(func=bench_batch)
+
+    tiling = subparsers.add_parser("tiling", help="Throughput and recall of tiled against whole-image inference")
+    tiling.add_argument("--input", default=pipeline.INPUT_PATH, help="Directory of benchmark images")
+    tiling.add_argument("--images", type=int, default=8, help="Number of images to run")
+    tiling.add_argument("--tile-size", type=int, default=1024, help="Tile edge in pixels")
+    tiling.add_argument("--overlap", type=int, default=pipeline.DEFAULT_TILE_OVERLAP, help="Tile overlap in pixels")
+    tiling.add_argument("--batch-size", type=int, default=4, help="Images or tiles per forward pass")
+    tiling.add_argument("--match-iou", type=float, default=0.5, help="Box IoU at which detections match")
+    tiling.set_defaults(func=bench_tiling)
+
+    decode = subparsers.add_parser("decode", help="Decode time and memory of full against reduced JPEG decoding")
+    decode.add_argument("--input", default=pipeline.INPUT_PATH, help="Directory of benchmark images")
+    decode.add_argument("--images", type=int, default=8, help="Number of images to decode")
+    decode.add_argument("--detect", action="store_true", help="Also compare detections of both decodes")
+    decode.add_argument("--match-iou", type=float, default=0.5, help="Box IoU at which detections match")
+    decode.set_defaults(func=bench_decode)
+
+    render = subparsers.add_parser("render", help="Annotated-image write time and size per output format")
+    render.add_argument("--input", default=pipeline.INPUT_PATH, help="Directory of benchmark images")
+    render.add_argument("--images", type=int, default=8, help="Number of images to render")
+    render.add_argument("--formats", nargs="+", default=sorted(pipeline.OUTPUT_EXTENSIONS),
+                        choices=sorted(pipeline.OUTPUT_EXTENSIONS), help="Output formats to compare")
+    render.add_argument("--quality", type=int, default=pipeline.OUTPUT_CONF["QUALITY"],
+                        help="JPEG/WebP quality")
+    render.set_defaults(func=bench_render)
+
+    db = subparsers.add_parser("db", help="Service-layer requests/sec with per-call against persistent connections")
+    db.add_argument("--requests", type=int, default=2000, help="Simulated requests per mode")
+    db.add_argument("--threads", type=int, default=4, help="Concurrent request threads")
+    db.set_defaults(func=bench_db)
+
+    db_async = subparsers.add_parser("db-async", help="Per-user read latency under concurrent full-table reads")
+    db_async.add_argument("--rows", type=int, default=200000, help="Analysis rows in the scratch database")
+    db_async.add_argument("--requests", type=int, default=400, help="Fast per-user reads to time")
+    db_async.add_argument("--slow", type=int, default=2, help="Full-table reads issued alongside them")
+    db_async.add_argument("--interval", type=float, default=0.005, help="Seconds between fast request arrivals")
+    db_async.set_defaults(func=bench_db_async)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,126 @@
+import asyncio
 import sqlite3
 import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 # Database file path
 DB_PATH = os.path.join(os.path.dirname(__file__), 'database.db')
 
+# Connection tuning, applied once when a thread opens its connection
+BUSY_TIMEOUT_MS = 5000               # Wait this long on a locked database instead of failing
+CACHE_SIZE_KIB = 64 * 1024           # Page cache per connection
+MMAP_SIZE_BYTES = 256 * 1024 * 1024  # Memory-map reads of the database file
+STATEMENT_CACHE_SIZE = 256           # Prepared statements kept per connection
 
-def get_connection():
-    """Get a database connection with WAL mode enabled."""
-    conn = sqlite3.connect(DB_PATH)
+# Async access: database calls from request handlers run on a dedicated pool
+DB_EXECUTOR_WORKERS = 4  # Threads, and so connections, serving async callers
+DB_MAX_PENDING = 64      # Calls queued or running on the pool; further callers wait their turn
+
+_local = threading.local()
+
+
+def connect(db_path=None, check_same_thread=True):
+    """
+    Open a new connection with WAL mode and the tuned pragmas applied.
+    Pass check_same_thread=False for a connection handed between threads
+    (never concurrently).
+    """
+    conn = sqlite3.connect(db_path or DB_PATH, timeout=BUSY_TIMEOUT_MS / 1000,
+                           cached_statements=STATEMENT_CACHE_SIZE,
+                           check_same_thread=check_same_thread)
     conn.execute('PRAGMA journal_mode=WAL')
+    # NORMAL is durable across application crashes in WAL mode; only an OS
+    # crash or power loss can drop the last commits
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA cache_size=-{CACHE_SIZE_KIB}')
+    conn.execute(f'PRAGMA mmap_size={MMAP_SIZE_BYTES}')
+    conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
     return conn
 
 
+def get_connection():
+    """
+    Get this thread's long-lived database connection, opening it on first use.
+
+    The connection is shared by every call on the thread, so callers must not
+    close it. Wrap writes in `with conn:` to commit them (or roll them back on
+    error) as one transaction. Statements are prepared once and reused from
+    the connection's statement cache.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.path != DB_PATH:
+        if conn is not None:
+            conn.close()
+        conn = _local.conn = connect()
+        _local.path = DB_PATH
+    return conn
+
+
+def close_connection():
+    """Close this thread's connection, if it has one."""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+
+_db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix='db')
+_pending_slots = weakref.WeakKeyDictionary()  # Event loop -> semaphore bounding its queued calls
+
+
+async def run_db(func, *args, **kwargs):
+    """
+    Run a synchronous database function on the database pool and await it.
+
+    Keeps the event loop free while SQLite works, so one slow query does not
+    stall every other request. At most DB_MAX_PENDING calls are handed to the
+    pool at once; beyond that callers wait here rather than growing its queue.
+    """
+    loop = asyncio.get_running_loop()
+    slots = _pending_slots.get(loop)
+    if slots is None:
+        slots = _pending_slots[loop] = asyncio.Semaphore(DB_MAX_PENDING)
+    async with slots:
+        return await loop.run_in_executor(_db_executor, partial(func, *args, **kwargs))
+
+
 def init_db():
-    """Initialize the database and create tables if they don't exist."""
-    conn = get_connection()
-    cursor = conn.cursor()
+    """Initialize the database, bringing its schema up to the latest version."""
+    migrate(get_connection())
+
+
+def migrate(conn):
+    """
+    Apply every migration newer than the database's schema version.
+
+    The version is kept in PRAGMA user_version. Each migration runs in its
+    own transaction together with the version bump, so a failed migration
+    leaves the database at the previous version.
+
+    Returns:
+        int: The schema version after migrating
+    """
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for target, migration in MIGRATIONS:
+        if target <= version:
+            continue
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            migration(conn.cursor())
+            conn.execute(f'PRAGMA user_version = {target}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        version = target
+    return version
 
+
+def _create_tables(cursor):
+    """Migration 1: create every table that does not exist yet."""
     # Create user table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS user (
@@ -83,19 +187,153 @@ def init_db():
         )
     ''')
 
-    conn.commit()
-    conn.close()
+
+def _merge_duplicate_users(cursor):
+    """
+    Fold users that share a name into the one with the lowest id, the row
+    get_or_create_name has been returning, so a unique index can be built.
+    """
+    cursor.execute('''
+        SELECT name, MIN(id) FROM user GROUP BY name HAVING COUNT(*) > 1
+    ''')
+    for name, keep_id in cursor.fetchall():
+        duplicate_ids = [row[0] for row in cursor.execute(
+            'SELECT id FROM user WHERE name = ? AND id != ?', (name, keep_id)).fetchall()]
+        placeholders = ', '.join('?' * len(duplicate_ids))
+        for table in ('image_match', 'user_analysis'):
+            cursor.execute(f'UPDATE {table} SET user_id = ? WHERE user_id IN ({placeholders})',
+                           (keep_id, *duplicate_ids))
+        # user_profit allows one row per user; keep the kept user's own row if it has one
+        cursor.execute(f'UPDATE OR IGNORE user_profit SET user_id = ? WHERE user_id IN ({placeholders})',
+                       (keep_id, *duplicate_ids))
+        cursor.execute(f'DELETE FROM user_profit WHERE user_id IN ({placeholders})', duplicate_ids)
+        cursor.execute(f'DELETE FROM user WHERE id IN ({placeholders})', duplicate_ids)
+
+
+def _add_indexes(cursor):
+    """Migration 2: index the per-user and per-image lookups."""
+    _merge_duplicate_users(cursor)
+    # get_or_create_name
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_user_name ON user (name)')
+    # get_user_analyses: filter on user_id, already ordered by object_id
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_user_analysis_user_object
+        ON user_analysis (user_id, object_id)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_user_analysis_image_name
+        ON user_analysis (image_name)
+    ''')
+    # get_images_by_user, and image ownership checks by name
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_image_match_user_image
+        ON image_match (user_id, image_name)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_image_match_image_name
+        ON image_match (image_name)
+    ''')
+
+
+# Running per-user totals of user_analysis, in the column order of the triggers below
+_ROLLUP_COLUMNS = (
+    'total_classifications', 'marketable_count', 'not_marketable_count', 'ungraded_count',
+    'weight_count', 'total_weight_oz', 'total_price_usd'
+)
+# The contribution of one analysis row (NEW or OLD) to each rollup column
+_ROLLUP_TERMS = (
+    '1',
+    "IFNULL({row}.grade = 'Marketable', 0)",
+    "IFNULL({row}.grade = 'Not Marketable', 0)",
+    '{row}.grade IS NULL',
+    '{row}.weight_oz IS NOT NULL',
+    'IFNULL({row}.weight_oz, 0)',
+    'IFNULL({row}.price_usd, 0)'
+)
+
+
+def _add_analysis_rollup(cursor):
+    """
+    Migration 3: keep running per-user grade counts, weight and price totals
+    in user_analysis_rollup.
+
+    Triggers update the rollup in the same statement (and so the same
+    transaction) as every insert, update and delete on user_analysis, so
+    the totals can be read in O(1) instead of scanning a user's records.
+    A user's row is dropped when their last record is deleted.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_analysis_rollup (
+            user_id INTEGER NOT NULL PRIMARY KEY,
+            total_classifications INTEGER NOT NULL DEFAULT 0,
+            marketable_count INTEGER NOT NULL DEFAULT 0,
+            not_marketable_count INTEGER NOT NULL DEFAULT 0,
+            ungraded_count INTEGER NOT NULL DEFAULT 0,
+            weight_count INTEGER NOT NULL DEFAULT 0,
+            total_weight_oz REAL NOT NULL DEFAULT 0,
+            total_price_usd REAL NOT NULL DEFAULT 0,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES user (id)
+        )
+    ''')
+
+    columns = ', '.join(_ROLLUP_COLUMNS)
+    add = ', '.join(f'{c} = {c} + excluded.{c}' for c in _ROLLUP_COLUMNS)
+    new_terms = ', '.join(t.format(row='NEW') for t in _ROLLUP_TERMS)
+    subtract = ', '.join(f'{c} = {c} - ({t.format(row="OLD")})' for c, t in zip(_ROLLUP_COLUMNS, _ROLLUP_TERMS))
+    insert_new = f'''
+        INSERT INTO user_analysis_rollup (user_id, {columns}) VALUES (NEW.user_id, {new_terms})
+        ON CONFLICT (user_id) DO UPDATE SET {add}, updated_at = CURRENT_TIMESTAMP;
+    '''
+    remove_old = f'''
+        UPDATE user_analysis_rollup SET {subtract}, updated_at = CURRENT_TIMESTAMP
+        WHERE user_id = OLD.user_id;
+        DELETE FROM user_analysis_rollup WHERE user_id = OLD.user_id AND total_classifications <= 0;
+    '''
+
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS user_analysis_rollup_insert
+        AFTER INSERT ON user_analysis WHEN NEW.user_id IS NOT NULL
+        BEGIN {insert_new} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS user_analysis_rollup_delete
+        AFTER DELETE ON user_analysis WHEN OLD.user_id IS NOT NULL
+        BEGIN {remove_old} END
+    ''')
+    # Assumes both user_ids are set; user_analysis rows always get one
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS user_analysis_rollup_update
+        AFTER UPDATE ON user_analysis WHEN OLD.user_id IS NOT NULL AND NEW.user_id IS NOT NULL
+        BEGIN {remove_old} {insert_new} END
+    ''')
+
+    # Backfill from the records that already exist
+    sums = ', '.join(f'TOTAL({t.format(row="user_analysis")})' for t in _ROLLUP_TERMS)
+    cursor.execute(f'''
+        INSERT OR REPLACE INTO user_analysis_rollup (user_id, {columns})
+        SELECT user_id, {sums}
+        FROM user_analysis
+        WHERE user_id IS NOT NULL
+        GROUP BY user_id
+    ''')
+
+
+# Schema migrations as (version, function), applied in order by migrate().
+# Append new migrations; never edit or reorder applied ones.
+MIGRATIONS = [
+    (1, _create_tables),
+    (2, _add_indexes),
+    (3, _add_analysis_rollup),
+]
 
 
 def add_user(name):
     """Add a new user to the database."""
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('INSERT INTO user (name) VALUES (?)', (name,))
-    conn.commit()
-    user_id = cursor.lastrowid
-    conn.close()
-    return user_id
+    with conn:
+        cursor = conn.execute('INSERT INTO user (name) VALUES (?)', (name,))
+    return cursor.lastrowid
 
 
 def get_user(user_id):
@@ -103,9 +341,7 @@ def get_user(user_id):
     conn = get_connection()
     cursor = conn.cursor()
     cursor.execute('SELECT id, name FROM user WHERE id = ?', (user_id,))
-    user = cursor.fetchone()
-    conn.close()
-    return user
+    return cursor.fetchone()
 
 
 def get_all_users():
@@ -113,52 +349,44 @@ def get_all_users():
     conn = get_connection()
     cursor = conn.cursor()
     cursor.execute('SELECT id, name FROM user')
-    users = cursor.fetchall()
-    conn.close()
-    return users
+    return cursor.fetchall()
 
 
 def delete_user(user_id):
     """Delete a user by ID."""
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM user WHERE id = ?', (user_id,))
-    conn.commit()
-    rows_affected = cursor.rowcount
-    conn.close()
-    return rows_affected
+    with conn:
+        cursor = conn.execute('DELETE FROM user WHERE id = ?', (user_id,))
+    return cursor.rowcount
 
 
 def save_user_profit(user_id, scenario, profit_data):
     """Save or update user profit data. Uses REPLACE to avoid duplicates. Updates timestamp on every save."""
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT OR REPLACE INTO user_profit (
-            user_id, scenario, total_profit, total_revenue, total_penalty,
-            marketable_proportion, not_marketable_proportion,
-            total_classifications, total_marketable_classifications,
-            total_not_marketable_classifications, total_marketable_revenue,
-            total_not_marketable_revenue, timestamp
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-    ''', (
-        user_id,
-        scenario,
-        profit_data.get('total_profit'),
-        profit_data.get('total_revenue'),
-        profit_data.get('total_penalty'),
-        profit_data.get('marketable_proportion'),
-        profit_data.get('not_marketable_proportion'),
-        profit_data.get('total_classifications'),
-        profit_data.get('total_marketable_classifications'),
-        profit_data.get('total_not_marketable_classifications'),
-        profit_data.get('total_marketable_revenue'),
-        profit_data.get('total_not_marketable_revenue')
-    ))
-    conn.commit()
-    profit_id = cursor.lastrowid
-    conn.close()
-    return profit_id
+    with conn:
+        cursor = conn.execute('''
+            INSERT OR REPLACE INTO user_profit (
+                user_id, scenario, total_profit, total_revenue, total_penalty,
+                marketable_proportion, not_marketable_proportion,
+                total_classifications, total_marketable_classifications,
+                total_not_marketable_classifications, total_marketable_revenue,
+                total_not_marketable_revenue, timestamp
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ''', (
+            user_id,
+            scenario,
+            profit_data.get('total_profit'),
+            profit_data.get('total_revenue'),
+            profit_data.get('total_penalty'),
+            profit_data.get('marketable_proportion'),
+            profit_data.get('not_marketable_proportion'),
+            profit_data.get('total_classifications'),
+            profit_data.get('total_marketable_classifications'),
+            profit_data.get('total_not_marketable_classifications'),
+            profit_data.get('total_marketable_revenue'),
+            profit_data.get('total_not_marketable_revenue')
+        ))
+    return cursor.lastrowid
 
 
 def get_user_profit(user_id, scenario=None):
@@ -189,7 +417,6 @@ def get_user_profit(user_id, scenario=None):
         ''', (user_id,))
         profit = cursor.fetchall()
 
-    conn.close()
     return profit
 
 
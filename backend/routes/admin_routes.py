@@ -1,21 +1,88 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-from database import get_connection
-import os
+from database import get_connection, run_db
+from services.output_service import list_output_files
+from services.workspace_service import list_workspaces
 
 router = APIRouter()
 
-OUTPUT_DIR = "output"
+# Rows returned by an admin query unless the request asks for fewer/more
+DEFAULT_QUERY_MAX_ROWS = 1000
+QUERY_MAX_ROWS_LIMIT = 10000
 
 
 class SQLQuery(BaseModel):
     query: str
+    max_rows: int = DEFAULT_QUERY_MAX_ROWS
+
+
+def _run_select(query, max_rows):
+    """
+    Run a query and return its column names, up to max_rows rows as
+    dictionaries, and whether more rows were left unread.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(query)
+
+    # Get column names
+    columns = [description[0] for description in cursor.description] if cursor.description else []
+
+    # Read one row past the cap so truncation can be reported without loading the rest
+    rows = cursor.fetchmany(max_rows + 1)
+    truncated = len(rows) > max_rows
+    rows = rows[:max_rows]
+
+    # Convert to list of dictionaries
+    results = []
+    for row in rows:
+        results.append(dict(zip(columns, row)))
+
+    return columns, results, truncated
+
+
+def _list_tables():
+    """Return the names of all tables in the database."""
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute("""
+        SELECT name FROM sqlite_master
+        WHERE type='table'
+        ORDER BY name
+    """)
+
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _table_schema(table_name):
+    """Return the column descriptions of a table."""
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    # Get table info
+    cursor.execute(f"PRAGMA table_info({table_name})")
+    columns = cursor.fetchall()
+
+    schema = []
+    for col in columns:
+        schema.append({
+            "cid": col[0],
+            "name": col[1],
+            "type": col[2],
+            "notnull": bool(col[3]),
+            "default_value": col[4],
+            "pk": bool(col[5])
+        })
+
+    return schema
 
 
 @router.post("/admin/query")
 async def execute_query(sql_query: SQLQuery):
     """
     Execute a SQL query on the database (SELECT queries only for safety).
+    At most max_rows rows are returned; truncated is true when the query had more.
     """
     try:
         query = sql_query.query.strip()
@@ -27,28 +94,20 @@ async def execute_query(sql_query: SQLQuery):
                 detail="Only SELECT queries are allowed for safety reasons"
             )
 
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute(query)
-
-        # Get column names
-        columns = [description[0] for description in cursor.description] if cursor.description else []
-
-        # Fetch all results
-        rows = cursor.fetchall()
-
-        # Convert to list of dictionaries
-        results = []
-        for row in rows:
-            results.append(dict(zip(columns, row)))
+        if not 1 <= sql_query.max_rows <= QUERY_MAX_ROWS_LIMIT:
+            raise HTTPException(
+                status_code=400,
+                detail=f"max_rows must be between 1 and {QUERY_MAX_ROWS_LIMIT}"
+            )
 
-        conn.close()
+        columns, results, truncated = await run_db(_run_select, query, sql_query.max_rows)
 
         return {
             "status": "success",
             "columns": columns,
             "data": results,
-            "row_count": len(results)
+            "row_count": len(results),
+            "truncated": truncated
         }
 
     except HTTPException:
@@ -63,17 +122,7 @@ async def get_tables():
     Get list of all tables in the database.
     """
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute("""
-            SELECT name FROM sqlite_master
-            WHERE type='table'
-            ORDER BY name
-        """)
-
-        tables = [row[0] for row in cursor.fetchall()]
-        conn.close()
+        tables = await run_db(_list_tables)
 
         return {
             "status": "success",
@@ -90,25 +139,7 @@ async def get_table_schema(table_name: str):
     Get the schema/structure of a specific table.
     """
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-
-        # Get table info
-        cursor.execute(f"PRAGMA table_info({table_name})")
-        columns = cursor.fetchall()
-
-        schema = []
-        for col in columns:
-            schema.append({
-                "cid": col[0],
-                "name": col[1],
-                "type": col[2],
-                "notnull": bool(col[3]),
-                "default_value": col[4],
-                "pk": bool(col[5])
-            })
-
-        conn.close()
+        schema = await run_db(_table_schema, table_name)
 
         return {
             "status": "success",
@@ -123,23 +154,22 @@ async def get_table_schema(table_name: str):
 @router.get("/admin/images")
 async def list_output_images():
     """
-    List all images in the output directory with their metadata.
+    List all images in the shared and every user's output directory with their metadata.
+    The URLs are signed for their image alone, so the listing does not hand
+    out workspace tokens.
     """
     try:
-        if not os.path.exists(OUTPUT_DIR):
-            return {"status": "success", "images": [], "message": "Output directory does not exist"}
-
         images = []
-        for filename in os.listdir(OUTPUT_DIR):
-            file_path = os.path.join(OUTPUT_DIR, filename)
-            if os.path.isfile(file_path):
-                # Check if it's an image file
-                _, ext = os.path.splitext(filename)
-                if ext.lower() in ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp']:
+        for workspace in list_workspaces():
+            for output_file in list_output_files(workspace.output_dir):
+                if output_file["type"] == "image":
                     images.append({
-                        "filename": filename,
-                        "size": os.path.getsize(file_path),
-                        "url": f"/output/file/{filename}"
+                        "filename": output_file["filename"],
+                        "user_id": workspace.user_id,
+                        "size": output_file["size"],
+                        "pending": output_file["pending"],
+                        "url": workspace.signed_file_url(output_file["filename"]),
+                        "thumbnail_url": workspace.signed_thumbnail_url(output_file["filename"])
                     })
 
         return {
@@ -1,5 +1,6 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
+from database import run_db
 from services.image_service import add_image_match, get_images_by_user
 
 
@@ -29,7 +30,7 @@ async def add_image_match_endpoint(request: ImageMatchRequest):
         if request.user_id is None or request.user_id < 1:
             raise HTTPException(status_code=400, detail="Valid user_id is required")
 
-        result = add_image_match(request.image_name.strip(), request.user_id)
+        result = await run_db(add_image_match, request.image_name.strip(), request.user_id)
 
         return {
             "image_id": result['image_id'],
@@ -55,7 +56,7 @@ async def get_user_images_endpoint(request: UserImagesRequest):
         if request.user_id is None or request.user_id < 1:
             raise HTTPException(status_code=400, detail="Valid user_id is required")
 
-        images = get_images_by_user(request.user_id)
+        images = await run_db(get_images_by_user, request.user_id)
 
         return {
             "user_id": request.user_id,
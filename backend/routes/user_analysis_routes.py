@@ -1,4 +1,5 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
 import sys
@@ -6,12 +7,18 @@ import os
 
 # Add parent directory to path to import user_analysis_service
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from services.user_analysis_service import add_analysis, get_user_analyses, get_all_analyses
+from database import run_db
+from services.user_analysis_service import (
+    ANALYSIS_FIELDS, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE,
+    add_analysis, add_analyses, get_analyses_page, get_user_analyses,
+    get_analysis_rollup, get_analysis_summary, iter_analysis_batches, select_columns
+)
+from services.export_service import EXPORT_FORMATS, create_encoder
 
 router = APIRouter()
 
 
-class AddAnalysisRequest(BaseModel):
+class AnalysisRow(BaseModel):
     image_name: str
     object_id_in_image: int
     area_px2: float
@@ -30,7 +37,15 @@ class AddAnalysisRequest(BaseModel):
     weight_oz: float
     price_usd: float
     grade: str
+
+
+class AddAnalysisRequest(AnalysisRow):
+    user_id: int
+
+
+class AddAnalysesRequest(BaseModel):
     user_id: int
+    analyses: List[AnalysisRow]
 
 
 class GetUserAnalysesRequest(BaseModel):
@@ -66,7 +81,8 @@ async def add_analysis_endpoint(request: AddAnalysisRequest):
     Add a new analysis record to the user_analysis table.
     """
     try:
-        analysis_id = add_analysis(
+        analysis_id = await run_db(
+            add_analysis,
             image_name=request.image_name,
             object_id_in_image=request.object_id_in_image,
             area_px2=request.area_px2,
@@ -98,13 +114,34 @@ async def add_analysis_endpoint(request: AddAnalysisRequest):
         raise HTTPException(status_code=500, detail=f"Failed to add analysis: {str(e)}")
 
 
+@router.post("/add-analyses")
+async def add_analyses_endpoint(request: AddAnalysesRequest):
+    """
+    Add a batch of analysis records for one user in a single transaction.
+    """
+    try:
+        records = [{field: getattr(analysis, field) for field in ANALYSIS_FIELDS}
+                   for analysis in request.analyses]
+        inserted = await run_db(add_analyses, records, request.user_id)
+
+        return {
+            "user_id": request.user_id,
+            "count": inserted,
+            "message": "Analysis records added successfully",
+            "status": "success"
+        }
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to add analyses: {str(e)}")
+
+
 @router.post("/get-user-analyses")
 async def get_user_analyses_endpoint(request: GetUserAnalysesRequest):
     """
     Get all analysis records for a specific user.
     """
     try:
-        analyses = get_user_analyses(request.user_id)
+        analyses = await run_db(get_user_analyses, request.user_id)
 
         # Convert tuple results to dictionaries
         analysis_list = []
@@ -143,43 +180,151 @@ async def get_user_analyses_endpoint(request: GetUserAnalysesRequest):
         raise HTTPException(status_code=500, detail=f"Failed to get user analyses: {str(e)}")
 
 
-@router.get("/get-all-user-analyses")
-async def get_all_user_analyses_endpoint():
+@router.get("/analyses")
+async def get_analyses_endpoint(
+    user_id: Optional[int] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[int] = None,
+    fields: Optional[str] = None,
+    grade: Optional[str] = None,
+    image_name: Optional[str] = None,
+    min_weight: Optional[float] = None,
+    max_weight: Optional[float] = None
+):
     """
-    Get all analysis records from the user_analysis table.
+    Get one page of analysis records, ordered by object_id.
+
+    Pass the returned next_after as after to fetch the following page; it is
+    null on the last page. fields is a comma-separated list of columns to
+    return. user_id, grade, image_name and the weight range filter server-side.
     """
     try:
-        analyses = get_all_analyses()
+        page = await run_db(
+            get_analyses_page,
+            user_id=user_id,
+            limit=limit,
+            after=after,
+            fields=[f.strip() for f in fields.split(',') if f.strip()] if fields else None,
+            grade=grade,
+            image_name=image_name,
+            min_weight=min_weight,
+            max_weight=max_weight
+        )
 
-        # Convert tuple results to dictionaries
-        analysis_list = []
-        for analysis in analyses:
-            analysis_list.append({
-                "object_id": analysis[0],
-                "image_name": analysis[1],
-                "object_id_in_image": analysis[2],
-                "area_px2": analysis[3],
-                "top_left_x": analysis[4],
-                "top_left_y": analysis[5],
-                "bottom_right_x": analysis[6],
-                "bottom_right_y": analysis[7],
-                "center": analysis[8],
-                "width_px": analysis[9],
-                "length_px": analysis[10],
-                "volume_px3": analysis[11],
-                "solidity": analysis[12],
-                "strict_solidity": analysis[13],
-                "lw_ratio": analysis[14],
-                "area_in2": analysis[15],
-                "weight_oz": analysis[16],
-                "price_usd": analysis[17],
-                "grade": analysis[18],
-                "user_id": analysis[19]
-            })
+        return {
+            "analyses": page['analyses'],
+            "count": len(page['analyses']),
+            "next_after": page['next_after'],
+            "has_more": page['next_after'] is not None,
+            "status": "success"
+        }
+
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get analyses: {str(e)}")
+
+
+@router.get("/analyses/summary")
+async def get_analysis_summary_endpoint(user_id: Optional[int] = None, group_by: str = "user"):
+    """
+    Get grade counts, weight statistics and price totals per user
+    (group_by=user) or per user and image (group_by=image).
+    """
+    try:
+        summaries = await run_db(get_analysis_summary, user_id=user_id, group_by=group_by)
 
         return {
-            "analyses": analysis_list,
-            "count": len(analysis_list),
+            "group_by": group_by,
+            "summaries": summaries,
+            "count": len(summaries),
+            "status": "success"
+        }
+
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to summarize analyses: {str(e)}")
+
+
+@router.get("/analyses/rollup/{user_id}")
+async def get_analysis_rollup_endpoint(user_id: int):
+    """
+    Get a user's running grade counts, weight and price totals. These are
+    maintained on every insert and delete, so the read does not depend on
+    how many records the user has.
+    """
+    try:
+        rollup = await run_db(get_analysis_rollup, user_id)
+
+        return {
+            "user_id": user_id,
+            "rollup": rollup,
+            "status": "success"
+        }
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get analysis rollup: {str(e)}")
+
+
+@router.get("/analyses/export")
+async def export_analyses_endpoint(format: str = "csv", user_id: Optional[int] = None,
+                                   fields: Optional[str] = None):
+    """
+    Stream analysis records as CSV, NDJSON or Parquet, in object_id order.
+
+    Rows are read from the database cursor in batches and written out as
+    they are encoded, so memory use does not grow with the table. user_id
+    limits the export to one user; fields is a comma-separated column list.
+    """
+    try:
+        columns = select_columns([f.strip() for f in fields.split(',') if f.strip()] if fields else None)
+        encoder = create_encoder(format, columns)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+
+    async def body():
+        batches = iter_analysis_batches(columns, user_id=user_id)
+        try:
+            yield encoder.start()
+            while True:
+                rows = await run_db(next, batches, None)
+                if rows is None:
+                    break
+                yield encoder.encode(rows)
+            yield encoder.finish()
+        finally:
+            # Closes the export connection, also when the client disconnects early
+            await run_db(batches.close)
+
+    filename = f"analyses_user_{user_id}" if user_id is not None else "analyses"
+    return StreamingResponse(
+        body(),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f"attachment; filename={filename}.{format}"}
+    )
+
+
+@router.get("/get-all-user-analyses")
+async def get_all_user_analyses_endpoint(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[int] = None
+):
+    """
+    Get analysis records of every user from the user_analysis table, one
+    page at a time in object_id order. Pass the returned next_after as after
+    to fetch the following page; it is null on the last page.
+    """
+    try:
+        page = await run_db(get_analyses_page, limit=limit, after=after)
+
+        return {
+            "analyses": page['analyses'],
+            "count": len(page['analyses']),
+            "next_after": page['next_after'],
+            "has_more": page['next_after'] is not None,
             "status": "success"
         }
 
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-from services.user_profit_service import save_profit_data, get_profit_data
+from database import run_db
+from services.user_profit_service import save_profit_data, get_profit_data, calculate_pricing_summary
 
 
 router = APIRouter()
@@ -44,7 +45,7 @@ async def save_profit_endpoint(request: ProfitDataRequest):
             'total_not_marketable_revenue': request.total_not_marketable_revenue
         }
 
-        result = save_profit_data(request.user_id, request.scenario, profit_data)
+        result = await run_db(save_profit_data, request.user_id, request.scenario, profit_data)
 
         return {
             "success": result['success'],
@@ -63,7 +64,7 @@ async def get_profit_endpoint(user_id: int, scenario: int = None):
     If scenario is provided, returns single record. Otherwise returns all scenarios for the user.
     """
     try:
-        result = get_profit_data(user_id, scenario)
+        result = await run_db(get_profit_data, user_id, scenario)
 
         if scenario is not None and result is None:
             raise HTTPException(status_code=404, detail="Profit data not found")
@@ -77,3 +78,28 @@ async def get_profit_endpoint(user_id: int, scenario: int = None):
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get profit data: {str(e)}")
+
+
+@router.get("/pricing-summary/{user_id}")
+async def get_pricing_summary_endpoint(user_id: int, scenario: int = 1):
+    """
+    Compute a user's profit metrics for a scenario (1: bin, 2: conveyor) from
+    their analysis records. The response has the fields /save-profit expects.
+    """
+    try:
+        if scenario not in [1, 2]:
+            raise HTTPException(status_code=400, detail="Scenario must be 1 or 2")
+
+        summary = await run_db(calculate_pricing_summary, user_id, scenario)
+
+        return {
+            "user_id": user_id,
+            "scenario": scenario,
+            "pricing_summary": summary,
+            "status": "success"
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to compute pricing summary: {str(e)}")
@@ -1,6 +1,8 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
+from database import run_db
 from services.user_service import get_or_create_name
+from services.workspace_service import workspace_token
 
 
 router = APIRouter()
@@ -17,17 +19,20 @@ async def get_or_create_name_endpoint(request: NameRequest):
 
     If the name exists in the database, return the existing user.
     If the name doesn't exist, create a new user and return it.
+    The returned workspace_token must accompany the user's user_id on the
+    upload, classification and output endpoints.
     """
     try:
         if not request.name or not request.name.strip():
             raise HTTPException(status_code=400, detail="Name cannot be empty")
 
-        result = get_or_create_name(request.name.strip())
+        result = await run_db(get_or_create_name, request.name.strip())
 
         return {
             "id": result['id'],
             "name": result['name'],
             "is_new_name": result['is_new_name'],
+            "workspace_token": workspace_token(result['id']),
             "status": "success"
         }
 
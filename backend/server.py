@@ -1,13 +1,26 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, Request, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from typing import Optional
+import asyncio
+import json
 import os
-import shutil
-import subprocess
-import sys
-from typing import List
 import mimetypes
 from database import init_db
+from services.inference_service import get_engine
+from services.job_service import get_job_manager, QueueFullError
+from services.file_serving_service import file_response
+from services.output_service import (
+    list_output_files as list_workspace_output, resolve_output_file, resolve_thumbnail, resolve_variant
+)
+from services.upload_service import (
+    MAX_UPLOAD_REQUEST_BYTES, InvalidUploadError, UploadTooLargeError, receive_uploads
+)
+from services.workspace_service import (
+    SHARED_INPUT_DIR, SHARED_OUTPUT_DIR, WorkspaceAccessError,
+    authorize_file, authorize_workspace, clear_input, get_workspace
+)
 from routes.user_routes import router as user_router
 from routes.image_routes import router as image_router
 from routes.user_analysis_routes import router as user_analysis_router
@@ -19,6 +32,18 @@ app = FastAPI()
 # Initialize the database on startup
 init_db()
 
+
+@app.on_event("startup")
+async def load_inference_engine():
+    """
+    Load the Detectron2 model once so /classify only pays for inference.
+    """
+    try:
+        await run_in_threadpool(get_engine().load)
+    except Exception as e:
+        # Keep the API up; /classify will retry the load and report the error
+        print(f"Failed to load inference engine at startup: {e}")
+
 # Add CORS middleware to allow requests from frontend
 app.add_middleware(
     CORSMiddleware,
@@ -40,65 +65,100 @@ app.include_router(user_analysis_router, prefix="/api", tags=["user-analysis"])
 app.include_router(admin_router, prefix="/api", tags=["admin"])
 app.include_router(user_profit_router, prefix="/api", tags=["user-profit"])
 
-# Ensure the input and output directories exist
-INPUT_DIR = "input"
-OUTPUT_DIR = "output"
-os.makedirs(INPUT_DIR, exist_ok=True)
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+# Ensure the shared input and output directories exist; signed-in users get
+# their own workspace (see services/workspace_service.py) via user_id and
+# the workspace token returned when they sign in
+get_workspace()
+
+# How often a job stream checks for newly finished images
+STREAM_POLL_SECONDS = 0.2
+
+
+def caller_workspace(user_id: Optional[int], token: Optional[str]):
+    """Return the caller's workspace, or fail with 403 if token does not grant access to it."""
+    try:
+        return authorize_workspace(user_id, token)
+    except WorkspaceAccessError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+
+
+def caller_file_workspace(user_id: Optional[int], filename: str, token: Optional[str], sig: Optional[str]):
+    """Like caller_workspace, also accepting a signature for this one file (see admin /images)."""
+    try:
+        return authorize_file(user_id, filename, token, sig)
+    except WorkspaceAccessError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+
+
+def caller_job(job_id: str, user_id: Optional[int], token: Optional[str]):
+    """
+    Return a job of the caller's workspace. Jobs of other workspaces are
+    reported as missing, so job IDs cannot be probed across users.
+    """
+    caller_workspace(user_id, token)
+    job = get_job_manager().get(job_id)
+    if job is None or job.workspace.user_id != user_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 @app.post("/upload")
-async def upload_files(files: List[UploadFile] = File(...)):
+async def upload_files(request: Request, user_id: Optional[int] = None, token: Optional[str] = None):
     """
-    Upload multiple image files to the input directory for ML processing.
+    Upload multiple image files to the caller's input directory for ML processing.
+
+    The multipart body is parsed as it arrives and each file is streamed to
+    disk, stored under a content-addressed name (SHA-256 plus extension), so
+    uploading the same image twice stores it once. Results are reported under
+    the original filenames. Requests over the per-file or per-request size
+    limit are rejected with 413 as soon as the limit is crossed and leave no
+    files behind.
     """
+    # Refuse oversized bodies before reading any of them
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_UPLOAD_REQUEST_BYTES:
+        raise HTTPException(status_code=413,
+                            detail=f"Upload exceeds the {MAX_UPLOAD_REQUEST_BYTES // (1024 * 1024)} MB request limit")
+
     try:
-        uploaded_files = []
-        for file in files:
-            # Check if file is an image
-            if not file.content_type or not file.content_type.startswith('image/'):
-                raise HTTPException(status_code=400, detail=f"File {file.filename} is not an image")
-            
-            # Save file to input directory
-            file_path = os.path.join(INPUT_DIR, file.filename)
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-            
-            uploaded_files.append(file.filename)
-        
+        workspace = await run_in_threadpool(caller_workspace, user_id, token)
+        result = await receive_uploads(request, workspace.input_dir)
+        files = result['files']
+        print(f"Uploaded {len(files)} files, {result['bytes_received'] / (1024 * 1024):.1f} MB "
+              f"in {result['upload_seconds']:.2f}s ({result['megabytes_per_second']:.1f} MB/s)")
+
         return {
-            "message": f"Successfully uploaded {len(uploaded_files)} files", 
-            "files": uploaded_files,
+            "message": f"Successfully uploaded {len(files)} files",
+            "files": [f['image_name'] for f in files],
+            "uploads": files,
+            "bytes_received": result['bytes_received'],
+            "upload_seconds": result['upload_seconds'],
+            "megabytes_per_second": result['megabytes_per_second'],
             "status": "success"
         }
-    
+
+    except HTTPException:
+        raise
+    except InvalidUploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.delete("/clear-all-input")
-async def clear_all_files():
+async def clear_all_files(user_id: Optional[int] = None, token: Optional[str] = None):
     """
-    Delete all files in both input and output directories.
+    Delete the uploaded images in the caller's input directory.
+    Other users' workspaces are left untouched.
     """
     try:
-        input_files_deleted = 0
+        workspace = caller_workspace(user_id, token)
+        if get_job_manager().is_busy(workspace):
+            raise HTTPException(status_code=409, detail="A classification job is still using these images")
+
+        input_files_deleted = await run_in_threadpool(clear_input, workspace)
         output_files_deleted = 0
-        
-        # Clear input directory
-        if os.path.exists(INPUT_DIR):
-            for filename in os.listdir(INPUT_DIR):
-                file_path = os.path.join(INPUT_DIR, filename)
-                if os.path.isfile(file_path):
-                    os.remove(file_path)
-                    input_files_deleted += 1
-        
-        # Clear output directory
-        # if os.path.exists(OUTPUT_DIR):
-        #     for filename in os.listdir(OUTPUT_DIR):
-        #         file_path = os.path.join(OUTPUT_DIR, filename)
-        #         if os.path.isfile(file_path):
-        #             os.remove(file_path)
-        #             output_files_deleted += 1
-        
+
         return {
             "message": f"Successfully cleared all files. Deleted {input_files_deleted} input files and {output_files_deleted} output files.",
             "input_files_deleted": input_files_deleted,
@@ -106,48 +166,48 @@ async def clear_all_files():
             "status": "success"
         }
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to clear files: {str(e)}")
 
 @app.get("/output/files")
-async def list_output_files():
+async def list_output_files(user_id: Optional[int] = None, token: Optional[str] = None):
     """
-    List all files in the output directory.
+    List all files in the caller's output directory.
+    Annotated images that are drawn lazily are listed with pending set.
     """
     try:
-        if not os.path.exists(OUTPUT_DIR):
-            return {"files": [], "message": "Output directory does not exist"}
-        
-        files = []
-        for filename in os.listdir(OUTPUT_DIR):
-            file_path = os.path.join(OUTPUT_DIR, filename)
-            if os.path.isfile(file_path):
-                # Get file extension to determine type
-                _, ext = os.path.splitext(filename)
-                file_type = "image" if ext.lower() in ['.jpg', '.jpeg', '.png', '.gif', '.bmp'] else "csv" if ext.lower() == '.csv' else "other"
-                
-                files.append({
-                    "filename": filename,
-                    "type": file_type,
-                    "size": os.path.getsize(file_path)
-                })
-        
+        files = list_workspace_output(caller_workspace(user_id, token).output_dir)
+
         return {
             "files": files,
             "count": len(files),
             "status": "success"
         }
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/output/file/{filename}")
-async def get_output_file(filename: str):
+async def get_output_file(request: Request, filename: str, user_id: Optional[int] = None,
+                          token: Optional[str] = None, sig: Optional[str] = None, w: Optional[int] = Query(None, ge=1), download: bool = False):
     """
-    Serve a specific file from the output directory.
+    Serve a specific file from the caller's output directory.
+    Annotated images rendered lazily are drawn on their first request.
+    Responses carry ETag/Last-Modified validators so repeat views cost a 304,
+    and honour byte ranges. With w, an image is served resized to at least
+    that width; with download, it is sent as an attachment. Instead of the
+    workspace token, sig may carry the file's own signature.
     """
     try:
-        file_path = os.path.join(OUTPUT_DIR, filename)
+        output_dir = caller_file_workspace(user_id, filename, token, sig).output_dir
+        if w is None:
+            file_path = await run_in_threadpool(resolve_output_file, output_dir, filename)
+        else:
+            file_path = await run_in_threadpool(resolve_variant, output_dir, filename, w)
         
         if not os.path.exists(file_path):
             raise HTTPException(status_code=404, detail="File not found")
@@ -156,17 +216,16 @@ async def get_output_file(filename: str):
             raise HTTPException(status_code=400, detail="Path is not a file")
         
         # Determine media type
-        media_type, _ = mimetypes.guess_type(file_path)
+        media_type, _ = mimetypes.guess_type(filename)
         if media_type is None:
             media_type = 'application/octet-stream'
         
-        return FileResponse(
-            path=file_path,
-            media_type=media_type,
+        return file_response(
+            request,
+            file_path,
             filename=filename,
-            headers={
-                "Content-Disposition": f"attachment; filename={filename}"
-            }
+            disposition="attachment" if download else "inline",
+            media_type=media_type
         )
     
     except HTTPException:
@@ -174,16 +233,36 @@ async def get_output_file(filename: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/output/thumbnail/{filename}")
+async def get_output_thumbnail(request: Request, filename: str, user_id: Optional[int] = None,
+                               token: Optional[str] = None, sig: Optional[str] = None):
+    """
+    Serve the thumbnail of an annotated image in the caller's output directory.
+    """
+    try:
+        output_dir = caller_file_workspace(user_id, filename, token, sig).output_dir
+        file_path = await run_in_threadpool(resolve_thumbnail, output_dir, filename)
+        if file_path is None:
+            raise HTTPException(status_code=404, detail="File not found")
+
+        media_type, _ = mimetypes.guess_type(file_path)
+        return file_response(request, file_path, media_type=media_type or 'application/octet-stream')
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/output/csv/{filename}")
-async def get_csv_content(filename: str):
+async def get_csv_content(filename: str, user_id: Optional[int] = None, token: Optional[str] = None):
     """
-    Get CSV file content as JSON for frontend display.
+    Get CSV file content from the caller's output directory as JSON for frontend display.
     """
     try:
         if not filename.endswith('.csv'):
             raise HTTPException(status_code=400, detail="File is not a CSV")
         
-        file_path = os.path.join(OUTPUT_DIR, filename)
+        file_path = os.path.join(caller_workspace(user_id, token).output_dir, filename)
         
         if not os.path.exists(file_path):
             raise HTTPException(status_code=404, detail="CSV file not found")
@@ -215,67 +294,105 @@ async def get_csv_content(filename: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/classify")
-async def classify_images():
+@app.post("/classify", status_code=202)
+async def classify_images(user_id: Optional[int] = None, token: Optional[str] = None):
     """
-    Run the MaskrcnnGradAidAg.py ML script to process uploaded images.
+    Queue a classification job for the caller's uploaded images and return its ID right away.
+    Jobs of different users run in parallel; a user's own jobs run one at a time.
+    Poll /jobs/{job_id} for progress and fetch /jobs/{job_id}/result when it is done.
     """
     try:
-        # Check if input directory exists and has files
-        if not os.path.exists(INPUT_DIR):
-            raise HTTPException(status_code=400, detail="Input directory does not exist. Please upload images first.")
-        
-        input_files = [f for f in os.listdir(INPUT_DIR) if os.path.isfile(os.path.join(INPUT_DIR, f))]
+        workspace = caller_workspace(user_id, token)
+        input_files = [f for f in os.listdir(workspace.input_dir)
+                       if os.path.isfile(os.path.join(workspace.input_dir, f))]
         if not input_files:
             raise HTTPException(status_code=400, detail="No files found in input directory. Please upload images first.")
         
-        # Check if the ML script exists
-        ml_script_path = "MaskrcnnGradAidAg.py"
-        if not os.path.exists(ml_script_path):
-            raise HTTPException(status_code=500, detail=f"ML script '{ml_script_path}' not found in backend directory.")
-        
-        # Run the ML script
         try:
-            result = subprocess.run(
-                [sys.executable, ml_script_path],
-                cwd=os.getcwd(),
-                capture_output=True,
-                text=True,
-                timeout=300  # 5 minute timeout
-            )
-            
-            if result.returncode == 0:
-                # Check if output files were generated
-                output_files = []
-                if os.path.exists(OUTPUT_DIR):
-                    output_files = [f for f in os.listdir(OUTPUT_DIR) if os.path.isfile(os.path.join(OUTPUT_DIR, f))]
-                
-                return {
-                    "message": "Classification completed successfully",
-                    "status": "success",
-                    "output_files_generated": len(output_files),
-                    "stdout": result.stdout,
-                    "processed_files": input_files
-                }
-            else:
-                return {
-                    "message": "Classification completed with errors",
-                    "status": "error",
-                    "error_code": result.returncode,
-                    "stdout": result.stdout,
-                    "stderr": result.stderr
-                }
-                
-        except subprocess.TimeoutExpired:
-            raise HTTPException(status_code=408, detail="Classification process timed out after 5 minutes.")
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Failed to run classification script: {str(e)}")
+            job = get_job_manager().submit(workspace)
+        except QueueFullError as e:
+            raise HTTPException(status_code=429, detail=str(e))
+
+        return {
+            "message": "Classification job queued",
+            "status": job.status,
+            "job_id": job.job_id,
+            "images_total": len(job.images),
+            "status_url": f"/jobs/{job.job_id}{workspace.query}",
+            "result_url": f"/jobs/{job.job_id}/result{workspace.query}",
+            "stream_url": f"/jobs/{job.job_id}/stream{workspace.query}"
+        }
     
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/jobs/{job_id}")
+async def get_job_status(job_id: str, user_id: Optional[int] = None, token: Optional[str] = None):
+    """
+    Get the status and per-image progress of a classification job.
+    """
+    job = caller_job(job_id, user_id, token)
+    return job.to_dict()
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str, user_id: Optional[int] = None, token: Optional[str] = None):
+    """
+    Get the result of a finished classification job.
+    """
+    manager = get_job_manager()
+    job = caller_job(job_id, user_id, token)
+    if not job.is_finished:
+        raise HTTPException(status_code=409, detail=f"Job is still {job.status}")
+    return manager.result(job)
+
+@app.get("/jobs/{job_id}/stream")
+async def stream_job_results(job_id: str, user_id: Optional[int] = None, token: Optional[str] = None,
+                             format: str = "ndjson"):
+    """
+    Stream each image's feature rows, grade counts and annotated-image URL
+    as soon as that image finishes, followed by the job result.
+    format is "ndjson" (one JSON object per line) or "sse" (Server-Sent Events).
+    """
+    manager = get_job_manager()
+    job = caller_job(job_id, user_id, token)
+    if format not in ("ndjson", "sse"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'sse'")
+
+    def encode(event):
+        data = json.dumps(event, default=str)
+        if format == "sse":
+            return f"event: {event['type']}\ndata: {data}\n\n"
+        return data + "\n"
+
+    async def events():
+        sent = 0
+        while True:
+            # Check before draining so events appended just before the job finished are not missed
+            finished = job.is_finished
+            for event in job.events_since(sent):
+                yield encode(event)
+                sent += 1
+            if finished:
+                yield encode({"type": "done", **manager.result(job)})
+                return
+            await asyncio.sleep(STREAM_POLL_SECONDS)
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(events(), media_type=media_type,
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """
+    Get the hit/miss counters and size of the per-image result cache.
+    """
+    stats = get_engine().cache_stats()
+    if stats is None:
+        return {"enabled": False}
+    return {"enabled": True, **stats}
+
 @app.get("/")
 async def root():
     """
@@ -290,8 +407,9 @@ async def health_check():
     """
     return {
         "status": "healthy", 
-        "input_dir_exists": os.path.exists(INPUT_DIR),
-        "output_dir_exists": os.path.exists(OUTPUT_DIR)
+        "input_dir_exists": os.path.exists(SHARED_INPUT_DIR),
+        "output_dir_exists": os.path.exists(SHARED_OUTPUT_DIR),
+        "model_loaded": get_engine().is_loaded
     }
 
 if __name__ == "__main__":
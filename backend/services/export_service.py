@@ -0,0 +1,149 @@
+import csv
+import io
+import json
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet'
+}
+
+# user_analysis columns that are not REAL, for the Parquet schema
+_TEXT_COLUMNS = {'image_name', 'center', 'grade'}
+_INTEGER_COLUMNS = {'object_id', 'object_id_in_image', 'top_left_x', 'top_left_y',
+                    'bottom_right_x', 'bottom_right_y', 'user_id'}
+
+
+class CSVEncoder:
+    """Encode batches of rows as CSV, header first."""
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def start(self):
+        return self._write([self.columns])
+
+    def encode(self, rows):
+        return self._write(rows)
+
+    def finish(self):
+        return b''
+
+    def _write(self, rows):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode('utf-8')
+
+
+class NDJSONEncoder:
+    """Encode batches of rows as one JSON object per line."""
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def start(self):
+        return b''
+
+    def encode(self, rows):
+        return ''.join(json.dumps(dict(zip(self.columns, row))) + '\n' for row in rows).encode('utf-8')
+
+    def finish(self):
+        return b''
+
+
+class _ChunkSink:
+    """
+    Write-only file object that hands back what was written since the last
+    drain, so a ParquetWriter can stream without keeping the whole file.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def writable(self):
+        return True
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class ParquetEncoder:
+    """Encode each batch of rows as one Parquet row group; the footer is written by finish."""
+
+    def __init__(self, columns):
+        if pa is None:
+            raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow)")
+        self.columns = columns
+        self.schema = pa.schema([(column, _arrow_type(column)) for column in columns])
+        self._sink = _ChunkSink()
+        self._writer = pq.ParquetWriter(self._sink, self.schema)
+
+    def start(self):
+        return self._sink.drain()
+
+    def encode(self, rows):
+        arrays = [pa.array(values, type=field.type)
+                  for values, field in zip(zip(*rows), self.schema)]
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        return self._sink.drain()
+
+    def finish(self):
+        self._writer.close()
+        return self._sink.drain()
+
+
+def _arrow_type(column):
+    if column in _TEXT_COLUMNS:
+        return pa.string()
+    if column in _INTEGER_COLUMNS:
+        return pa.int64()
+    return pa.float64()
+
+
+_ENCODERS = {'csv': CSVEncoder, 'ndjson': NDJSONEncoder, 'parquet': ParquetEncoder}
+
+
+def create_encoder(export_format, columns):
+    """
+    Create the encoder for an export format.
+
+    Args:
+        export_format (str): One of EXPORT_FORMATS
+        columns (list): Column names of the exported rows
+
+    Returns:
+        An encoder with start(), encode(rows) and finish() methods returning bytes
+
+    Raises:
+        ValueError: If the format is unknown
+        RuntimeError: If the format needs an optional dependency that is not installed
+    """
+    if export_format not in _ENCODERS:
+        raise ValueError(f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+    return _ENCODERS[export_format](columns)
@@ -0,0 +1,148 @@
+import mimetypes
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import quote
+
+from starlette.responses import FileResponse, Response, StreamingResponse
+
+# Bytes read at a time when streaming a byte range
+RANGE_CHUNK_BYTES = 64 * 1024
+# Outputs can be rewritten under the same name by a later run, so clients
+# may keep them but must revalidate, which the validators make a cheap 304
+OUTPUT_CACHE_CONTROL = "private, no-cache"
+
+
+class RangeNotSatisfiableError(ValueError):
+    """Raised when a Range header lies entirely outside the file."""
+
+
+def file_etag(stat_result):
+    """Strong validator of a file version, built from its mtime and size."""
+    return f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+
+def _etag_matches(if_none_match, etag):
+    # If-None-Match uses the weak comparison, so W/ prefixes are ignored
+    if if_none_match.strip() == "*":
+        return True
+    return any(candidate.strip().removeprefix("W/") == etag for candidate in if_none_match.split(","))
+
+
+def is_not_modified(request, etag, mtime):
+    """
+    Return True if the client's cached copy is current. If-None-Match takes
+    precedence over If-Modified-Since, as RFC 9110 requires.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def parse_range(range_header, size):
+    """
+    Parse a single "bytes=" range.
+
+    Args:
+        range_header (str): Value of the Range header
+        size (int): File size in bytes
+
+    Returns:
+        tuple: (first, last) byte offsets, inclusive, or None if the header
+            is to be ignored (another unit, several ranges or malformed)
+
+    Raises:
+        RangeNotSatisfiableError: If the range starts beyond the end of the file
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, dash, last = spec.strip().partition("-")
+    if not dash or not (first.isdigit() or first == "") or not (last.isdigit() or last == ""):
+        return None
+
+    if first == "":
+        # Suffix range: the last N bytes
+        if last == "" or int(last) == 0 or size == 0:
+            raise RangeNotSatisfiableError(range_header)
+        return max(size - int(last), 0), size - 1
+    first = int(first)
+    if last and first > int(last):
+        return None
+    if first >= size:
+        raise RangeNotSatisfiableError(range_header)
+    last = int(last) if last else size - 1
+    return first, min(last, size - 1)
+
+
+def _read_range(path, first, last, chunk_size=RANGE_CHUNK_BYTES):
+    with open(path, "rb") as f:
+        f.seek(first)
+        remaining = last - first + 1
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+
+
+def file_response(request, path, filename=None, disposition="inline", media_type=None,
+                  cache_control=OUTPUT_CACHE_CONTROL):
+    """
+    Build the response serving a file with HTTP caching support.
+
+    Every response carries an ETag and Last-Modified. A matching
+    If-None-Match (or, without it, If-Modified-Since) gets 304 Not Modified,
+    a single byte range gets 206 Partial Content unless an If-Range
+    validator no longer matches, and a range beyond the end of the file
+    gets 416.
+
+    Args:
+        request (Request): The incoming request
+        path (str): File to serve
+        filename (str, optional): Name for the Content-Disposition header
+        disposition (str): "inline" to display in the browser, "attachment" to download
+        media_type (str, optional): Content type; guessed from the path if omitted
+        cache_control (str): Cache-Control header value
+
+    Returns:
+        Response: The 200, 206, 304 or 416 response
+    """
+    stat_result = os.stat(path)
+    etag = file_etag(stat_result)
+    last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": last_modified,
+        "Cache-Control": cache_control,
+        "Accept-Ranges": "bytes"
+    }
+    if filename:
+        headers["Content-Disposition"] = f"{disposition}; filename*=UTF-8''{quote(filename)}"
+    media_type = media_type or mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+    if is_not_modified(request, etag, stat_result.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range.strip() in (etag, last_modified)):
+        try:
+            byte_range = parse_range(range_header, stat_result.st_size)
+        except RangeNotSatisfiableError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{stat_result.st_size}"})
+        if byte_range is not None:
+            first, last = byte_range
+            headers["Content-Range"] = f"bytes {first}-{last}/{stat_result.st_size}"
+            headers["Content-Length"] = str(last - first + 1)
+            return StreamingResponse(_read_range(path, first, last), status_code=206,
+                                     media_type=media_type, headers=headers)
+
+    return FileResponse(path, media_type=media_type, headers=headers, stat_result=stat_result)
@@ -18,13 +18,12 @@ def add_image_match(image_name, user_id):
     conn = get_connection()
     cursor = conn.cursor()
 
-    cursor.execute(
-        'INSERT INTO image_match (image_name, user_id) VALUES (?, ?)',
-        (image_name, user_id)
-    )
-    conn.commit()
+    with conn:
+        cursor.execute(
+            'INSERT INTO image_match (image_name, user_id) VALUES (?, ?)',
+            (image_name, user_id)
+        )
     image_id = cursor.lastrowid
-    conn.close()
 
     return {
         'image_id': image_id,
@@ -54,7 +53,6 @@ def get_images_by_user(user_id):
         (user_id,)
     )
     rows = cursor.fetchall()
-    conn.close()
 
     images = []
     for row in rows:
@@ -0,0 +1,145 @@
+import os
+import queue
+import threading
+import time
+
+import torch
+
+import MaskrcnnGradAidAg as pipeline
+
+# CPU cores the engine may keep busy across all concurrently running jobs
+ENGINE_CPU_BUDGET = os.cpu_count() or 1
+# Jobs run at the same time, each on its own predictor (capped by the CPU budget)
+ENGINE_PARALLEL_JOBS = 2
+# Inference processes per predictor. With more than one, each process holds
+# its own model and the images of a job are spread across them.
+ENGINE_NUM_WORKERS = 1
+# Torch intra-op threads per inference process
+# (None: CPU budget / (parallel jobs x workers))
+ENGINE_TORCH_THREADS = None
+# Images sent through the model per forward pass
+ENGINE_BATCH_SIZE = pipeline.DEFAULT_BATCH_SIZE
+# Tile edge for tiled inference on large frames (0: whole-image inference)
+ENGINE_TILE_SIZE = pipeline.DEFAULT_TILE_SIZE
+ENGINE_TILE_OVERLAP = pipeline.DEFAULT_TILE_OVERLAP
+# Decode large JPEGs at reduced scale when the model would shrink them anyway
+ENGINE_DECODE_DOWNSCALE = pipeline.DEFAULT_DECODE_DOWNSCALE
+# Encoding, thumbnails and lazy drawing of the annotated images
+ENGINE_OUTPUT_CONF = dict(pipeline.OUTPUT_CONF)
+# Per-image result cache shared by all jobs (None disables it)
+ENGINE_CACHE_DIR = "cache"
+ENGINE_CACHE_MAX_BYTES = pipeline.DEFAULT_CACHE_MAX_BYTES
+# Only run new or changed images, merging with the manifest kept in the output directory
+ENGINE_INCREMENTAL = False
+
+
+class InferenceEngine:
+    """
+    Long-lived pool of Detectron2 predictors.
+
+    The models are loaded once (at FastAPI startup) and reused for every
+    classification request, so a request only pays for actual inference
+    instead of Python startup, torch/detectron2 imports and weight loading.
+    Each running job checks out a predictor of its own, so up to job_slots
+    jobs run in parallel. The CPU budget is split between them: job_slots x
+    workers x torch threads stays within ENGINE_CPU_BUDGET.
+    """
+
+    def __init__(self, cpu_budget=ENGINE_CPU_BUDGET, parallel_jobs=ENGINE_PARALLEL_JOBS,
+                 num_workers=ENGINE_NUM_WORKERS, torch_threads=ENGINE_TORCH_THREADS):
+        self.num_workers = num_workers
+        self.job_slots = max(1, min(parallel_jobs, cpu_budget // num_workers))
+        self.torch_threads = torch_threads or max(1, cpu_budget // (self.job_slots * num_workers))
+        self._predictors = []
+        self._idle = queue.Queue()
+        self.cache = None
+        self._load_lock = threading.Lock()
+        self.device = None
+        self.load_seconds = None
+
+    @property
+    def is_loaded(self):
+        return bool(self._predictors)
+
+    def _create_predictor(self):
+        if self.num_workers > 1:
+            return pipeline.InferencePool(self.num_workers, self.torch_threads,
+                                          tile_size=ENGINE_TILE_SIZE,
+                                          tile_overlap=ENGINE_TILE_OVERLAP,
+                                          tile_batch_size=ENGINE_BATCH_SIZE)
+        predictor = pipeline.create_predictor(self.device)
+        if ENGINE_TILE_SIZE:
+            predictor = pipeline.TiledPredictor(predictor, ENGINE_TILE_SIZE, ENGINE_TILE_OVERLAP,
+                                                tile_batch_size=ENGINE_BATCH_SIZE)
+        return predictor
+
+    def load(self):
+        """Load the predictors if they have not been loaded yet."""
+        with self._load_lock:
+            if self._predictors:
+                return
+            start = time.perf_counter()
+            self.device = pipeline.check_cuda()
+            if self.num_workers == 1:
+                # torch.set_num_threads is process-wide, so every running job
+                # shares this setting; it is sized so that job_slots concurrent
+                # jobs together stay within the CPU budget
+                torch.set_num_threads(self.torch_threads)
+            for _ in range(self.job_slots):
+                predictor = self._create_predictor()
+                self._predictors.append(predictor)
+                self._idle.put(predictor)
+            if ENGINE_CACHE_DIR:
+                self.cache = pipeline.ResultCache(ENGINE_CACHE_DIR, ENGINE_CACHE_MAX_BYTES,
+                                                  fingerprint_extra={'tile_size': ENGINE_TILE_SIZE,
+                                                                     'tile_overlap': ENGINE_TILE_OVERLAP,
+                                                                     'decode_downscale': ENGINE_DECODE_DOWNSCALE})
+            self.load_seconds = time.perf_counter() - start
+
+    def classify_directory(self, input_dir, output_dir, image_files=None, progress_callback=None,
+                           image_names=None):
+        """
+        Run the pipeline over every image in input_dir and write the results to output_dir.
+        Blocks until one of the engine's predictors is free.
+
+        Args:
+            input_dir (str): Directory containing the uploaded images
+            output_dir (str): Directory for annotated images and the combined CSV
+            image_files (list, optional): (root, filename) pairs to process instead of walking input_dir
+            progress_callback (callable, optional): Called with a dict after every image
+            image_names (dict, optional): Filename -> name to report the image and
+                name its outputs under, such as the original names of uploads
+
+        Returns:
+            dict: The pipeline summary plus:
+                - inference_seconds: Wall time spent inside the pipeline
+        """
+        self.load()
+        predictor = self._idle.get()
+        try:
+            start = time.perf_counter()
+            run = pipeline.run_incremental if ENGINE_INCREMENTAL else pipeline.run_pipeline
+            summary = run(predictor, input_dir, output_dir,
+                          image_files=image_files,
+                          progress_callback=progress_callback,
+                          batch_size=ENGINE_BATCH_SIZE,
+                          cache=self.cache,
+                          decode_downscale=ENGINE_DECODE_DOWNSCALE,
+                          output_conf=ENGINE_OUTPUT_CONF,
+                          image_names=image_names)
+            summary['inference_seconds'] = time.perf_counter() - start
+        finally:
+            self._idle.put(predictor)
+        return summary
+
+    def cache_stats(self):
+        """Return the result cache's hit/miss counters and size, or None without a cache."""
+        return self.cache.stats() if self.cache is not None else None
+
+
+_engine = InferenceEngine()
+
+
+def get_engine():
+    """Return the process-wide inference engine."""
+    return _engine
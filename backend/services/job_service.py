@@ -0,0 +1,237 @@
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import MaskrcnnGradAidAg as pipeline
+from services.inference_service import get_engine
+from services.output_service import list_output_files
+from services.upload_service import load_upload_names
+
+# Jobs waiting to start before new submissions are rejected
+MAX_PENDING_JOBS = 20
+# Finished jobs kept in memory for status/result polling
+MAX_FINISHED_JOBS = 100
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
+JOB_FAILED = 'failed'
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue already holds MAX_PENDING_JOBS jobs."""
+
+
+class ClassificationJob:
+    """State of a single queued classification run."""
+
+    def __init__(self, workspace, image_files, image_names=None):
+        self.job_id = uuid.uuid4().hex
+        self.workspace = workspace
+        self.input_dir = workspace.input_dir
+        self.output_dir = workspace.output_dir
+        self.image_files = image_files
+        self.image_names = image_names or {}
+        self.status = JOB_QUEUED
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.images = [
+            {'filename': pipeline.reported_name(filename, self.image_names),
+             'status': 'pending', 'objects_detected': 0}
+            for _, filename in image_files
+        ]
+        self.images_done = 0
+        self.summary = None
+        self.error = None
+        # Append-only per-image results for streaming listeners
+        self.events = []
+        # Progress is recorded from the pipeline and image-writer threads
+        # while status requests and streams read it
+        self._progress_lock = threading.Lock()
+
+    @property
+    def is_finished(self):
+        return self.status in (JOB_COMPLETED, JOB_FAILED)
+
+    def record_progress(self, event):
+        """Record a pipeline progress event for one image."""
+        output_file = event.get('output_file')
+        with self._progress_lock:
+            self.images[event['index']].update(
+                status=event['status'],
+                objects_detected=event['objects_detected'],
+                peak_rss_mb=event.get('peak_rss_mb'),
+                cached=event.get('cached', False)
+            )
+            self.images_done += 1
+            self.events.append({
+                'type': 'image',
+                'index': event['index'],
+                'filename': event['filename'],
+                'status': event['status'],
+                'objects_detected': event['objects_detected'],
+                'image_url': self.workspace.file_url(output_file) if output_file else None,
+                'grade_counts': event.get('grade_counts', {}),
+                'rows': event.get('rows', [])
+            })
+
+    def events_since(self, start):
+        """Return the streaming events recorded after the first start ones."""
+        with self._progress_lock:
+            return self.events[start:]
+
+    def to_dict(self):
+        """Return the job's status and per-image progress."""
+        total = len(self.images)
+        with self._progress_lock:
+            images_done = self.images_done
+            images = [dict(image) for image in self.images]
+        return {
+            'job_id': self.job_id,
+            'user_id': self.workspace.user_id,
+            'status': self.status,
+            'images_total': total,
+            'images_done': images_done,
+            'progress': images_done / total if total else 1.0,
+            'images': images,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'error': self.error
+        }
+
+
+class JobManager:
+    """
+    Scheduler that starts classification jobs in submission order, up to
+    max_running at once (one per engine predictor). Jobs of the same
+    workspace share its output directory, so they run one after another;
+    a queued job waiting for its workspace does not hold up other users.
+    """
+
+    def __init__(self, max_running=None, max_pending=MAX_PENDING_JOBS,
+                 max_finished=MAX_FINISHED_JOBS):
+        self.max_running = max_running or get_engine().job_slots
+        self._executor = ThreadPoolExecutor(max_workers=self.max_running, thread_name_prefix='classify')
+        self._jobs = {}
+        self._queue = deque()
+        self._busy_workspaces = set()
+        self._lock = threading.Lock()
+        self.max_pending = max_pending
+        self.max_finished = max_finished
+
+    def submit(self, workspace):
+        """
+        Snapshot the images currently in a workspace and enqueue a job for them.
+
+        Raises:
+            QueueFullError: If max_pending jobs are already waiting
+        """
+        image_files = pipeline.find_image_files(workspace.input_dir)
+        job = ClassificationJob(workspace, image_files, load_upload_names(workspace.input_dir))
+
+        with self._lock:
+            if len(self._queue) >= self.max_pending:
+                raise QueueFullError(f"{len(self._queue)} classification jobs are already queued")
+            self._jobs[job.job_id] = job
+            self._queue.append(job)
+            self._prune_finished()
+            self._dispatch()
+        return job
+
+    def get(self, job_id):
+        """Return the job with the given ID, or None."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def is_busy(self, workspace):
+        """Return True while a job of the workspace is queued or running."""
+        with self._lock:
+            return (workspace.key in self._busy_workspaces
+                    or any(job.workspace.key == workspace.key for job in self._queue))
+
+    def _dispatch(self):
+        # Called with the lock held
+        for job in list(self._queue):
+            if len(self._busy_workspaces) >= self.max_running:
+                return
+            if job.workspace.key in self._busy_workspaces:
+                continue
+            self._queue.remove(job)
+            self._busy_workspaces.add(job.workspace.key)
+            job.status = JOB_RUNNING
+            self._executor.submit(self._run, job)
+
+    def _prune_finished(self):
+        finished = [j for j in self._jobs.values() if j.is_finished]
+        if len(finished) <= self.max_finished:
+            return
+        finished.sort(key=lambda j: j.finished_at)
+        for job in finished[:len(finished) - self.max_finished]:
+            del self._jobs[job.job_id]
+
+    def _run(self, job):
+        job.started_at = time.time()
+        try:
+            job.summary = get_engine().classify_directory(
+                job.input_dir, job.output_dir,
+                image_files=job.image_files,
+                progress_callback=job.record_progress,
+                image_names=job.image_names
+            )
+            job.status = JOB_COMPLETED
+        except Exception as e:
+            job.error = str(e)
+            job.status = JOB_FAILED
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self._busy_workspaces.discard(job.workspace.key)
+                self._dispatch()
+
+    def result(self, job):
+        """
+        Build the result payload of a finished job.
+
+        Returns:
+            dict: The same fields /classify used to return synchronously
+        """
+        if job.status == JOB_FAILED:
+            return {
+                'job_id': job.job_id,
+                'message': 'Classification completed with errors',
+                'status': 'error',
+                'error': job.error
+            }
+
+        output_files = []
+        if os.path.exists(job.output_dir):
+            output_files = list_output_files(job.output_dir)
+
+        return {
+            'job_id': job.job_id,
+            'message': 'Classification completed successfully',
+            'status': 'success',
+            'output_files_generated': len(output_files),
+            'objects_detected': job.summary['objects_detected'],
+            'inference_seconds': job.summary['inference_seconds'],
+            'peak_rss_mb': job.summary['peak_rss_mb'],
+            'cache_hits': job.summary['cache_hits'],
+            'cache_misses': job.summary['cache_misses'],
+            'grade_counts': job.summary['grade_counts'],
+            'weight_stats': job.summary['weight_stats'],
+            'processed_files': job.summary['processed_files'],
+            'output_files': job.summary['output_files']
+        }
+
+
+_job_manager = JobManager()
+
+
+def get_job_manager():
+    """Return the process-wide job manager."""
+    return _job_manager
@@ -0,0 +1,255 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+from PIL import Image
+
+import MaskrcnnGradAidAg as pipeline
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')
+# Locks serializing the drawing of the same file; a path always maps to the same stripe
+RENDER_LOCK_STRIPES = 64
+# Widths of the resized variants served for ?w=; requests are rounded up to
+# the next one so arbitrary widths do not fill the cache
+VARIANT_WIDTHS = (160, 320, 640, 960, 1280, 1920, 2560)
+VARIANT_CACHE_DIR = os.path.join("cache", "variants")
+# Size bound of the variant cache before least-recently-used eviction
+VARIANT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+# Variants used more recently than this are not evicted, so a response that
+# is about to send one still finds its file; the cache may briefly exceed
+# its size bound instead
+VARIANT_EVICT_MIN_AGE_SECONDS = 60
+
+_render_locks = [threading.Lock() for _ in range(RENDER_LOCK_STRIPES)]
+
+
+def _render_lock(path):
+    return _render_locks[hash(path) % RENDER_LOCK_STRIPES]
+
+
+def _file_type(filename):
+    _, ext = os.path.splitext(filename)
+    if ext.lower() in IMAGE_EXTENSIONS:
+        return "image"
+    return "csv" if ext.lower() == '.csv' else "other"
+
+
+def list_output_files(output_dir):
+    """
+    List the files of an output directory, including annotated images that
+    were rendered lazily and are only drawn on first request.
+
+    Returns:
+        list: Per file, its filename, type ("image", "csv" or "other"), size
+            in bytes (0 while pending) and whether it is still pending
+    """
+    files = []
+    for filename in os.listdir(output_dir):
+        file_path = os.path.join(output_dir, filename)
+        if os.path.isfile(file_path):
+            files.append({
+                "filename": filename,
+                "type": _file_type(filename),
+                "size": os.path.getsize(file_path),
+                "pending": False
+            })
+    present = {f["filename"] for f in files}
+    for filename in pipeline.list_pending(output_dir):
+        if filename not in present:
+            files.append({"filename": filename, "type": "image", "size": 0, "pending": True})
+    return files
+
+
+def resolve_output_file(output_dir, filename):
+    """
+    Return the path of an output file, drawing it first if it was rendered
+    lazily. Concurrent requests for the same pending image draw it once.
+    """
+    file_path = os.path.join(output_dir, filename)
+    if os.path.exists(file_path):
+        return file_path
+    with _render_lock(file_path):
+        if not os.path.exists(file_path) and pipeline.is_pending(file_path):
+            pipeline.render_pending(file_path)
+    return file_path
+
+
+def _output_conf_for(file_path):
+    """OUTPUT_CONF with the format of an existing annotated image, or None if it is not one we encode."""
+    ext = os.path.splitext(file_path)[1].lower()
+    for output_format, extensions in pipeline.OUTPUT_EXTENSIONS.items():
+        if ext in extensions:
+            return dict(pipeline.OUTPUT_CONF, FORMAT=output_format)
+    return None
+
+
+def resolve_thumbnail(output_dir, filename):
+    """
+    Return the path of an annotated image's thumbnail. Images written before
+    thumbnails existed get one made on first request; where none can be made
+    (thumbnails disabled, or a format we do not encode) the image itself is returned.
+
+    Returns:
+        str: Path of the thumbnail or image, or None if the image does not exist
+    """
+    file_path = resolve_output_file(output_dir, filename)
+    if not os.path.isfile(file_path):
+        return None
+    thumbnail = pipeline.thumbnail_path(file_path)
+    if os.path.isfile(thumbnail):
+        return thumbnail
+
+    output_conf = _output_conf_for(file_path)
+    if output_conf is None or not output_conf["THUMBNAIL_SIZE"]:
+        return file_path
+    with _render_lock(thumbnail):
+        if not os.path.isfile(thumbnail):
+            img = cv2.imread(file_path)
+            if img is None:
+                return file_path
+            pipeline.write_thumbnail(img, file_path, output_conf)
+    return thumbnail
+
+
+def variant_width(width):
+    """Round a requested width up to a VARIANT_WIDTHS entry; None if it is beyond the largest."""
+    for candidate in VARIANT_WIDTHS:
+        if width <= candidate:
+            return candidate
+    return None
+
+
+class VariantCache:
+    """
+    On-disk cache of resized output images, keyed by source path, version
+    and width, bounded to max_bytes with least-recently-used eviction.
+    Variants handed out within the last min_age seconds are kept even over
+    the bound. Safe to share between threads.
+    """
+
+    def __init__(self, cache_dir=VARIANT_CACHE_DIR, max_bytes=VARIANT_CACHE_MAX_BYTES,
+                 min_age=VARIANT_EVICT_MIN_AGE_SECONDS):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.min_age = min_age
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # Rebuild the LRU order from the variants' last-use times, kept in
+        # their atime so the mtime (and with it the ETag) stays fixed
+        entries = []
+        for name in os.listdir(cache_dir):
+            if not name.endswith(".tmp"):
+                stat = os.stat(os.path.join(cache_dir, name))
+                entries.append((stat.st_atime, name, stat.st_size))
+        self._entries = OrderedDict((name, size) for _, name, size in sorted(entries))
+        self._total_bytes = sum(self._entries.values())
+        self._last_used = {}  # Name -> monotonic time it was last handed out by this process
+
+    def _touch(self, name):
+        # Called with the lock held; returns False if the variant is gone
+        if name not in self._entries:
+            return False
+        path = os.path.join(self.cache_dir, name)
+        try:
+            os.utime(path, ns=(time.time_ns(), os.stat(path).st_mtime_ns))
+        except OSError:
+            self._total_bytes -= self._entries.pop(name)
+            self._last_used.pop(name, None)
+            return False
+        self._entries.move_to_end(name)
+        self._last_used[name] = time.monotonic()
+        return True
+
+    def _evict(self):
+        # Called with the lock held. Entries are in LRU order, so once the
+        # oldest was used too recently to evict, all the others were too.
+        cutoff = time.monotonic() - self.min_age
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            oldest = next(iter(self._entries))
+            if self._last_used.get(oldest, float("-inf")) > cutoff:
+                break
+            self._total_bytes -= self._entries.pop(oldest)
+            self._last_used.pop(oldest, None)
+            try:
+                os.remove(os.path.join(self.cache_dir, oldest))
+            except OSError:
+                pass
+
+    def get(self, source_path, width):
+        """
+        Return the path of source_path resized to width pixels, creating it
+        on first use. The source itself is returned when it is no wider than
+        width or cannot be resized.
+        """
+        stat = os.stat(source_path)
+        ext = os.path.splitext(source_path)[1].lower()
+        version = f"{os.path.abspath(source_path)}:{stat.st_mtime_ns}:{stat.st_size}:{width}"
+        name = hashlib.sha256(version.encode()).hexdigest() + ext
+        path = os.path.join(self.cache_dir, name)
+
+        with self._lock:
+            if self._touch(name):
+                return path
+
+        try:
+            with Image.open(source_path) as header: # Reads the header only
+                source_width, source_height = header.size
+        except OSError:
+            return source_path
+        output_conf = _output_conf_for(source_path)
+        if width >= source_width or output_conf is None:
+            return source_path
+
+        with _render_lock(path):
+            with self._lock:
+                if self._touch(name):
+                    return path
+            img = cv2.imread(source_path)
+            if img is None:
+                return source_path
+            resized = cv2.resize(img, (width, max(1, round(source_height * width / source_width))),
+                                 interpolation=cv2.INTER_AREA)
+            pipeline.write_image(path, resized, pipeline.encode_params(output_conf))
+
+            with self._lock:
+                self._entries[name] = os.path.getsize(path)
+                self._total_bytes += self._entries[name]
+                self._last_used[name] = time.monotonic()
+                self._evict()
+        return path
+
+    def stats(self):
+        """Return the number of variants and their total size."""
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._total_bytes, "max_bytes": self.max_bytes}
+
+
+_variant_cache = None
+_variant_cache_lock = threading.Lock()
+
+
+def get_variant_cache():
+    """Return the process-wide variant cache, creating its directory on first use."""
+    global _variant_cache
+    with _variant_cache_lock:
+        if _variant_cache is None:
+            _variant_cache = VariantCache()
+        return _variant_cache
+
+
+def resolve_variant(output_dir, filename, width):
+    """
+    Return the path of an output image resized to (at least) width pixels,
+    or of the image itself when it is no wider than that.
+    """
+    file_path = resolve_output_file(output_dir, filename)
+    if not os.path.isfile(file_path) or _file_type(filename) != "image":
+        return file_path
+    snapped = variant_width(width)
+    if snapped is None:
+        return file_path
+    return get_variant_cache().get(file_path, snapped)
@@ -0,0 +1,328 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+from starlette.concurrency import run_in_threadpool
+
+try:
+    from python_multipart.exceptions import FormParserError
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ModuleNotFoundError:  # python-multipart < 0.0.13
+    from multipart.exceptions import FormParserError
+    from multipart.multipart import MultipartParser, parse_options_header
+
+# Largest single image accepted
+MAX_UPLOAD_FILE_BYTES = 50 * 1024 * 1024
+# Largest total of one /upload request
+MAX_UPLOAD_REQUEST_BYTES = 500 * 1024 * 1024
+# Most files accepted in one /upload request
+MAX_UPLOAD_FILES = 200
+# Form field carrying the uploaded images
+UPLOAD_FIELD = 'files'
+# Hex digits of the SHA-256 used in stored file names
+STORED_NAME_DIGITS = 32
+# Extensions of the images the pipeline reads (MaskrcnnGradAidAg.IMG_SUFFIXES)
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff')
+# Extension an upload is stored under when its filename has none of IMAGE_EXTENSIONS
+CONTENT_TYPE_EXTENSIONS = {'image/png': '.png', 'image/jpeg': '.jpg', 'image/tiff': '.tif'}
+
+PART_SUFFIX = '.part'
+# Stored name -> original filename of the images in an input directory
+UPLOAD_NAMES_FILE = '.upload-names.json'
+
+_names_lock = threading.Lock()
+
+
+class UploadTooLargeError(Exception):
+    """Raised when a file or a whole upload exceeds its size limit."""
+
+
+class InvalidUploadError(ValueError):
+    """Raised when an upload is malformed, has too many files or a file is not an image."""
+
+
+def upload_extension(filename, content_type):
+    """
+    Extension an upload is stored under: its own if the pipeline reads it,
+    else the one of its content type, or None if it is not an image the
+    pipeline reads.
+    """
+    _, ext = os.path.splitext(original_name(filename))
+    if ext.lower() in IMAGE_EXTENSIONS:
+        return ext.lower()
+    return CONTENT_TYPE_EXTENSIONS.get(content_type.split(';')[0].strip().lower())
+
+
+def stored_name(digest, extension):
+    """Content-addressed name for an upload: its SHA-256 plus its extension."""
+    return digest[:STORED_NAME_DIGITS] + extension
+
+
+def original_name(filename):
+    """The client's filename without any directory part, or '' if nothing usable is left."""
+    name = os.path.basename((filename or '').replace('\\', '/')).strip()
+    return '' if name in ('.', '..') else name
+
+
+class _Part:
+    """One file of the request being written to its part file."""
+
+    def __init__(self, filename, extension, path, out):
+        self.filename = filename
+        self.extension = extension
+        self.path = path
+        self.out = out
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.pending = []  # Bytes received but not written yet
+
+
+class _UploadReceiver:
+    """
+    Collects the multipart parser's callbacks while a chunk is parsed, so
+    they can be handled afterwards with awaits for the disk writes.
+    """
+
+    def __init__(self, boundary):
+        self.events = []
+        self.ended = False
+        self.parser = MultipartParser(boundary, {
+            'on_part_begin': lambda: self.events.append(('begin', b'')),
+            'on_header_field': lambda data, start, end: self.events.append(('field', data[start:end])),
+            'on_header_value': lambda data, start, end: self.events.append(('value', data[start:end])),
+            'on_header_end': lambda: self.events.append(('header_end', b'')),
+            'on_headers_finished': lambda: self.events.append(('headers', b'')),
+            'on_part_data': lambda data, start, end: self.events.append(('data', data[start:end])),
+            'on_part_end': lambda: self.events.append(('end', b'')),
+            'on_end': self._on_end,
+        })
+
+    def _on_end(self):
+        self.ended = True
+
+    def feed(self, chunk):
+        """Parse a chunk of the body and return the events it produced."""
+        self.events = []
+        try:
+            if chunk:
+                self.parser.write(chunk)
+            else:
+                self.parser.finalize()
+        except FormParserError as e:
+            raise InvalidUploadError(f"Invalid upload: {e}") from e
+        return self.events
+
+
+def _part_headers(header_list):
+    """Form field name, filename (None for plain fields) and content type of a part."""
+    headers = {field.lower(): value for field, value in header_list}
+    _, options = parse_options_header(headers.get(b'content-disposition', b''))
+    name = options.get(b'name', b'').decode('utf-8', 'replace')
+    filename = options.get(b'filename')
+    content_type = headers.get(b'content-type', b'').decode('latin-1')
+    return name, None if filename is None else filename.decode('utf-8', 'replace'), content_type
+
+
+def _commit_part(part_path, target_path):
+    """Move a finished part into place; returns False if identical content was already stored."""
+    if os.path.exists(target_path):
+        os.remove(part_path)
+        return False
+    os.replace(part_path, target_path)
+    return True
+
+
+def _remove_parts(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def load_upload_names(input_dir):
+    """
+    Return the original filenames of the images stored in input_dir.
+
+    Returns:
+        dict: Stored (content-addressed) name -> original filename
+    """
+    try:
+        with open(os.path.join(input_dir, UPLOAD_NAMES_FILE), encoding='utf-8') as f:
+            names = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return names if isinstance(names, dict) else {}
+
+
+def _unique_name(name, taken):
+    stem, ext = os.path.splitext(name)
+    candidate, n = name, 2
+    while candidate in taken:
+        candidate = f"{stem} ({n}){ext}"
+        n += 1
+    return candidate
+
+
+def _record_upload_names(input_dir, uploads):
+    """
+    Add (stored name, original filename) pairs to input_dir's name map.
+    An image keeps the first name it was uploaded under. Different images
+    uploaded under the same filename are told apart as "name (2).ext" and
+    so on, since results and output files are named after the original
+    filename.
+
+    Returns:
+        dict: Stored name -> the name recorded for it
+    """
+    with _names_lock:
+        names = load_upload_names(input_dir)
+        for stored, original in uploads:
+            if stored not in names:
+                names[stored] = _unique_name(original or stored, set(names.values()))
+        path = os.path.join(input_dir, UPLOAD_NAMES_FILE)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(names, f)
+        os.replace(tmp_path, path)
+        return {stored: names[stored] for stored, _ in uploads}
+
+
+async def receive_uploads(request, input_dir, max_file_bytes=MAX_UPLOAD_FILE_BYTES,
+                          max_request_bytes=MAX_UPLOAD_REQUEST_BYTES, max_files=MAX_UPLOAD_FILES):
+    """
+    Parse a multipart/form-data request as it arrives and store the images
+    of its "files" field in input_dir under content-addressed names.
+
+    Each file is hashed and written to a temporary part file while its bytes
+    come in, and every limit is checked as they do, so an oversized request
+    is refused without being read to the end. Parts are only moved into
+    place once the whole request has been received within its limits, so a
+    rejected request leaves nothing behind. A file whose content is already
+    stored is not written again. The original filenames are recorded for
+    load_upload_names.
+
+    Args:
+        request (Request): The incoming request
+        input_dir (str): Directory the pipeline reads images from
+        max_file_bytes (int): Limit per file
+        max_request_bytes (int): Limit for the whole request body
+        max_files (int): Limit on the number of files
+
+    Returns:
+        dict: A dictionary containing:
+            - files: Per file, its original filename, the image_name its results
+              are reported under, stored_as name, size and whether it was a duplicate
+            - bytes_received: Total bytes of the files
+            - upload_seconds: Wall time from the start of the body to its end
+            - megabytes_per_second: Request body throughput
+
+    Raises:
+        UploadTooLargeError: If a file or the request exceeds its limit
+        InvalidUploadError: If the body is not valid multipart data, holds no
+            files or too many, or a file is not an image the pipeline reads
+    """
+    content_type, options = parse_options_header(request.headers.get('content-type', ''))
+    boundary = options.get(b'boundary')
+    if content_type != b'multipart/form-data' or not boundary:
+        raise InvalidUploadError("Upload must be multipart/form-data")
+
+    os.makedirs(input_dir, exist_ok=True)
+    receiver = _UploadReceiver(boundary)
+    received, part_paths = [], []
+    part = None
+    header_list, header_field, header_value = [], b'', b''
+    skipping = False  # In a part that is not a file of UPLOAD_FIELD
+    body_bytes = 0
+
+    async def flush(part):
+        if part.pending:
+            data = b''.join(part.pending)
+            part.pending = []
+            await run_in_threadpool(part.out.write, data)
+
+    start = time.perf_counter()
+    try:
+        stream = request.stream()
+        while not receiver.ended:
+            chunk = await anext(stream, b'')
+            body_bytes += len(chunk)
+            if body_bytes > max_request_bytes:
+                raise UploadTooLargeError(
+                    f"Upload exceeds the {max_request_bytes // (1024 * 1024)} MB request limit")
+
+            for kind, data in receiver.feed(chunk):
+                if kind == 'begin':
+                    header_list, header_field, header_value = [], b'', b''
+                elif kind == 'field':
+                    header_field += data
+                elif kind == 'value':
+                    header_value += data
+                elif kind == 'header_end':
+                    header_list.append((header_field, header_value))
+                    header_field, header_value = b'', b''
+                elif kind == 'headers':
+                    name, filename, part_type = _part_headers(header_list)
+                    skipping = name != UPLOAD_FIELD or filename is None
+                    if skipping:
+                        continue
+                    if len(received) >= max_files:
+                        raise InvalidUploadError(f"Too many files; at most {max_files} per upload")
+                    if not part_type.startswith('image/'):
+                        raise InvalidUploadError(f"File {filename} is not an image")
+                    extension = upload_extension(filename, part_type)
+                    if extension is None:
+                        raise InvalidUploadError(f"File {filename} is not a PNG, JPEG or TIFF image")
+                    path = os.path.join(input_dir, f".upload-{uuid.uuid4().hex}{PART_SUFFIX}")
+                    part_paths.append(path)
+                    part = _Part(filename, extension, path, await run_in_threadpool(open, path, 'wb'))
+                elif kind == 'data' and part is not None and not skipping:
+                    part.size += len(data)
+                    if part.size > max_file_bytes:
+                        raise UploadTooLargeError(
+                            f"File {part.filename} exceeds the {max_file_bytes // (1024 * 1024)} MB file limit")
+                    part.digest.update(data)
+                    part.pending.append(data)
+                elif kind == 'end' and part is not None and not skipping:
+                    await flush(part)
+                    await run_in_threadpool(part.out.close)
+                    received.append(part)
+                    part = None
+            if part is not None:
+                await flush(part)
+            if not chunk and not receiver.ended:
+                raise InvalidUploadError("Upload ended before the multipart body was complete")
+    except BaseException:
+        if part is not None:
+            await run_in_threadpool(part.out.close)
+        await run_in_threadpool(_remove_parts, part_paths)
+        raise
+
+    if not received:
+        raise InvalidUploadError("No files uploaded")
+
+    files = []
+    for part in received:
+        name = stored_name(part.digest.hexdigest(), part.extension)
+        created = await run_in_threadpool(_commit_part, part.path, os.path.join(input_dir, name))
+        files.append({
+            'filename': part.filename,
+            'stored_as': name,
+            'size': part.size,
+            'duplicate': not created
+        })
+    recorded = await run_in_threadpool(_record_upload_names, input_dir,
+                                       [(f['stored_as'], original_name(f['filename'])) for f in files])
+    for f in files:
+        f['image_name'] = recorded[f['stored_as']]
+    seconds = time.perf_counter() - start
+
+    return {
+        'files': files,
+        'bytes_received': sum(f['size'] for f in files),
+        'upload_seconds': seconds,
+        'megabytes_per_second': body_bytes / (1024 * 1024) / seconds if seconds > 0 else 0.0
+    }
@@ -1,4 +1,4 @@
-from database import get_connection
+from database import connect, get_connection
 
 
 def add_analysis(image_name, object_id_in_image, area_px2, top_left_x, top_left_y,
@@ -9,22 +9,54 @@ def add_analysis(image_name, object_id_in_image, area_px2, top_left_x, top_left_
     conn = get_connection()
     cursor = conn.cursor()
 
-    cursor.execute('''
-        INSERT INTO user_analysis (
-            image_name, object_id_in_image, area_px2, top_left_x, top_left_y,
-            bottom_right_x, bottom_right_y, center, width_px, length_px,
-            volume_px3, solidity, strict_solidity, lw_ratio, area_in2,
-            weight_oz, price_usd, grade, user_id
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (image_name, object_id_in_image, area_px2, top_left_x, top_left_y,
-          bottom_right_x, bottom_right_y, center, width_px, length_px,
-          volume_px3, solidity, strict_solidity, lw_ratio, area_in2,
-          weight_oz, price_usd, grade, user_id))
-
-    conn.commit()
-    analysis_id = cursor.lastrowid
-    conn.close()
-    return analysis_id
+    with conn:
+        cursor.execute('''
+            INSERT INTO user_analysis (
+                image_name, object_id_in_image, area_px2, top_left_x, top_left_y,
+                bottom_right_x, bottom_right_y, center, width_px, length_px,
+                volume_px3, solidity, strict_solidity, lw_ratio, area_in2,
+                weight_oz, price_usd, grade, user_id
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (image_name, object_id_in_image, area_px2, top_left_x, top_left_y,
+              bottom_right_x, bottom_right_y, center, width_px, length_px,
+              volume_px3, solidity, strict_solidity, lw_ratio, area_in2,
+              weight_oz, price_usd, grade, user_id))
+
+    return cursor.lastrowid
+
+
+# Columns written per object by add_analyses, in INSERT order (user_id is appended)
+ANALYSIS_FIELDS = (
+    'image_name', 'object_id_in_image', 'area_px2', 'top_left_x', 'top_left_y',
+    'bottom_right_x', 'bottom_right_y', 'center', 'width_px', 'length_px',
+    'volume_px3', 'solidity', 'strict_solidity', 'lw_ratio', 'area_in2',
+    'weight_oz', 'price_usd', 'grade'
+)
+_INSERT_ANALYSIS_SQL = f'''
+    INSERT INTO user_analysis ({', '.join(ANALYSIS_FIELDS)}, user_id)
+    VALUES ({', '.join('?' * (len(ANALYSIS_FIELDS) + 1))})
+'''
+
+
+def add_analyses(records, user_id):
+    """
+    Add many analysis records for one user in a single transaction.
+
+    Args:
+        records: Iterable of dicts keyed by ANALYSIS_FIELDS
+        user_id: ID of the user the records belong to
+
+    Returns:
+        int: Number of records inserted
+    """
+    rows = [tuple(record[field] for field in ANALYSIS_FIELDS) + (user_id,) for record in records]
+    if not rows:
+        return 0
+
+    conn = get_connection()
+    with conn:
+        conn.executemany(_INSERT_ANALYSIS_SQL, rows)
+    return len(rows)
 
 
 def get_user_analyses(user_id):
@@ -42,9 +74,94 @@ def get_user_analyses(user_id):
         ORDER BY object_id
     ''', (user_id,))
 
-    analyses = cursor.fetchall()
-    conn.close()
-    return analyses
+    return cursor.fetchall()
+
+
+# Columns a page of analyses can be narrowed to
+ANALYSIS_COLUMNS = ('object_id',) + ANALYSIS_FIELDS + ('user_id',)
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Rows fetched from the export cursor at a time
+EXPORT_BATCH_ROWS = 5000
+
+
+def select_columns(fields=None):
+    """
+    Resolve a requested column list against ANALYSIS_COLUMNS.
+
+    Args:
+        fields (list, optional): Column names (default: all of ANALYSIS_COLUMNS)
+
+    Returns:
+        list: The columns to select, object_id first
+
+    Raises:
+        ValueError: If a field is unknown
+    """
+    columns = list(ANALYSIS_COLUMNS) if not fields else ['object_id'] + [f for f in fields if f != 'object_id']
+    unknown = [f for f in columns if f not in ANALYSIS_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return columns
+
+
+def get_analyses_page(user_id=None, limit=DEFAULT_PAGE_SIZE, after=None, fields=None,
+                      grade=None, image_name=None, min_weight=None, max_weight=None):
+    """
+    Get one page of analysis records in object_id order, using keyset
+    pagination: pass the returned next_after as after to get the next page.
+
+    Args:
+        user_id (int, optional): Only this user's records
+        limit (int): Page size, at most MAX_PAGE_SIZE
+        after (int, optional): Return records with object_id greater than this
+        fields (list, optional): Columns to return (default: all of ANALYSIS_COLUMNS);
+            object_id is always included
+        grade (str, optional): Only records with this grade
+        image_name (str, optional): Only records of this image
+        min_weight (float, optional): Only records weighing at least this many oz
+        max_weight (float, optional): Only records weighing at most this many oz
+
+    Returns:
+        dict: A dictionary containing:
+            - analyses: The page's records as dictionaries
+            - next_after: Cursor for the next page, or None on the last page
+
+    Raises:
+        ValueError: If limit is out of range or a field is unknown
+    """
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    columns = select_columns(fields)
+
+    # Column names are whitelisted by select_columns; every value is a bound parameter
+    conditions, params = [], []
+    for condition, value in (('user_id = ?', user_id), ('object_id > ?', after),
+                             ('grade = ?', grade), ('image_name = ?', image_name),
+                             ('weight_oz >= ?', min_weight), ('weight_oz <= ?', max_weight)):
+        if value is not None:
+            conditions.append(condition)
+            params.append(value)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    # One extra row tells whether another page follows
+    cursor.execute(f'''
+        SELECT {', '.join(columns)}
+        FROM user_analysis
+        {where}
+        ORDER BY object_id
+        LIMIT ?
+    ''', (*params, limit + 1))
+    rows = cursor.fetchall()
+
+    has_more = len(rows) > limit
+    analyses = [dict(zip(columns, row)) for row in rows[:limit]]
+    return {
+        'analyses': analyses,
+        'next_after': analyses[-1]['object_id'] if has_more else None
+    }
 
 
 def get_all_analyses():
@@ -61,9 +178,134 @@ def get_all_analyses():
         ORDER BY object_id
     ''')
 
-    analyses = cursor.fetchall()
-    conn.close()
-    return analyses
+    return cursor.fetchall()
+
+
+def iter_analysis_batches(columns, user_id=None, batch_size=EXPORT_BATCH_ROWS):
+    """
+    Yield analysis records in object_id order as lists of at most batch_size
+    tuples, reading them from the cursor as they are consumed.
+
+    The export holds its own connection so a slow download neither ties up a
+    thread's shared connection nor needs to stay on one thread; it is closed
+    when the generator finishes or is closed.
+
+    Args:
+        columns (list): Columns to select, as returned by select_columns
+        user_id (int, optional): Only this user's records
+        batch_size (int): Rows per fetchmany call
+    """
+    conn = connect(check_same_thread=False)
+    try:
+        cursor = conn.cursor()
+        where, params = ('WHERE user_id = ?', (user_id,)) if user_id is not None else ('', ())
+        cursor.execute(f'''
+            SELECT {', '.join(columns)}
+            FROM user_analysis
+            {where}
+            ORDER BY object_id
+        ''', params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield rows
+    finally:
+        conn.close()
+
+
+# Grouping keys accepted by get_analysis_summary
+SUMMARY_GROUPS = {
+    'user': ('user_id',),
+    'image': ('user_id', 'image_name')
+}
+
+
+def get_analysis_summary(user_id=None, group_by='user'):
+    """
+    Aggregate analysis records per user or per image with one GROUP BY query.
+
+    Args:
+        user_id (int, optional): Only this user's records
+        group_by (str): 'user' or 'image' (per user and image name)
+
+    Returns:
+        list: One dictionary per group with the group key columns and:
+            - total_classifications: Number of records
+            - grade_counts: Records per grade ('Marketable', 'Not Marketable', 'Ungraded')
+            - weight_stats: count, mean, min and max of weight_oz
+            - total_price_usd: Sum of the per-object prices
+
+    Raises:
+        ValueError: If group_by is unknown
+    """
+    if group_by not in SUMMARY_GROUPS:
+        raise ValueError(f"group_by must be one of: {', '.join(SUMMARY_GROUPS)}")
+    keys = SUMMARY_GROUPS[group_by]
+    where, params = ('WHERE user_id = ?', (user_id,)) if user_id is not None else ('', ())
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT {', '.join(keys)},
+               COUNT(*),
+               SUM(grade = 'Marketable'),
+               SUM(grade = 'Not Marketable'),
+               SUM(grade IS NULL),
+               COUNT(weight_oz), AVG(weight_oz), MIN(weight_oz), MAX(weight_oz),
+               TOTAL(price_usd)
+        FROM user_analysis
+        {where}
+        GROUP BY {', '.join(keys)}
+        ORDER BY {', '.join(keys)}
+    ''', params)
+
+    summaries = []
+    for row in cursor.fetchall():
+        group = dict(zip(keys, row))
+        total, marketable, not_marketable, ungraded, weighed, mean, low, high, price = row[len(keys):]
+        summaries.append({
+            **group,
+            'total_classifications': total,
+            'grade_counts': {
+                'Marketable': marketable,
+                'Not Marketable': not_marketable,
+                'Ungraded': ungraded
+            },
+            'weight_stats': {'count': weighed, 'mean': mean, 'min': low, 'max': high},
+            'total_price_usd': price
+        })
+    return summaries
+
+
+# Columns of user_analysis_rollup returned by get_analysis_rollup
+ROLLUP_FIELDS = (
+    'total_classifications', 'marketable_count', 'not_marketable_count', 'ungraded_count',
+    'weight_count', 'total_weight_oz', 'total_price_usd', 'updated_at'
+)
+
+
+def get_analysis_rollup(user_id):
+    """
+    Get a user's running analysis totals from user_analysis_rollup.
+
+    The rollup is kept up to date by triggers on user_analysis, so this is a
+    single primary-key lookup however many records the user has.
+
+    Returns:
+        dict: The ROLLUP_FIELDS values (zeros for a user without records)
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT {', '.join(ROLLUP_FIELDS)}
+        FROM user_analysis_rollup
+        WHERE user_id = ?
+    ''', (user_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return {**{field: 0 for field in ROLLUP_FIELDS}, 'updated_at': None}
+    return dict(zip(ROLLUP_FIELDS, row))
 
 
 def delete_user_analyses(user_id):
@@ -71,11 +313,9 @@ def delete_user_analyses(user_id):
     conn = get_connection()
     cursor = conn.cursor()
 
-    cursor.execute('DELETE FROM user_analysis WHERE user_id = ?', (user_id,))
-    conn.commit()
-    rows_affected = cursor.rowcount
-    conn.close()
-    return rows_affected
+    with conn:
+        cursor.execute('DELETE FROM user_analysis WHERE user_id = ?', (user_id,))
+    return cursor.rowcount
 
 
 def delete_analysis(object_id):
@@ -83,8 +323,6 @@ def delete_analysis(object_id):
     conn = get_connection()
     cursor = conn.cursor()
 
-    cursor.execute('DELETE FROM user_analysis WHERE object_id = ?', (object_id,))
-    conn.commit()
-    rows_affected = cursor.rowcount
-    conn.close()
-    return rows_affected
+    with conn:
+        cursor.execute('DELETE FROM user_analysis WHERE object_id = ?', (object_id,))
+    return cursor.rowcount
@@ -1,4 +1,61 @@
 from database import save_user_profit, get_user_profit
+from services.user_analysis_service import get_analysis_rollup
+
+# Pricing constants, kept in step with frontend/src/services/PricingService.ts
+MARKETABLE_RATIO = 0.35
+PENALTY = 15
+MARKETABLE_PRICE = 0.56
+NOT_MARKETABLE_PRICE = 0.008
+FINAL_COUNT = 20
+
+SCENARIO_BIN = 1
+SCENARIO_CONVEYOR = 2
+
+
+def pricing_summary(total, marketable, scenario):
+    """
+    Compute the profit metrics for a set of classifications.
+
+    Args:
+        total (int): Number of classifications
+        marketable (int): How many of them are marketable
+        scenario (int): 1 (bin: penalized for straying from MARKETABLE_RATIO) or 2 (conveyor: no penalty)
+
+    Returns:
+        dict: The same metrics save_profit_data stores
+    """
+    if total == 0:
+        marketable_proportion = not_marketable_proportion = 0.0
+    else:
+        marketable_proportion = marketable / total
+        not_marketable_proportion = (total - marketable) / total
+
+    total_penalty = abs(marketable_proportion - MARKETABLE_RATIO) * PENALTY if scenario == SCENARIO_BIN and total else 0.0
+    total_marketable_revenue = marketable_proportion * FINAL_COUNT * MARKETABLE_PRICE
+    total_not_marketable_revenue = not_marketable_proportion * FINAL_COUNT * NOT_MARKETABLE_PRICE
+    total_revenue = total_marketable_revenue + total_not_marketable_revenue
+
+    return {
+        'total_profit': total_revenue - total_penalty,
+        'total_revenue': total_revenue,
+        'total_penalty': total_penalty,
+        'marketable_proportion': marketable_proportion,
+        'not_marketable_proportion': not_marketable_proportion,
+        'total_classifications': total,
+        'total_marketable_classifications': marketable,
+        'total_not_marketable_classifications': total - marketable,
+        'total_marketable_revenue': total_marketable_revenue,
+        'total_not_marketable_revenue': total_not_marketable_revenue
+    }
+
+
+def calculate_pricing_summary(user_id, scenario):
+    """
+    Compute a user's profit metrics for a scenario from their running
+    analysis rollup, without reading the records themselves.
+    """
+    rollup = get_analysis_rollup(user_id)
+    return pricing_summary(rollup['total_classifications'], rollup['marketable_count'], scenario)
 
 
 def save_profit_data(user_id, scenario, profit_data):
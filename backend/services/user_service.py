@@ -1,3 +1,5 @@
+import sqlite3
+
 from database import get_connection
 
 
@@ -23,7 +25,6 @@ def get_or_create_name(name):
 
     if existing_user:
         # Name already exists
-        conn.close()
         return {
             'id': existing_user[0],
             'name': existing_user[1],
@@ -31,10 +32,13 @@ def get_or_create_name(name):
         }
     else:
         # Name doesn't exist, create it
-        cursor.execute('INSERT INTO user (name) VALUES (?)', (name,))
-        conn.commit()
+        try:
+            with conn:
+                cursor.execute('INSERT INTO user (name) VALUES (?)', (name,))
+        except sqlite3.IntegrityError:
+            # Created by a concurrent request since the lookup; names are unique
+            return get_or_create_name(name)
         user_id = cursor.lastrowid
-        conn.close()
 
         return {
             'id': user_id,
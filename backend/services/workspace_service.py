@@ -0,0 +1,173 @@
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+
+from services.upload_service import PART_SUFFIX, UPLOAD_NAMES_FILE
+
+# Per-user workspaces live in WORKSPACE_ROOT/user_<id>/input and .../output
+WORKSPACE_ROOT = "workspaces"
+# Requests without a user_id share the original top-level directories
+SHARED_INPUT_DIR = "input"
+SHARED_OUTPUT_DIR = "output"
+SHARED_WORKSPACE = "shared"
+# Key signing the workspace tokens; created on first use
+WORKSPACE_SECRET_FILE = os.path.join(WORKSPACE_ROOT, ".secret")
+# Hex digits of a workspace token
+TOKEN_DIGITS = 32
+
+_USER_PREFIX = "user_"
+_secret = None
+_secret_lock = threading.Lock()
+
+
+class WorkspaceAccessError(PermissionError):
+    """Raised when a request for a user's workspace lacks that user's token."""
+
+
+def _workspace_secret():
+    global _secret
+    with _secret_lock:
+        if _secret is None:
+            os.makedirs(WORKSPACE_ROOT, exist_ok=True)
+            try:
+                # Exclusive create, so concurrent processes agree on one key
+                fd = os.open(WORKSPACE_SECRET_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(secrets.token_bytes(32))
+            except FileExistsError:
+                pass
+            with open(WORKSPACE_SECRET_FILE, 'rb') as f:
+                _secret = f.read()
+        return _secret
+
+
+def _sign(message):
+    return hmac.new(_workspace_secret(), message.encode(), hashlib.sha256).hexdigest()[:TOKEN_DIGITS]
+
+
+def workspace_token(user_id):
+    """Token proving access to a user's workspace, handed out when the user signs in."""
+    return _sign(str(int(user_id)))
+
+
+def file_signature(user_id, filename):
+    """Signature granting read access to one output file (and its thumbnail) of a user's workspace."""
+    return _sign(f"file:{int(user_id)}:{filename}")
+
+
+class Workspace:
+    """Input and output directories of one user's classification runs."""
+
+    def __init__(self, user_id, input_dir, output_dir):
+        self.user_id = user_id
+        self.key = SHARED_WORKSPACE if user_id is None else f"{_USER_PREFIX}{user_id}"
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+
+    @property
+    def query(self):
+        """Query string identifying this workspace to the API; empty for the shared one."""
+        if self.user_id is None:
+            return ""
+        return f"?user_id={self.user_id}&token={workspace_token(self.user_id)}"
+
+    def file_url(self, filename):
+        """URL of a file in this workspace's output directory."""
+        return f"/output/file/{filename}{self.query}"
+
+    def thumbnail_url(self, filename):
+        """URL of the thumbnail of an annotated image in this workspace."""
+        return f"/output/thumbnail/{filename}{self.query}"
+
+    def _signed_query(self, filename):
+        if self.user_id is None:
+            return ""
+        return f"?user_id={self.user_id}&sig={file_signature(self.user_id, filename)}"
+
+    def signed_file_url(self, filename):
+        """
+        URL of a file in this workspace's output directory that grants access
+        to that file only, for listings shown to someone other than the owner.
+        """
+        return f"/output/file/{filename}{self._signed_query(filename)}"
+
+    def signed_thumbnail_url(self, filename):
+        """Like signed_file_url, for the thumbnail of an annotated image."""
+        return f"/output/thumbnail/{filename}{self._signed_query(filename)}"
+
+
+def get_workspace(user_id=None):
+    """
+    Return the workspace of a user, creating its directories on first use.
+
+    Args:
+        user_id (int, optional): Owner of the workspace; None for the shared workspace
+
+    Returns:
+        Workspace: The user's input and output directories
+    """
+    if user_id is None:
+        workspace = Workspace(None, SHARED_INPUT_DIR, SHARED_OUTPUT_DIR)
+    else:
+        root = os.path.join(WORKSPACE_ROOT, f"{_USER_PREFIX}{int(user_id)}")
+        workspace = Workspace(int(user_id), os.path.join(root, "input"), os.path.join(root, "output"))
+    os.makedirs(workspace.input_dir, exist_ok=True)
+    os.makedirs(workspace.output_dir, exist_ok=True)
+    return workspace
+
+
+def authorize_workspace(user_id=None, token=None):
+    """
+    Return a user's workspace if token is theirs. The shared workspace
+    (user_id None) needs no token.
+
+    Raises:
+        WorkspaceAccessError: If the token is missing or belongs to someone else
+    """
+    if user_id is not None and not (token and hmac.compare_digest(str(token), workspace_token(user_id))):
+        raise WorkspaceAccessError(f"Access to the workspace of user {user_id} requires their token")
+    return get_workspace(user_id)
+
+
+def authorize_file(user_id=None, filename=None, token=None, sig=None):
+    """
+    Return a user's workspace for reading filename, given either the
+    workspace token or that file's signature (see Workspace.signed_file_url).
+
+    Raises:
+        WorkspaceAccessError: If neither grants access
+    """
+    if user_id is not None and sig and hmac.compare_digest(str(sig), file_signature(user_id, filename)):
+        return get_workspace(user_id)
+    return authorize_workspace(user_id, token)
+
+
+def list_workspaces():
+    """Return the shared workspace followed by every user workspace on disk."""
+    workspaces = [get_workspace()]
+    if os.path.isdir(WORKSPACE_ROOT):
+        for name in sorted(os.listdir(WORKSPACE_ROOT)):
+            user_id = name[len(_USER_PREFIX):]
+            if name.startswith(_USER_PREFIX) and user_id.isdigit():
+                workspaces.append(get_workspace(int(user_id)))
+    return workspaces
+
+
+def clear_input(workspace):
+    """
+    Delete the uploaded images of a workspace and their original names.
+    Part files of uploads still in progress are left for their request to
+    finish or clean up.
+
+    Returns:
+        int: Number of files deleted
+    """
+    deleted = 0
+    for filename in os.listdir(workspace.input_dir):
+        file_path = os.path.join(workspace.input_dir, filename)
+        if os.path.isfile(file_path) and not filename.endswith(PART_SUFFIX):
+            os.remove(file_path)
+            deleted += filename != UPLOAD_NAMES_FILE
+    return deleted
@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+# Tests import the backend modules the way server.py does, from the backend directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """Point the database module at a fresh file for the duration of a test."""
+    path = str(tmp_path / 'test.db')
+    database.close_connection()
+    monkeypatch.setattr(database, 'DB_PATH', path)
+    yield path
+    database.close_connection()
@@ -0,0 +1,87 @@
+import re
+
+import pytest
+
+import database
+from services.image_service import add_image_match, get_images_by_user
+from services.user_analysis_service import (
+    ANALYSIS_FIELDS, add_analyses, get_analyses_page, get_user_analyses
+)
+from services.user_service import get_or_create_name
+
+LATEST_VERSION = database.MIGRATIONS[-1][0]
+
+
+def _record(image_name, weight_oz, grade):
+    record = dict.fromkeys(ANALYSIS_FIELDS)
+    record.update(image_name=image_name, object_id_in_image=1, weight_oz=weight_oz, grade=grade)
+    return record
+
+
+@pytest.fixture
+def populated_db(db_path):
+    """A migrated database with a few users, images and analyses."""
+    database.init_db()
+    for user in ('alice', 'bob', 'carol'):
+        user_id = get_or_create_name(user)['id']
+        for i in range(20):
+            add_image_match(f'{user}_{i}.jpg', user_id)
+        add_analyses([_record(f'{user}_{i}.jpg', 4.0 + i, 'Marketable') for i in range(50)], user_id)
+    return db_path
+
+
+def _schema(conn):
+    return conn.execute('SELECT type, name, sql FROM sqlite_master ORDER BY type, name').fetchall()
+
+
+def _traced_selects(call):
+    """Run call and return the SELECT statements it executes, with parameters bound."""
+    conn = database.get_connection()
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        call()
+    finally:
+        conn.set_trace_callback(None)
+    return [sql for sql in statements if sql.lstrip().upper().startswith('SELECT')]
+
+
+def test_migrate_brings_new_database_to_latest_version(db_path):
+    conn = database.connect()
+    try:
+        assert database.migrate(conn) == LATEST_VERSION == 3
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == 3
+    finally:
+        conn.close()
+
+
+def test_migrate_twice_is_harmless(populated_db):
+    conn = database.get_connection()
+    schema = _schema(conn)
+    users = conn.execute('SELECT id, name FROM user ORDER BY id').fetchall()
+    rollup = conn.execute('SELECT * FROM user_analysis_rollup ORDER BY user_id').fetchall()
+
+    assert database.migrate(conn) == LATEST_VERSION
+    database.init_db()
+
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == LATEST_VERSION
+    assert _schema(conn) == schema
+    assert conn.execute('SELECT id, name FROM user ORDER BY id').fetchall() == users
+    assert conn.execute('SELECT * FROM user_analysis_rollup ORDER BY user_id').fetchall() == rollup
+
+
+@pytest.mark.parametrize('lookup, index', [
+    (lambda: get_user_analyses(2), 'idx_user_analysis_user_object'),
+    (lambda: get_analyses_page(user_id=2, after=10), 'idx_user_analysis_user_object'),
+    (lambda: get_images_by_user(2), 'idx_image_match_user_image'),
+    (lambda: get_or_create_name('bob'), 'idx_user_name'),
+], ids=['user_analyses', 'analyses_page', 'images_by_user', 'user_by_name'])
+def test_lookups_search_their_index(populated_db, lookup, index):
+    selects = _traced_selects(lookup)
+    assert selects, 'lookup ran no SELECT'
+
+    conn = database.get_connection()
+    for sql in selects:
+        plan = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}')]
+        assert any(re.match(rf'SEARCH \w+ USING (COVERING )?INDEX {index} ', step) for step in plan), plan
+        assert not any(step.startswith('SCAN') for step in plan), plan
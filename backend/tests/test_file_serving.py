@@ -0,0 +1,161 @@
+import os
+from email.utils import formatdate
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from services.file_serving_service import RangeNotSatisfiableError, file_response, parse_range
+
+CONTENT = bytes(range(256)) * 4
+
+
+@pytest.fixture
+def served_file(tmp_path):
+    path = tmp_path / 'masked_a.jpg'
+    path.write_bytes(CONTENT)
+    os.utime(path, (1_700_000_000, 1_700_000_000))
+    return str(path)
+
+
+@pytest.fixture
+def client(served_file):
+    app = FastAPI()
+
+    @app.get('/file')
+    async def get_file(request: Request):
+        return file_response(request, served_file, filename='masked_a.jpg')
+
+    return TestClient(app)
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('bytes=0-99', (0, 99)),
+    ('bytes=1000-', (1000, 1023)),
+    ('bytes=1000-5000', (1000, 1023)),
+    ('bytes=-24', (1000, 1023)),
+    ('bytes=-5000', (0, 1023)),
+    ('items=0-10', None),
+    ('bytes=0-10,20-30', None),
+    ('bytes=10-5', None),
+    ('bytes=abc', None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, len(CONTENT)) == expected
+
+
+@pytest.mark.parametrize('header', ['bytes=1024-', 'bytes=-0'])
+def test_parse_range_unsatisfiable(header):
+    with pytest.raises(RangeNotSatisfiableError):
+        parse_range(header, len(CONTENT))
+
+
+def test_full_response_carries_validators(client):
+    response = client.get('/file')
+    assert response.status_code == 200
+    assert response.content == CONTENT
+    assert response.headers['etag']
+    assert response.headers['last-modified'] == formatdate(1_700_000_000, usegmt=True)
+    assert response.headers['accept-ranges'] == 'bytes'
+    assert response.headers['content-disposition'] == "inline; filename*=UTF-8''masked_a.jpg"
+
+
+def test_matching_etag_is_not_modified(client):
+    etag = client.get('/file').headers['etag']
+    assert client.get('/file', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/file', headers={'If-None-Match': f'"other", W/{etag}'}).status_code == 304
+    assert client.get('/file', headers={'If-None-Match': '"other"'}).status_code == 200
+
+
+def test_if_modified_since(client):
+    assert client.get('/file', headers={'If-Modified-Since': formatdate(1_700_000_000, usegmt=True)}).status_code == 304
+    assert client.get('/file', headers={'If-Modified-Since': formatdate(1_600_000_000, usegmt=True)}).status_code == 200
+    assert client.get('/file', headers={'If-Modified-Since': 'not a date'}).status_code == 200
+    # If-None-Match takes precedence
+    response = client.get('/file', headers={'If-None-Match': '"other"',
+                                            'If-Modified-Since': formatdate(1_700_000_000, usegmt=True)})
+    assert response.status_code == 200
+
+
+def test_single_range(client):
+    response = client.get('/file', headers={'Range': 'bytes=10-19'})
+    assert response.status_code == 206
+    assert response.content == CONTENT[10:20]
+    assert response.headers['content-range'] == f'bytes 10-19/{len(CONTENT)}'
+    assert response.headers['content-length'] == '10'
+
+
+def test_suffix_range(client):
+    response = client.get('/file', headers={'Range': 'bytes=-100'})
+    assert response.status_code == 206
+    assert response.content == CONTENT[-100:]
+    assert response.headers['content-range'] == f'bytes 924-1023/{len(CONTENT)}'
+
+
+def test_if_range(client):
+    etag = client.get('/file').headers['etag']
+    matching = client.get('/file', headers={'Range': 'bytes=0-9', 'If-Range': etag})
+    assert matching.status_code == 206
+    assert matching.content == CONTENT[:10]
+
+    stale = client.get('/file', headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+    assert stale.status_code == 200
+    assert stale.content == CONTENT
+
+
+def test_unsatisfiable_range(client):
+    response = client.get('/file', headers={'Range': f'bytes={len(CONTENT)}-'})
+    assert response.status_code == 416
+    assert response.headers['content-range'] == f'bytes */{len(CONTENT)}'
+    assert response.headers['etag']
+
+
+@pytest.fixture
+def output_service():
+    pytest.importorskip('detectron2')
+    from services import output_service
+    return output_service
+
+
+@pytest.fixture
+def clock(output_service, monkeypatch):
+    """A monotonic clock the test advances by hand."""
+    now = [1000.0]
+    monkeypatch.setattr(output_service.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def _images(tmp_path, count):
+    import cv2
+    import numpy as np
+    paths = []
+    for i in range(count):
+        path = tmp_path / f'masked_{i}.jpg'
+        cv2.imwrite(str(path), np.full((400, 800, 3), i * 40, np.uint8))
+        paths.append(str(path))
+    return paths
+
+
+def test_variant_cache_keeps_recently_used_variants(output_service, clock, tmp_path):
+    sources = _images(tmp_path, 3)
+    cache = output_service.VariantCache(str(tmp_path / 'variants'), max_bytes=1, min_age=60)
+
+    variants = [cache.get(source, 320) for source in sources]
+    assert all(os.path.exists(path) for path in variants)
+    assert cache.stats()['entries'] == 3  # Over the bound, but all just handed out
+
+    clock[0] += 30
+    assert cache.get(sources[0], 320) == variants[0]  # A hit renews its last use
+    clock[0] += 45
+    latest = cache.get(sources[0], 160)
+
+    assert os.path.exists(variants[0]) and os.path.exists(latest)
+    assert not os.path.exists(variants[1]) and not os.path.exists(variants[2])
+    assert cache.stats()['entries'] == 2
+
+
+def test_variant_cache_returns_source_when_not_wider(output_service, tmp_path):
+    source, = _images(tmp_path, 1)
+    cache = output_service.VariantCache(str(tmp_path / 'variants'))
+    assert cache.get(source, 960) == source
+    assert cache.stats()['entries'] == 0
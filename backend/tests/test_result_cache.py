@@ -0,0 +1,155 @@
+from collections import Counter
+
+import numpy as np
+import pytest
+
+pytest.importorskip('detectron2')
+cv2 = pytest.importorskip('cv2')
+
+import MaskrcnnGradAidAg as pipeline
+
+
+class FakePredictor:
+    """Stands in for the model: an image's detections name the image it was given."""
+
+    def __init__(self):
+        self.seen = []
+
+    def detect(self, img):
+        value = int(img[0, 0, 0])
+        self.seen.append(value)
+        return f'dets-of-{value}'
+
+
+class FakeCache:
+    """
+    A result cache keyed by filename. added_later holds images another job
+    caches between the two passes of _iter_results; vanished holds images
+    evicted between them.
+    """
+
+    def __init__(self, entries, added_later=(), vanished=()):
+        self.entries = dict(entries)
+        self.added_later = set(added_later)
+        self.vanished = set(vanished)
+
+    def key_for(self, image_path):
+        return image_path.rsplit('/', 1)[-1]
+
+    def contains(self, key):
+        present = key in self.entries
+        if key in self.added_later:
+            self.entries[key] = {'detections': f'cached-{key}'}
+        if key in self.vanished:
+            del self.entries[key]
+        return present
+
+    def get(self, key):
+        return self.entries.get(key)
+
+
+@pytest.fixture
+def images(tmp_path, monkeypatch):
+    """Write a.png, b.png, ... whose first pixel holds their index, and run detection on FakePredictor."""
+    monkeypatch.setattr(pipeline, 'detect_objects_batch',
+                        lambda predictor, imgs, *args, **kwargs: [predictor.detect(img) for img in imgs])
+    names = ['a.png', 'b.png', 'c.png', 'd.png', 'e.png']
+    for i, name in enumerate(names):
+        cv2.imwrite(str(tmp_path / name), np.full((8, 8, 3), i, np.uint8))
+    return [(str(tmp_path), name) for name in names]
+
+
+def _run(predictor, image_files, cache, batch_size=2):
+    results = pipeline._iter_results(predictor, image_files, batch_size, Counter(), cache, decode_downscale=False)
+    return [(f_name, detections, entry is not None)
+            for i, root, f_name, img, scale, detections, rss, key, entry in results]
+
+
+def test_cache_key_depends_on_content_and_fingerprint(tmp_path):
+    (tmp_path / 'a.jpg').write_bytes(b'same image')
+    (tmp_path / 'copy.jpg').write_bytes(b'same image')
+    (tmp_path / 'other.jpg').write_bytes(b'other image')
+    cache = pipeline.ResultCache(str(tmp_path / 'cache'))
+    retiled = pipeline.ResultCache(str(tmp_path / 'cache'), fingerprint_extra={'tile_size': 512})
+
+    key = cache.key_for(str(tmp_path / 'a.jpg'))
+    assert cache.key_for(str(tmp_path / 'copy.jpg')) == key
+    assert cache.key_for(str(tmp_path / 'other.jpg')) != key
+    assert retiled.key_for(str(tmp_path / 'a.jpg')) != key
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = pipeline.ResultCache(str(tmp_path / 'cache'))
+    cache.put('a', ['detections'], 0)
+    entry_bytes = cache.stats()['bytes']
+    cache.max_bytes = 2 * entry_bytes
+    cache.put('b', ['detections'], 0)
+
+    assert cache.get('a') is not None  # a is now more recent than b
+    cache.put('c', ['detections'], 0)
+
+    assert cache.contains('a') and cache.contains('c')
+    assert not cache.contains('b')
+    assert cache.get('b') is None
+    assert cache.stats()['bytes'] <= cache.max_bytes
+    # The order survives a restart
+    assert list(pipeline.ResultCache(str(tmp_path / 'cache'))._entries) == ['a', 'c']
+
+
+def test_cache_round_trips_the_annotated_image(tmp_path):
+    output_file = tmp_path / 'out' / 'masked_a.jpg'
+    (tmp_path / 'out' / pipeline.THUMBNAIL_DIRNAME).mkdir(parents=True)
+    output_file.write_bytes(b'annotated')
+    (tmp_path / 'out' / pipeline.THUMBNAIL_DIRNAME / 'masked_a.jpg').write_bytes(b'thumb')
+    cache = pipeline.ResultCache(str(tmp_path / 'cache'))
+    cache.put('a', ['detections'], 7, str(output_file), encoding=['.jpg'])
+
+    restored = tmp_path / 'restored' / 'masked_a.jpg'
+    pending = tmp_path / 'restored' / pipeline.PENDING_DIRNAME / 'masked_a.jpg.pkl'
+    pending.parent.mkdir(parents=True)
+    pending.write_bytes(b'stale')
+    entry = cache.get('a')
+    pipeline._restore_cached_output(entry, str(restored))
+
+    assert (entry['detections'], entry['row_start'], entry['encoding']) == (['detections'], 7, ['.jpg'])
+    assert restored.read_bytes() == b'annotated'
+    assert (restored.parent / pipeline.THUMBNAIL_DIRNAME / 'masked_a.jpg').read_bytes() == b'thumb'
+    assert not pending.exists()
+
+
+def test_iter_results_keeps_order_with_mixed_hits_and_misses(images):
+    predictor = FakePredictor()
+    cache = FakeCache({'b.png': {'detections': 'cached-b'}, 'd.png': {'detections': 'cached-d'}})
+
+    assert _run(predictor, images, cache) == [
+        ('a.png', 'dets-of-0', False),
+        ('b.png', 'cached-b', True),
+        ('c.png', 'dets-of-2', False),
+        ('d.png', 'cached-d', True),
+        ('e.png', 'dets-of-4', False),
+    ]
+    assert predictor.seen == [0, 2, 4]
+
+
+def test_iter_results_uses_inference_for_images_cached_meanwhile(images):
+    # Another job caches b.png after it was found missing: its inference
+    # result must still be used, or every later miss gets its predecessor's
+    predictor = FakePredictor()
+    cache = FakeCache({'d.png': {'detections': 'cached-d'}}, added_later={'b.png'})
+
+    assert [detections for _, detections, _ in _run(predictor, images, cache)] == [
+        'dets-of-0', 'dets-of-1', 'dets-of-2', 'cached-d', 'dets-of-4']
+
+
+def test_iter_results_reruns_hits_evicted_meanwhile(images):
+    predictor = FakePredictor()
+    cache = FakeCache({'b.png': {'detections': 'cached-b'}, 'c.png': {'detections': 'cached-c'}},
+                      vanished={'c.png'})
+
+    assert _run(predictor, images, cache) == [
+        ('a.png', 'dets-of-0', False),
+        ('b.png', 'cached-b', True),
+        ('c.png', 'dets-of-2', False),
+        ('d.png', 'dets-of-3', False),
+        ('e.png', 'dets-of-4', False),
+    ]
@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('detectron2')
+
+import MaskrcnnGradAidAg as pipeline
+
+
+def _candidate(mask, window, score):
+    """The detection a tile at window would report for the part of a full-image mask it sees."""
+    x0, y0, x1, y1 = window
+    visible = mask[y0:y1, x0:x1]
+    ys, xs = np.nonzero(visible)
+    crop = visible[ys.min():ys.max() + 1, xs.min():xs.max() + 1]
+    return {'score': score, 'mask': crop, 'offset': (x0 + xs.min(), y0 + ys.min()),
+            'pixels': int(np.count_nonzero(crop))}
+
+
+def _full_mask(obj, shape):
+    mask = np.zeros(shape, dtype=bool)
+    x0, y0 = obj['offset']
+    h, w = obj['mask'].shape
+    mask[y0:y0 + h, x0:x0 + w] = obj['mask']
+    return mask
+
+
+def _ellipse(shape, center, axes):
+    ys, xs = np.ogrid[:shape[0], :shape[1]]
+    return ((xs - center[0]) / axes[0]) ** 2 + ((ys - center[1]) / axes[1]) ** 2 <= 1
+
+
+@pytest.mark.parametrize('height, width, tile_size, overlap', [
+    (900, 1300, 512, 64),
+    (1024, 1024, 512, 64),
+    (513, 2000, 512, 100),
+    (300, 400, 512, 64),
+])
+def test_tile_windows_cover_the_image_with_overlap(height, width, tile_size, overlap):
+    windows = pipeline.tile_windows(height, width, tile_size, overlap)
+
+    covered = np.zeros((height, width), dtype=int)
+    for x0, y0, x1, y1 in windows:
+        assert 0 <= x0 < x1 <= width and 0 <= y0 < y1 <= height
+        assert x1 - x0 == min(tile_size, width) and y1 - y0 == min(tile_size, height)
+        covered[y0:y1, x0:x1] += 1
+    assert covered.min() >= 1
+
+    # The last row and column of tiles sit flush with the far edges
+    assert max(x1 for _, _, x1, _ in windows) == width
+    assert max(y1 for _, _, _, y1 in windows) == height
+    for starts in ({x0 for x0, _, _, _ in windows}, {y0 for _, y0, _, _ in windows}):
+        starts = sorted(starts)
+        for a, b in zip(starts, starts[1:]):
+            assert tile_size - (b - a) >= overlap
+
+
+def test_tile_windows_reject_overlap_of_a_whole_tile():
+    with pytest.raises(ValueError):
+        pipeline.tile_windows(1000, 1000, 256, 256)
+
+
+def test_merge_joins_an_object_cut_by_a_seam():
+    shape = (400, 800)
+    windows = [(0, 0, 450, 400), (350, 0, 800, 400)]
+    obj = _ellipse(shape, center=(440, 200), axes=(60, 40))
+    candidates = [_candidate(obj, windows[0], 0.9), _candidate(obj, windows[1], 0.8)]
+    assert candidates[0]['pixels'] < np.count_nonzero(obj)
+
+    merged = pipeline.merge_tile_detections(candidates)
+
+    assert len(merged) == 1
+    assert np.array_equal(_full_mask(merged[0], shape), obj)
+    assert merged[0]['pixels'] == np.count_nonzero(obj)
+
+
+def test_merge_keeps_touching_objects_apart():
+    shape = (400, 800)
+    windows = [(0, 0, 450, 400), (350, 0, 800, 400)]
+    left = np.zeros(shape, dtype=bool)
+    left[150:250, 360:400] = True
+    right = np.zeros(shape, dtype=bool)
+    right[150:250, 400:440] = True  # Shares an edge with left
+    candidates = [_candidate(mask, window, score)
+                  for mask, score in ((left, 0.9), (right, 0.7))
+                  for window in windows]
+
+    merged = pipeline.merge_tile_detections(candidates)
+
+    assert len(merged) == 2
+    assert sorted(_full_mask(obj, shape).tobytes() for obj in merged) == sorted([left.tobytes(), right.tobytes()])
+
+
+def test_merge_grid_matches_comparing_every_pair():
+    rng = np.random.default_rng(0)
+    shape = (900, 1300)
+    windows = pipeline.tile_windows(*shape, 512, 64)
+    candidates = []
+    for _ in range(60):
+        obj = _ellipse(shape, center=(rng.integers(30, 1270), rng.integers(30, 870)),
+                       axes=(rng.integers(8, 40), rng.integers(8, 40)))
+        for window in windows:
+            x0, y0, x1, y1 = window
+            if obj[y0:y1, x0:x1].any():
+                candidates.append(_candidate(obj, window, float(rng.random())))
+
+    gridded = pipeline.merge_tile_detections(candidates, cell_size=32)
+    every_pair = pipeline.merge_tile_detections(candidates, cell_size=10 ** 6)
+
+    assert [(obj['offset'], obj['pixels']) for obj in gridded] == \
+        [(obj['offset'], obj['pixels']) for obj in every_pair]
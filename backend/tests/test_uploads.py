@@ -0,0 +1,133 @@
+import json
+import os
+
+import pytest
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.testclient import TestClient
+
+from services.upload_service import (
+    PART_SUFFIX, UPLOAD_NAMES_FILE, InvalidUploadError, UploadTooLargeError, receive_uploads
+)
+
+MAX_FILE_BYTES = 1000
+MAX_REQUEST_BYTES = 4000
+MAX_FILES = 3
+BOUNDARY = 'test-boundary'
+
+
+@pytest.fixture
+def input_dir(tmp_path):
+    return tmp_path / 'input'
+
+
+@pytest.fixture
+def client(input_dir):
+    """An /upload route with small limits, answering like server.py's."""
+    app = FastAPI()
+
+    @app.post('/upload')
+    async def upload(request: Request):
+        try:
+            return await receive_uploads(request, str(input_dir), max_file_bytes=MAX_FILE_BYTES,
+                                         max_request_bytes=MAX_REQUEST_BYTES, max_files=MAX_FILES)
+        except InvalidUploadError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except UploadTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+
+    return TestClient(app)
+
+
+def _image(name, content, content_type='image/jpeg'):
+    return ('files', (name, content, content_type))
+
+
+def _stored(input_dir):
+    return sorted(f for f in os.listdir(input_dir) if f != UPLOAD_NAMES_FILE)
+
+
+def _names(input_dir):
+    with open(input_dir / UPLOAD_NAMES_FILE, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def test_upload_stores_files_under_their_content_hash(client, input_dir):
+    response = client.post('/upload', files=[_image('a.JPG', b'a' * 100), _image('b.png', b'b' * 100, 'image/png')])
+
+    assert response.status_code == 200
+    files = response.json()['files']
+    assert [(f['filename'], f['image_name'], f['size'], f['duplicate']) for f in files] == [
+        ('a.JPG', 'a.JPG', 100, False), ('b.png', 'b.png', 100, False)]
+    assert [os.path.splitext(f['stored_as'])[1] for f in files] == ['.jpg', '.png']
+    assert _stored(input_dir) == sorted(f['stored_as'] for f in files)
+    assert response.json()['bytes_received'] == 200
+
+
+def test_duplicate_content_is_stored_once(client, input_dir):
+    first = client.post('/upload', files=[_image('a.jpg', b'same'), _image('copy.jpg', b'same')]).json()['files']
+    again = client.post('/upload', files=[_image('a.jpg', b'same')]).json()['files']
+
+    assert [f['duplicate'] for f in first + again] == [False, True, True]
+    assert len({f['stored_as'] for f in first + again}) == 1
+    assert len(_stored(input_dir)) == 1
+    # The image keeps the name it was first uploaded under
+    assert [f['image_name'] for f in first + again] == ['a.jpg', 'a.jpg', 'a.jpg']
+
+
+def test_different_images_with_the_same_name_are_told_apart(client, input_dir):
+    first = client.post('/upload', files=[_image('photo.jpg', b'one')]).json()['files'][0]
+    second = client.post('/upload', files=[_image('photo.jpg', b'two'), _image('photo.jpg', b'three')]).json()['files']
+
+    assert [f['image_name'] for f in [first] + second] == ['photo.jpg', 'photo (2).jpg', 'photo (3).jpg']
+    assert _names(input_dir) == {f['stored_as']: f['image_name'] for f in [first] + second}
+
+
+def test_file_without_extension_is_stored_with_its_content_type(client, input_dir):
+    response = client.post('/upload', files=[_image('photo', b'x' * 10, 'image/png')])
+
+    assert response.status_code == 200
+    stored = response.json()['files'][0]
+    assert stored['stored_as'].endswith('.png')
+    assert stored['image_name'] == 'photo'
+
+
+@pytest.mark.parametrize('files, status', [
+    ([_image('big.jpg', b'x' * (MAX_FILE_BYTES + 1))], 413),
+    ([_image(f'{i}.jpg', bytes([i])) for i in range(MAX_FILES + 1)], 400),
+    ([_image('a.jpg', b'a'), _image('notes.txt', b'text', 'text/plain')], 400),
+    ([_image('a.jpg', b'a'), _image('anim.gif', b'gif', 'image/gif')], 400),
+    ([], 400),
+], ids=['file_limit', 'max_files', 'not_an_image', 'unsupported_image', 'no_files'])
+def test_rejected_upload_leaves_nothing_behind(client, input_dir, files, status):
+    response = client.post('/upload', files=files or None, data={'note': 'x'} if not files else None)
+
+    assert response.status_code == status
+    assert not input_dir.exists() or os.listdir(input_dir) == []
+
+
+def test_request_limit_keeps_earlier_uploads(client, input_dir):
+    assert client.post('/upload', files=[_image('kept.jpg', b'k' * 900)]).status_code == 200
+
+    # Each file is within its limit, the request as a whole is not
+    files = [_image(f'{i}.jpg', bytes([i]) * 900) for i in range(MAX_FILES)]
+    response = client.post('/upload', files=files, data={'note': 'n' * 1500})
+
+    assert response.status_code == 413
+    assert not any(f.endswith(PART_SUFFIX) for f in os.listdir(input_dir))
+    assert len(_stored(input_dir)) == 1
+    assert list(_names(input_dir).values()) == ['kept.jpg']
+
+
+def test_truncated_body_is_rejected(client, input_dir):
+    body = (f'--{BOUNDARY}\r\n'
+            'Content-Disposition: form-data; name="files"; filename="a.jpg"\r\n'
+            'Content-Type: image/jpeg\r\n\r\n').encode() + b'x' * 100
+    response = client.post('/upload', content=body,
+                           headers={'Content-Type': f'multipart/form-data; boundary={BOUNDARY}'})
+
+    assert response.status_code == 400
+    assert os.listdir(input_dir) == []
+
+
+def test_non_multipart_body_is_rejected(client):
+    assert client.post('/upload', json={'files': []}).status_code == 400
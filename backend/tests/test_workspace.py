@@ -0,0 +1,40 @@
+import pytest
+
+from services import workspace_service
+from services.workspace_service import (
+    WorkspaceAccessError, authorize_file, authorize_workspace, file_signature, get_workspace, workspace_token
+)
+
+
+@pytest.fixture(autouse=True)
+def workspace_root(tmp_path, monkeypatch):
+    """Run each test in a fresh directory with its own signing key."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(workspace_service, '_secret', None)
+
+
+def test_workspace_needs_its_owners_token():
+    assert authorize_workspace(7, workspace_token(7)).user_id == 7
+    assert authorize_workspace().user_id is None
+    for token in (None, '', workspace_token(8), file_signature(7, 'masked_a.jpg')):
+        with pytest.raises(WorkspaceAccessError):
+            authorize_workspace(7, token)
+
+
+def test_file_signature_grants_that_file_only():
+    sig = file_signature(7, 'masked_a.jpg')
+    assert authorize_file(7, 'masked_a.jpg', sig=sig).user_id == 7
+    assert authorize_file(7, 'masked_b.jpg', token=workspace_token(7)).user_id == 7
+    with pytest.raises(WorkspaceAccessError):
+        authorize_file(7, 'masked_b.jpg', sig=sig)
+    with pytest.raises(WorkspaceAccessError):
+        authorize_file(8, 'masked_a.jpg', sig=sig)
+
+
+def test_signed_urls_leave_out_the_workspace_token():
+    workspace = get_workspace(7)
+    assert workspace_token(7) in workspace.file_url('masked_a.jpg')
+    for url in (workspace.signed_file_url('masked_a.jpg'), workspace.signed_thumbnail_url('masked_a.jpg')):
+        assert workspace_token(7) not in url
+        assert url.endswith(f"?user_id=7&sig={file_signature(7, 'masked_a.jpg')}")
+    assert get_workspace().signed_file_url('masked_a.jpg') == '/output/file/masked_a.jpg'
@@ -30,7 +30,12 @@ function AppContent() {
     if (storedUser) {
       try {
         const userData = JSON.parse(storedUser)
-        setUser(userData)
+        if (userData.workspace_token) {
+          setUser(userData)
+        } else {
+          // Signed in before workspaces needed a token; sign in again to get one
+          localStorage.removeItem('user')
+        }
       } catch (error) {
         console.error('Failed to parse stored user data:', error)
         localStorage.removeItem('user')
@@ -161,6 +166,7 @@ function AppContent() {
 
       <FileUpload
         ref={fileUploadRef}
+        userId={user.id}
         onUploadComplete={handleUploadComplete}
         isClassifying={isClassifying}
         scenarioSelected={scenario !== null}
@@ -5,6 +5,7 @@ interface QueryResult {
   columns: string[];
   data: any[];
   row_count: number;
+  truncated: boolean;
 }
 
 interface TableInfo {
@@ -20,8 +21,11 @@ interface TableSchema {
 
 interface ImageInfo {
   filename: string;
+  user_id: number | null;
   size: number;
+  pending: boolean;
   url: string;
+  thumbnail_url: string;
 }
 
 interface AdminViewProps {
@@ -40,7 +44,7 @@ function AdminView({ username, userId, onLogout }: AdminViewProps) {
   const [selectedTable, setSelectedTable] = useState('');
   const [tableSchema, setTableSchema] = useState<TableSchema[]>([]);
   const [images, setImages] = useState<ImageInfo[]>([]);
-  const [selectedImage, setSelectedImage] = useState<string | null>(null);
+  const [selectedImage, setSelectedImage] = useState<ImageInfo | null>(null);
 
   const API_BASE_URL = import.meta.env.VITE_BACKEND_BASE_API_URL || 'http://localhost:8000';
 
@@ -74,7 +78,9 @@ function AdminView({ username, userId, onLogout }: AdminViewProps) {
       try {
         // Create a temporary anchor element and trigger download
         const a = document.createElement('a');
-        a.href = `${API_BASE_URL}${image.url}`;
+        const url = new URL(`${API_BASE_URL}${image.url}`);
+        url.searchParams.set('download', '1');
+        a.href = url.toString();
         a.download = image.filename;
         a.target = '_blank'; // Fallback if download doesn't work
         document.body.appendChild(a);
@@ -271,7 +277,10 @@ function AdminView({ username, userId, onLogout }: AdminViewProps) {
             {queryResult && (
               <div className="results-section">
                 <div style={{ display: 'flex', justifyContent: 'space-between', alignItems: 'center', marginBottom: '1rem' }}>
-                  <h3>Results ({queryResult.row_count} rows)</h3>
+                  <h3>
+                    Results ({queryResult.row_count} rows
+                    {queryResult.truncated && ', truncated - add a WHERE or LIMIT clause to narrow the query'})
+                  </h3>
                   <button className="refresh-btn" onClick={downloadResultsAsCSV}>
                     Download Results (CSV)
                   </button>
@@ -368,19 +377,19 @@ function AdminView({ username, userId, onLogout }: AdminViewProps) {
             <div className="images-grid">
               {images.map((image) => (
                 <div
-                  key={image.filename}
+                  key={image.url}
                   className="image-card"
-                  onClick={() => setSelectedImage(image.filename)}
+                  onClick={() => setSelectedImage(image)}
                 >
                   <img
-                    src={`${API_BASE_URL}${image.url}`}
+                    src={`${API_BASE_URL}${image.thumbnail_url}`}
                     alt={image.filename}
                     loading="lazy"
                   />
                   <div className="image-info">
                     <div className="image-name">{image.filename}</div>
                     <div className="image-size">
-                      {(image.size / 1024).toFixed(2)} KB
+                      {image.pending ? 'Not drawn yet' : `${(image.size / 1024).toFixed(2)} KB`}
                     </div>
                   </div>
                 </div>
@@ -400,10 +409,10 @@ function AdminView({ username, userId, onLogout }: AdminViewProps) {
                     ✕
                   </button>
                   <img
-                    src={`${API_BASE_URL}/output/file/${selectedImage}`}
-                    alt={selectedImage}
+                    src={`${API_BASE_URL}${selectedImage.url}`}
+                    alt={selectedImage.filename}
                   />
-                  <div className="modal-filename">{selectedImage}</div>
+                  <div className="modal-filename">{selectedImage.filename}</div>
                 </div>
               </div>
             )}
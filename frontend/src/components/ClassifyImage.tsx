@@ -1,6 +1,7 @@
 import { useState, forwardRef, useImperativeHandle } from 'react'
 import './ClassifyImage.css'
 import { addImageMatch } from '../services/ImageService'
+import { workspaceQuery } from '../services/WorkspaceService'
 
 interface ClassificationResult {
   message: string;
@@ -10,8 +11,19 @@ interface ClassificationResult {
   stderr?: string;
   error_code?: number;
   processed_files?: string[];
+  output_files?: string[];
 }
 
+interface JobStatus {
+  job_id: string;
+  status: 'queued' | 'running' | 'completed' | 'failed';
+  images_total: number;
+  images_done: number;
+  error?: string | null;
+}
+
+const JOB_POLL_INTERVAL_MS = 1000
+
 export interface ClassifyImageRef {
   classify: () => void;
 }
@@ -26,22 +38,46 @@ const ClassifyImage = forwardRef<ClassifyImageRef, ClassifyImageProps>(({ userId
   const [classifying, setClassifying] = useState(false)
   const [result, setResult] = useState<ClassificationResult | null>(null)
   const [error, setError] = useState<string | null>(null)
+  const [progress, setProgress] = useState<JobStatus | null>(null)
 
   const API_BASE_URL = import.meta.env.VITE_BACKEND_BASE_API_URL || 'http://localhost:8000'
 
+  // Poll a queued classification job until it finishes, then fetch its result
+  const waitForJob = async (jobId: string): Promise<Response> => {
+    while (true) {
+      const statusResponse = await fetch(`${API_BASE_URL}/jobs/${jobId}?${workspaceQuery(userId)}`)
+      if (!statusResponse.ok) {
+        return statusResponse
+      }
+
+      const jobStatus: JobStatus = await statusResponse.json()
+      setProgress(jobStatus)
+      if (jobStatus.status === 'completed' || jobStatus.status === 'failed') {
+        return fetch(`${API_BASE_URL}/jobs/${jobId}/result?${workspaceQuery(userId)}`)
+      }
+
+      await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL_MS))
+    }
+  }
+
   const handleClassify = async () => {
     setClassifying(true)
     setResult(null)
     setError(null)
+    setProgress(null)
 
     try {
-      const response = await fetch(`${API_BASE_URL}/classify`, {
+      const queueResponse = await fetch(`${API_BASE_URL}/classify?${workspaceQuery(userId)}`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
         },
       })
 
+      const response = queueResponse.ok
+        ? await waitForJob((await queueResponse.json()).job_id)
+        : queueResponse
+
       if (response.ok) {
         const classificationResult: ClassificationResult = await response.json()
         setResult(classificationResult)
@@ -49,7 +85,7 @@ const ClassifyImage = forwardRef<ClassifyImageRef, ClassifyImageProps>(({ userId
         // Clear input directory after successful classification
         if (classificationResult.status === 'success') {
           try {
-            await fetch(`${API_BASE_URL}/clear-all-input`, {
+            await fetch(`${API_BASE_URL}/clear-all-input?${workspaceQuery(userId)}`, {
               method: 'DELETE',
             })
             console.log('Input directory cleared successfully')
@@ -61,10 +97,10 @@ const ClassifyImage = forwardRef<ClassifyImageRef, ClassifyImageProps>(({ userId
 
             // Add image matches to database for processed files
             if (classificationResult.processed_files && classificationResult.processed_files.length > 0) {
-              for (const fileName of classificationResult.processed_files) {
+              for (const [index, fileName] of classificationResult.processed_files.entries()) {
                 try {
-                  // The output files have 'masked_' prefix added to the original filename
-                  const maskedFileName = `masked_${fileName}`
+                  // The annotated image's name, in the configured output format
+                  const maskedFileName = classificationResult.output_files?.[index] ?? `masked_${fileName}`
                   await addImageMatch(maskedFileName, userId)
                   console.log(`Added image match for ${maskedFileName}`)
                 } catch (matchError) {
@@ -169,6 +205,11 @@ const ClassifyImage = forwardRef<ClassifyImageRef, ClassifyImageProps>(({ userId
           <div className="processing-subtitle">
             This may take several minutes depending on the number and size of images.
           </div>
+          {progress && progress.images_total > 0 && (
+            <div className="processing-subtitle">
+              📷 Processed {progress.images_done}/{progress.images_total} images
+            </div>
+          )}
         </div>
       )}
     </div>
@@ -1,12 +1,14 @@
 import { useState, useEffect, forwardRef, useImperativeHandle } from 'react'
 import { getUserImages } from '../services/ImageService'
-import { addAnalysis, getUserAnalyses, AnalysisRecord } from '../services/UserAnalysis'
+import { addAnalyses, getAnalysesPage, getAnalysesExportUrl, AnalysisRecord, AnalysisRow } from '../services/UserAnalysis'
+import { workspaceQuery } from '../services/WorkspaceService'
 import './FileDisplay.css'
 
 interface OutputFile {
   filename: string;
   type: string;
   size: number;
+  pending?: boolean;
 }
 
 interface CSVData {
@@ -21,6 +23,18 @@ interface FileDisplayProps {
   userId: number;
 }
 
+// Analysis records sent per /api/add-analyses request
+const ANALYSIS_BATCH_SIZE = 1000
+// Analysis records fetched per page of the "My Analysis Data" table
+const ANALYSES_PAGE_SIZE = 100
+// Columns the analysis table shows; the rest are not fetched
+const ANALYSIS_TABLE_FIELDS: (keyof AnalysisRecord)[] = [
+  'object_id', 'image_name', 'object_id_in_image', 'area_px2', 'width_px', 'length_px',
+  'volume_px3', 'area_in2', 'weight_oz', 'grade', 'price_usd', 'lw_ratio', 'solidity'
+]
+// Width of the resized variant requested for inline images instead of the full-size file
+const DISPLAY_IMAGE_WIDTH = 1280
+
 export interface FileDisplayRef {
   parseAnalysisCSV: () => Promise<void>;
   refreshAll: () => Promise<void>;
@@ -35,6 +49,7 @@ const FileDisplay = forwardRef<FileDisplayRef, FileDisplayProps>(({ userId }, re
   const [userAnalyses, setUserAnalyses] = useState<AnalysisRecord[]>([])
   const [loadingAnalyses, setLoadingAnalyses] = useState(false)
   const [analysesError, setAnalysesError] = useState<string | null>(null)
+  const [analysesNextAfter, setAnalysesNextAfter] = useState<number | null>(null)
   const [analysesTableExpanded, setAnalysesTableExpanded] = useState(true)
 
   const API_BASE_URL = import.meta.env.VITE_BACKEND_BASE_API_URL || 'http://localhost:8000'
@@ -55,7 +70,7 @@ const FileDisplay = forwardRef<FileDisplayRef, FileDisplayProps>(({ userId }, re
       const userImageNames = new Set(userImagesResponse.images.map(img => img.image_name))
 
       // Then, get all output files from the backend
-      const response = await fetch(`${API_BASE_URL}/output/files`)
+      const response = await fetch(`${API_BASE_URL}/output/files?${workspaceQuery(userId)}`)
 
       if (response.ok) {
         const result = await response.json()
@@ -87,7 +102,7 @@ const FileDisplay = forwardRef<FileDisplayRef, FileDisplayProps>(({ userId }, re
 
   const fetchCSVContent = async (filename: string) => {
     try {
-      const response = await fetch(`${API_BASE_URL}/output/csv/${filename}`)
+      const response = await fetch(`${API_BASE_URL}/output/csv/${filename}?${workspaceQuery(userId)}`)
 
       if (response.ok) {
         const csvContent = await response.json()
@@ -114,11 +129,15 @@ const FileDisplay = forwardRef<FileDisplayRef, FileDisplayProps>(({ userId }, re
       const userImagesResponse = await getUserImages(userId)
       // The image_match table has 'masked_' prefix, so we need to create a set of original filenames
       const userImageNames = new Set(
-        userImagesResponse.images.map(img => {
+        userImagesResponse.images.flatMap(img => {
           // Remove 'masked_' prefix if present to match CSV image names
-          return img.image_name.startsWith('masked_')
+          const name = img.image_name.startsWith('masked_')
             ? img.image_name.substring(7) // Remove 'masked_' (7 characters)
             : img.image_name
+          // An image converted to the output format keeps its own extension
+          // before the output one (masked_x.png.jpg for x.png)
+          const dot = name.lastIndexOf('.')
+          return dot > 0 ? [name, name.substring(0, dot)] : [name]
         })
       )
 
@@ -128,67 +147,69 @@ const FileDisplay = forwardRef<FileDisplayRef, FileDisplayProps>(({ userId }, re
         headerMap[header] = index
       })
 
-      let addedCount = 0
+      const records: AnalysisRow[] = []
       let skippedCount = 0
 
-      // For each row in the CSV, create an analysis record only if it belongs to this user
+      // For each row in the CSV, build an analysis record only if it belongs to this user
       for (const row of csvContent.data) {
-        try {
-          // Extract image name from the row
-          const imageName = row[headerMap['image_name']] || ''
-
-          // Skip this row if the image doesn't belong to this user
-          if (!userImageNames.has(imageName)) {
-            skippedCount++
-            continue
-          }
+        // Extract image name from the row
+        const imageName = row[headerMap['image_name']] || ''
 
-          // Extract other values from the row based on header positions
-          const objectIdInImage = parseInt(row[headerMap['object_id_in_image']] || '0')
-          const areaPx2 = parseFloat(row[headerMap['area_px2']] || '0')
-          const topLeftX = parseFloat(row[headerMap['top_left_x']] || '0')
-          const topLeftY = parseFloat(row[headerMap['top_left_y']] || '0')
-          const bottomRightX = parseFloat(row[headerMap['bottom_right_x']] || '0')
-          const bottomRightY = parseFloat(row[headerMap['bottom_right_y']] || '0')
-          const center = row[headerMap['center']] || ''
-          const widthPx = parseFloat(row[headerMap['width_px']] || '0')
-          const lengthPx = parseFloat(row[headerMap['length_px']] || '0')
-          const volumePx3 = parseFloat(row[headerMap['volume_px3']] || '0')
-          const solidity = parseFloat(row[headerMap['solidity']] || '0')
-          const strictSolidity = parseFloat(row[headerMap['strict_solidity']] || '0')
-          const lwRatio = parseFloat(row[headerMap['lw_ratio']] || '0')
-          const areaIn2 = parseFloat(row[headerMap['area_in2']] || '0')
-          const weightOz = parseFloat(row[headerMap['weight_oz']] || '0')
-          const grade = row[headerMap['Grade']] || '' // Note: CSV uses 'Grade' with capital G
-          const priceUsd = parseFloat(row[headerMap['Price USD']] || '0')
-
-          // Call addAnalysis API
-          await addAnalysis({
-            image_name: imageName,
-            object_id_in_image: objectIdInImage,
-            area_px2: areaPx2,
-            top_left_x: topLeftX,
-            top_left_y: topLeftY,
-            bottom_right_x: bottomRightX,
-            bottom_right_y: bottomRightY,
-            center: center,
-            width_px: widthPx,
-            length_px: lengthPx,
-            volume_px3: volumePx3,
-            solidity: solidity,
-            strict_solidity: strictSolidity,
-            lw_ratio: lwRatio,
-            area_in2: areaIn2,
-            weight_oz: weightOz,
-            grade: grade,
-            price_usd: priceUsd,
-            user_id: userId
-          })
-          addedCount++
-        } catch (rowError) {
-          console.error('Error adding analysis record for row:', rowError)
-          // Continue processing other rows even if one fails
+        // Skip this row if the image doesn't belong to this user
+        if (!userImageNames.has(imageName)) {
+          skippedCount++
+          continue
         }
+
+        // Extract other values from the row based on header positions
+        const objectIdInImage = parseInt(row[headerMap['object_id_in_image']] || '0')
+        const areaPx2 = parseFloat(row[headerMap['area_px2']] || '0')
+        const topLeftX = parseFloat(row[headerMap['top_left_x']] || '0')
+        const topLeftY = parseFloat(row[headerMap['top_left_y']] || '0')
+        const bottomRightX = parseFloat(row[headerMap['bottom_right_x']] || '0')
+        const bottomRightY = parseFloat(row[headerMap['bottom_right_y']] || '0')
+        const center = row[headerMap['center']] || ''
+        const widthPx = parseFloat(row[headerMap['width_px']] || '0')
+        const lengthPx = parseFloat(row[headerMap['length_px']] || '0')
+        const volumePx3 = parseFloat(row[headerMap['volume_px3']] || '0')
+        const solidity = parseFloat(row[headerMap['solidity']] || '0')
+        const strictSolidity = parseFloat(row[headerMap['strict_solidity']] || '0')
+        const lwRatio = parseFloat(row[headerMap['lw_ratio']] || '0')
+        const areaIn2 = parseFloat(row[headerMap['area_in2']] || '0')
+        const weightOz = parseFloat(row[headerMap['weight_oz']] || '0')
+        const grade = row[headerMap['Grade']] || '' // Note: CSV uses 'Grade' with capital G
+        const priceUsd = parseFloat(row[headerMap['Price USD']] || '0')
+
+        records.push({
+          image_name: imageName,
+          object_id_in_image: objectIdInImage,
+          area_px2: areaPx2,
+          top_left_x: topLeftX,
+          top_left_y: topLeftY,
+          bottom_right_x: bottomRightX,
+          bottom_right_y: bottomRightY,
+          center: center,
+          width_px: widthPx,
+          length_px: lengthPx,
+          volume_px3: volumePx3,
+          solidity: solidity,
+          strict_solidity: strictSolidity,
+          lw_ratio: lwRatio,
+          area_in2: areaIn2,
+          weight_oz: weightOz,
+          grade: grade,
+          price_usd: priceUsd
+        })
+      }
+
+      // Insert the records in a few large transactions instead of one request per object
+      let addedCount = 0
+      for (let start = 0; start < records.length; start += ANALYSIS_BATCH_SIZE) {
+        const response = await addAnalyses({
+          user_id: userId,
+          analyses: records.slice(start, start + ANALYSIS_BATCH_SIZE)
+        })
+        addedCount += response.count
       }
 
       console.log(`Successfully added ${addedCount} analysis records for user ${userId}`)
@@ -203,13 +224,20 @@ const FileDisplay = forwardRef<FileDisplayRef, FileDisplayProps>(({ userId }, re
     }
   }
 
-  const fetchUserAnalyses = async () => {
+  // Fetch the first page of analyses, or the page after `after` appended to the table
+  const fetchUserAnalyses = async (after: number | null = null) => {
     setLoadingAnalyses(true)
     setAnalysesError(null)
 
     try {
-      const response = await getUserAnalyses(userId)
-      setUserAnalyses(response.analyses)
+      const response = await getAnalysesPage({
+        user_id: userId,
+        limit: ANALYSES_PAGE_SIZE,
+        after,
+        fields: ANALYSIS_TABLE_FIELDS
+      })
+      setUserAnalyses(prev => after === null ? response.analyses : [...prev, ...response.analyses])
+      setAnalysesNextAfter(response.next_after)
     } catch (err) {
       console.error('Error fetching user analyses:', err)
       setAnalysesError('Failed to fetch analysis data')
@@ -233,7 +261,7 @@ const FileDisplay = forwardRef<FileDisplayRef, FileDisplayProps>(({ userId }, re
       const filename = 'combined_analysis_with_grades.csv'
 
       // Fetch the CSV content
-      const response = await fetch(`${API_BASE_URL}/output/csv/${filename}`)
+      const response = await fetch(`${API_BASE_URL}/output/csv/${filename}?${workspaceQuery(userId)}`)
 
       if (response.ok) {
         const csvContent = await response.json()
@@ -335,7 +363,7 @@ const FileDisplay = forwardRef<FileDisplayRef, FileDisplayProps>(({ userId }, re
     return (
       <div className="image-container">
         <img
-          src={`${API_BASE_URL}/output/file/${filename}`}
+          src={`${API_BASE_URL}/output/file/${filename}?${workspaceQuery(userId)}&w=${DISPLAY_IMAGE_WIDTH}`}
           alt={filename}
           className="output-image"
           onError={(e) => {
@@ -380,7 +408,7 @@ const FileDisplay = forwardRef<FileDisplayRef, FileDisplayProps>(({ userId }, re
                     {file.type === 'csv' ? '📊' : file.type === 'image' ? '🖼️' : '📄'} {file.filename}
                   </span>
                   <span className="file-size">
-                    ({formatFileSize(file.size)})
+                    ({file.pending ? 'drawn on first view' : formatFileSize(file.size)})
                   </span>
                 </div>
                 <span className={`expand-icon ${expandedFiles.has(file.filename) ? 'expanded' : ''}`}>
@@ -395,7 +423,7 @@ const FileDisplay = forwardRef<FileDisplayRef, FileDisplayProps>(({ userId }, re
                   {file.type === 'other' && (
                     <div className="download-link-container">
                       <a
-                        href={`${API_BASE_URL}/output/file/${file.filename}`}
+                        href={`${API_BASE_URL}/output/file/${file.filename}?${workspaceQuery(userId)}&download=1`}
                         target="_blank"
                         rel="noopener noreferrer"
                         className="download-link"
@@ -448,7 +476,16 @@ const FileDisplay = forwardRef<FileDisplayRef, FileDisplayProps>(({ userId }, re
             {userAnalyses.length > 0 && (
               <div className="analyses-container">
                 <div className="files-count">
-                  Found {userAnalyses.length} analysis record{userAnalyses.length !== 1 ? 's' : ''}
+                  Showing {userAnalyses.length} analysis record{userAnalyses.length !== 1 ? 's' : ''}
+                  {analysesNextAfter !== null && ' (more available)'}
+                </div>
+                <div className="download-link-container">
+                  <a
+                    href={getAnalysesExportUrl('csv', userId)}
+                    className="download-link"
+                  >
+                    📥 Download all as CSV
+                  </a>
                 </div>
                 <div className="analyses-table-wrapper">
                   <table className="analyses-table">
@@ -492,6 +529,15 @@ const FileDisplay = forwardRef<FileDisplayRef, FileDisplayProps>(({ userId }, re
                     </tbody>
                   </table>
                 </div>
+                {analysesNextAfter !== null && (
+                  <button
+                    className="view-output-button"
+                    onClick={() => fetchUserAnalyses(analysesNextAfter)}
+                    disabled={loadingAnalyses}
+                  >
+                    {loadingAnalyses ? 'Loading...' : `Load ${ANALYSES_PAGE_SIZE} more`}
+                  </button>
+                )}
               </div>
             )}
 
@@ -1,13 +1,27 @@
 import { useState, useEffect, forwardRef, useImperativeHandle } from 'react'
 import './FileUpload.css'
+import { workspaceQuery } from '../services/WorkspaceService'
+
+interface StoredUpload {
+  filename: string;
+  image_name: string;
+  stored_as: string;
+  size: number;
+  duplicate: boolean;
+}
 
 interface UploadResponse {
   message: string;
   files: string[];
+  uploads: StoredUpload[];
+  bytes_received: number;
+  upload_seconds: number;
+  megabytes_per_second: number;
   status: string;
 }
 
 interface FileUploadProps {
+  userId?: number;
   onUploadComplete?: () => void | Promise<void>;
   isClassifying?: boolean;
   scenarioSelected?: boolean;
@@ -19,7 +33,7 @@ export interface FileUploadRef {
   clearFiles: () => void;
 }
 
-const FileUpload = forwardRef<FileUploadRef, FileUploadProps>(({ onUploadComplete, isClassifying = false, scenarioSelected = true, scenario = null, isMockUser = false }, ref) => {
+const FileUpload = forwardRef<FileUploadRef, FileUploadProps>(({ userId, onUploadComplete, isClassifying = false, scenarioSelected = true, scenario = null, isMockUser = false }, ref) => {
   const [selectedFiles, setSelectedFiles] = useState<FileList | null>(null)
   const [uploading, setUploading] = useState(false)
   const [uploadResult, setUploadResult] = useState<string | null>(null)
@@ -161,14 +175,18 @@ const FileUpload = forwardRef<FileUploadRef, FileUploadProps>(({ onUploadComplet
         formData.append('files', selectedFiles[i])
       }
 
-      const response = await fetch(`${API_BASE_URL}/upload`, {
+      const response = await fetch(`${API_BASE_URL}/upload${userId !== undefined ? `?${workspaceQuery(userId)}` : ''}`, {
         method: 'POST',
         body: formData,
       })
 
       if (response.ok) {
         const result: UploadResponse = await response.json()
-        setUploadResult(`✅ ${result.message}`)
+        const duplicates = result.uploads.filter(upload => upload.duplicate).length
+        setUploadResult(
+          `✅ ${result.message} (${result.megabytes_per_second.toFixed(1)} MB/s` +
+          `${duplicates > 0 ? `, ${duplicates} already stored` : ''})`
+        )
         setUploadedFiles(result.files)
 
         // Call the callback to trigger auto-scroll and classification
@@ -229,7 +247,7 @@ const FileUpload = forwardRef<FileUploadRef, FileUploadProps>(({ onUploadComplet
         id="file-input"
         type="file"
         multiple
-        accept="image/*"
+        accept="image/png,image/jpeg,image/tiff,.png,.jpg,.jpeg,.tif,.tiff"
         onChange={handleFileSelect}
         disabled={!scenarioSelected || uploading || isClassifying || isMockUser}
         className="file-input-hidden"
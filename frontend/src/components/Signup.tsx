@@ -35,7 +35,8 @@ function Signup({ onSignupComplete }: SignupProps) {
       // Store user data in localStorage
       const userData = {
         id: response.id,
-        name: response.name
+        name: response.name,
+        workspace_token: response.workspace_token
       };
       localStorage.setItem('user', JSON.stringify(userData));
 
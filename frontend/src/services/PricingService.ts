@@ -1,8 +1,6 @@
-import { getUserAnalyses, AnalysisRecord } from './UserAnalysis';
-
 const API_BASE_URL = import.meta.env.VITE_BACKEND_BASE_API_URL || 'http://localhost:8000';
 
-// Static pricing constants
+// Static pricing constants (the backend's user_profit_service uses the same values)
 export const MARKETABLE_RATIO = 0.35;
 export const NOT_MARKETABLE_RATIO = 0.65;
 export const PENALTY = 15;
@@ -42,14 +40,6 @@ export interface UserProfitData {
   timestamp: string;
 }
 
-/**
- * Determines if an analysis record is marketable based on its grade.
- * Grade will be either "Marketable" or "Not Marketable".
- */
-const isMarketable = (analysis: AnalysisRecord): boolean => {
-  return analysis.grade === 'Marketable';
-};
-
 /**
  * Saves profit data to the backend database.
  * Prevents duplicate rows by using unique constraint on user_id.
@@ -134,6 +124,7 @@ export const getUserProfitData = async (
 
 /**
  * Calculates pricing summary based on user analyses and scenario.
+ * The backend counts grades in SQL, so only the summary is transferred.
  *
  * @param user_id - The user ID to get analyses for
  * @param scenario - Either 'bin' (scenario 1) or 'conveyor' (scenario 2)
@@ -144,66 +135,23 @@ export const calculatePricingSummary = async (
   scenario: Scenario
 ): Promise<PricingSummary> => {
   try {
-    // Get user analyses
-    const userAnalysesResponse = await getUserAnalyses(user_id);
-    const analyses = userAnalysesResponse.analyses;
-
-    if (analyses.length === 0) {
-      // If no analyses, return zeros
-      return {
-        total_profit: 0,
-        total_revenue: 0,
-        total_penalty: 0,
-        marketable_proportion: 0,
-        not_marketable_proportion: 0,
-        total_classifications: 0,
-        total_marketable_classifications: 0,
-        total_not_marketable_classifications: 0,
-        total_marketable_revenue: 0,
-        total_not_marketable_revenue: 0,
-      };
-    }
+    // Convert scenario from 'bin' | 'conveyor' to 1 | 2
+    const scenarioNumber = scenario === 'bin' ? 1 : 2;
+
+    const response = await fetch(`${API_BASE_URL}/api/pricing-summary/${user_id}?scenario=${scenarioNumber}`, {
+      method: 'GET',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+    });
 
-    // Calculate ratios
-    const totalClassifications = analyses.length;
-    const marketableCount = analyses.filter(isMarketable).length;
-    const notMarketableCount = totalClassifications - marketableCount;
-
-    const userMarketableRatio = marketableCount / totalClassifications;
-    const userNotmarketableRatio = notMarketableCount / totalClassifications;
-
-    // Calculate penalty
-    let total_penalty = 0;
-    if (scenario === 'bin') {
-      // Scenario 1 (bin): calculate penalty           
-      total_penalty = Math.abs(userMarketableRatio - MARKETABLE_RATIO)  * PENALTY;
-    } else {
-      // Scenario 2 (conveyor): no penalty
-      total_penalty = 0;
+    if (!response.ok) {
+      const errorData = await response.json().catch(() => ({}));
+      throw new Error(errorData.detail || `HTTP error! status: ${response.status}`);
     }
 
-    // Calculate revenues (same for both scenarios)
-    const total_marketable_revenue = userMarketableRatio * FINAL_COUNT * MARKETABLE_PRICE;
-    const total_not_marketable_revenue = userNotmarketableRatio * FINAL_COUNT * NOT_MARKETABLE_PRICE;
-
-    // Calculate total revenue and profit
-    const total_revenue = total_marketable_revenue + total_not_marketable_revenue;
-    const total_profit = total_revenue - total_penalty;
-
-    const summary = {
-      total_profit,
-      total_revenue,
-      total_penalty,
-      marketable_proportion: userMarketableRatio,
-      not_marketable_proportion: userNotmarketableRatio,
-      total_classifications: totalClassifications,
-      total_marketable_classifications: marketableCount,
-      total_not_marketable_classifications: notMarketableCount,
-      total_marketable_revenue,
-      total_not_marketable_revenue,
-    };
-
-    return summary;
+    const data = await response.json();
+    return data.pricing_summary;
   } catch (error) {
     console.error('Error calculating pricing summary:', error);
     throw error;
@@ -45,6 +45,20 @@ export interface AddAnalysisRequest {
   user_id: number;
 }
 
+export type AnalysisRow = Omit<AddAnalysisRequest, 'user_id'>;
+
+export interface AddAnalysesRequest {
+  user_id: number;
+  analyses: AnalysisRow[];
+}
+
+export interface AddAnalysesResponse {
+  user_id: number;
+  count: number;
+  message: string;
+  status: string;
+}
+
 export interface AddAnalysisResponse {
   object_id: number;
   message: string;
@@ -65,6 +79,43 @@ export interface GetUserAnalysesResponse {
 export interface GetAllUserAnalysesResponse {
   analyses: AnalysisRecord[];
   count: number;
+  next_after: number | null;
+  has_more: boolean;
+  status: string;
+}
+
+export interface AnalysisSummary {
+  user_id: number;
+  image_name?: string;
+  total_classifications: number;
+  grade_counts: { [grade: string]: number };
+  weight_stats: { count: number; mean: number | null; min: number | null; max: number | null };
+  total_price_usd: number;
+}
+
+export interface GetAnalysisSummaryResponse {
+  group_by: 'user' | 'image';
+  summaries: AnalysisSummary[];
+  count: number;
+  status: string;
+}
+
+export interface GetAnalysesPageParams {
+  user_id?: number;
+  limit?: number;
+  after?: number | null;
+  fields?: (keyof AnalysisRecord)[];
+  grade?: string;
+  image_name?: string;
+  min_weight?: number;
+  max_weight?: number;
+}
+
+export interface GetAnalysesPageResponse {
+  analyses: AnalysisRecord[];
+  count: number;
+  next_after: number | null;
+  has_more: boolean;
   status: string;
 }
 
@@ -97,6 +148,35 @@ export const addAnalysis = async (
   }
 };
 
+/**
+ * Add a batch of analysis records for one user.
+ * The backend inserts the whole batch in a single transaction.
+ */
+export const addAnalyses = async (
+  batch: AddAnalysesRequest
+): Promise<AddAnalysesResponse> => {
+  try {
+    const response = await fetch(`${API_BASE_URL}/api/add-analyses`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify(batch),
+    });
+
+    if (!response.ok) {
+      const errorData = await response.json().catch(() => ({}));
+      throw new Error(errorData.detail || `HTTP error! status: ${response.status}`);
+    }
+
+    const data: AddAnalysesResponse = await response.json();
+    return data;
+  } catch (error) {
+    console.error('Error calling add-analyses:', error);
+    throw error;
+  }
+};
+
 /**
  * Get all analysis records associated with a specific user.
  * Returns a list of all analysis data for the given user_id.
@@ -130,12 +210,19 @@ export const getUserAnalyses = async (user_id: number): Promise<GetUserAnalysesR
 };
 
 /**
- * Get all analysis records from the database.
- * Returns a list of all analysis data for all users.
+ * Get one page of analysis records of all users, ordered by object_id.
+ * Pass the returned next_after as after to fetch the following page.
  */
-export const getAllUserAnalyses = async (): Promise<GetAllUserAnalysesResponse> => {
+export const getAllUserAnalyses = async (
+  after: number | null = null,
+  limit?: number
+): Promise<GetAllUserAnalysesResponse> => {
   try {
-    const response = await fetch(`${API_BASE_URL}/api/get-all-user-analyses`, {
+    const query = new URLSearchParams();
+    if (after !== null) query.set('after', String(after));
+    if (limit !== undefined) query.set('limit', String(limit));
+
+    const response = await fetch(`${API_BASE_URL}/api/get-all-user-analyses?${query.toString()}`, {
       method: 'GET',
       headers: {
         'Content-Type': 'application/json',
@@ -159,3 +246,89 @@ export const getAllUserAnalyses = async (): Promise<GetAllUserAnalysesResponse>
     throw error;
   }
 };
+
+/**
+ * Get one page of analysis records, ordered by object_id.
+ * Pass the returned next_after as after to fetch the following page.
+ */
+export const getAnalysesPage = async (
+  params: GetAnalysesPageParams = {}
+): Promise<GetAnalysesPageResponse> => {
+  try {
+    const query = new URLSearchParams();
+    Object.entries(params).forEach(([key, value]) => {
+      if (value === undefined || value === null) return;
+      query.set(key, Array.isArray(value) ? value.join(',') : String(value));
+    });
+
+    const response = await fetch(`${API_BASE_URL}/api/analyses?${query.toString()}`, {
+      method: 'GET',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+    });
+
+    if (!response.ok) {
+      const errorData = await response.json().catch(() => ({}));
+      throw new Error(errorData.detail || `HTTP error! status: ${response.status}`);
+    }
+
+    const data: GetAnalysesPageResponse = await response.json();
+    // Add 1 to object_id_in_image to match 1-based indexing in classified images
+    data.analyses = data.analyses.map(analysis => (
+      analysis.object_id_in_image === undefined ? analysis : {
+        ...analysis,
+        object_id_in_image: analysis.object_id_in_image + 1
+      }
+    ));
+    return data;
+  } catch (error) {
+    console.error('Error calling analyses:', error);
+    throw error;
+  }
+};
+
+/**
+ * URL that streams analysis records as a CSV, NDJSON or Parquet download.
+ * Leave user_id out to export every user's records.
+ */
+export const getAnalysesExportUrl = (
+  format: 'csv' | 'ndjson' | 'parquet',
+  user_id?: number
+): string => {
+  const query = new URLSearchParams({ format });
+  if (user_id !== undefined) query.set('user_id', String(user_id));
+  return `${API_BASE_URL}/api/analyses/export?${query.toString()}`;
+};
+
+/**
+ * Get grade counts, weight statistics and price totals per user or per image.
+ * Aggregated on the backend, so no analysis records are transferred.
+ */
+export const getAnalysisSummary = async (
+  group_by: 'user' | 'image' = 'user',
+  user_id?: number
+): Promise<GetAnalysisSummaryResponse> => {
+  try {
+    const query = new URLSearchParams({ group_by });
+    if (user_id !== undefined) query.set('user_id', String(user_id));
+
+    const response = await fetch(`${API_BASE_URL}/api/analyses/summary?${query.toString()}`, {
+      method: 'GET',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+    });
+
+    if (!response.ok) {
+      const errorData = await response.json().catch(() => ({}));
+      throw new Error(errorData.detail || `HTTP error! status: ${response.status}`);
+    }
+
+    const data: GetAnalysisSummaryResponse = await response.json();
+    return data;
+  } catch (error) {
+    console.error('Error calling analyses/summary:', error);
+    throw error;
+  }
+};
@@ -8,6 +8,7 @@ export interface GetOrCreateNameResponse {
   id: number;
   name: string;
   is_new_name: number;
+  workspace_token: string;
   status: string;
 }
 
@@ -15,6 +16,7 @@ export interface GetOrCreateNameResponse {
  * Get or create a user by name.
  * If the name exists, returns the existing user with is_new_name = 0.
  * If the name doesn't exist, creates it and returns is_new_name = 1.
+ * workspace_token grants access to the user's upload and output workspace.
  */
 export const getOrCreateName = async (name: string): Promise<GetOrCreateNameResponse> => {
   try {
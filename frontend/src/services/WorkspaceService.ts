@@ -0,0 +1,14 @@
+/**
+ * Query string identifying a user's workspace to the upload, classification
+ * and output endpoints: the user_id plus the workspace token handed out at
+ * sign-in (see getOrCreateName).
+ */
+export const workspaceQuery = (userId: number): string => {
+  let token = '';
+  try {
+    token = JSON.parse(localStorage.getItem('user') || '{}').workspace_token || '';
+  } catch {
+    token = '';
+  }
+  return `user_id=${userId}&token=${encodeURIComponent(token)}`;
+};